@@ -0,0 +1,96 @@
+"""
+Compare the sync and async OTP request paths against a local fake Sejam API.
+
+The sync path runs ``request_otp``/``get_profile`` on a thread pool, as a
+threaded WSGI worker would; the async path runs ``arequest_otp``/
+``aget_profile`` as concurrent tasks on one event loop, as an ASGI worker
+would. Usage:
+
+    python benchmarks/async_vs_sync.py --requests 500 --concurrency 10 50 200 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fake_sejam
+from common import HEADER, setup_django, summarize
+
+
+def run_sync(func, ids, concurrency):
+    from django.db import connection
+
+    def call(sh_id):
+        start = time.perf_counter()
+        try:
+            result = func(sh_id)
+        finally:
+            connection.close()
+        return time.perf_counter() - start, 'error' in result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, ids))
+    return results, time.perf_counter() - start
+
+
+def run_async(func, ids, concurrency):
+    from profiling.sejam_client import get_async_client
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(sh_id):
+            async with semaphore:
+                start = time.perf_counter()
+                result = await func(sh_id)
+                return time.perf_counter() - start, 'error' in result
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(call(sh_id) for sh_id in ids))
+        elapsed = time.perf_counter() - start
+        await get_async_client().aclose()
+        return results, elapsed
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--latency', type=float, default=0.05, help='fake upstream latency in seconds')
+    args = parser.parse_args()
+
+    server, port = fake_sejam.spawn(latency=args.latency)
+    setup_django(f"http://127.0.0.1:{port}")
+
+    from profiling.async_views import aget_profile, arequest_otp
+    from profiling.views import get_profile, get_valid_token, request_otp
+
+    # Warm the token cache so both paths start from the same state.
+    get_valid_token()
+
+    ids = [f"{i:010d}" for i in range(args.requests)]
+    scenarios = [
+        ('otp', request_otp, arequest_otp),
+        ('profile', lambda sh_id: get_profile(sh_id, '123456'),
+         lambda sh_id: aget_profile(sh_id, '123456')),
+    ]
+
+    print(f"upstream latency {args.latency * 1000:.0f} ms, {args.requests} requests per run")
+    print(HEADER)
+    for concurrency in args.concurrency:
+        for name, sync_func, async_func in scenarios:
+            for mode, runner, func in (('sync', run_sync, sync_func), ('async', run_async, async_func)):
+                results, elapsed = runner(func, ids, concurrency)
+                latencies = [latency for latency, _ in results]
+                errors = sum(failed for _, failed in results)
+                print(summarize(f"{name} {mode} c={concurrency}", latencies, elapsed, errors))
+
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()
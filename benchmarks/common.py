@@ -0,0 +1,59 @@
+"""Shared set-up for the benchmark scripts."""
+
+import os
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def setup_django(base_url):
+    """
+    Configure Django against a throwaway test database and the given API root.
+
+    Must be called before importing anything from ``profiling``.
+    """
+    sys.path.insert(0, str(ROOT))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sejam.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('SEJAM_API_USERNAME', 'benchmark')
+    os.environ.setdefault('SEJAM_API_PASSWORD', 'benchmark')
+    os.environ['SEJAM_API_BASE_URL'] = base_url
+    # Benchmarks should measure the code, not the retry policy.
+    os.environ.setdefault('SEJAM_HTTP_RETRIES', '0')
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    if connection.vendor == 'sqlite':
+        # The default in-memory test database locks whole tables under
+        # concurrent access; a file behaves like a real deployment.
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+
+def percentile(samples, pct):
+    """Return the ``pct`` percentile of ``samples`` (nearest-rank)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(label, latencies, elapsed, errors=0):
+    """Format one result row: label, throughput, errors and latency percentiles in ms."""
+    count = len(latencies)
+    return (
+        f"{label:<28} {count:>6} {errors:>6} {count / elapsed:>9.1f} "
+        f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+        f"{percentile(latencies, 99) * 1000:>8.1f} {statistics.fmean(latencies) * 1000:>8.1f}"
+    )
+
+
+HEADER = f"{'scenario':<28} {'reqs':>6} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'mean ms':>8}"
@@ -0,0 +1,249 @@
+"""
+Local stand-in for the Sejam API, used by the benchmarks.
+
+Implements ``/accessToken``, ``/kycOtp`` and
+``/servicesWithOtp/profiles/{id}`` with a configurable response latency,
+error rate and payload shape (share of legal persons, shareholders per
+legal person, padding). Run it on its own with:
+
+    python benchmarks/fake_sejam.py --port 8099 --latency 0.05 --error-rate 0.01 \
+        --legal-ratio 0.2 --shareholders 50
+
+and point ``SEJAM_API_BASE_URL`` at ``http://127.0.0.1:8099``.
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import threading
+import time
+import zlib
+from dataclasses import asdict, dataclass, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+PROFILE_PATH = '/servicesWithOtp/profiles/'
+
+SHAREHOLDER_POSITIONS = ['Chairman', 'ViceChairman', 'CEO', 'Member']
+
+
+@dataclass
+class FakeConfig:
+    """
+    Behaviour of the fake API.
+
+    Args:
+        latency (float): Seconds to wait before each response
+        error_rate (float): Share of OTP and profile calls answered with a 503
+        legal_ratio (float): Share of identifiers that are legal persons
+        shareholders (int): Shareholders per legal person
+        padding (int): Extra bytes added to each profile payload
+    """
+    latency: float = 0.0
+    error_rate: float = 0.0
+    legal_ratio: float = 0.0
+    shareholders: int = 5
+    padding: int = 0
+
+
+def private_person(sh_id):
+    """Build a Sejam profiles payload for a private person."""
+    return {
+        'uniqueIdentifier': sh_id,
+        'type': 'IranianPrivatePerson',
+        'mobile': '09120000000',
+        'email': 'user@example.com',
+        'privatePerson': {
+            'firstName': 'علی',
+            'lastName': 'رضایی',
+            'fatherName': 'محمد',
+            'gender': 'Male',
+            'birthDate': '1370-01-01',
+            'placeOfBirth': 'تهران',
+            'placeOfIssue': 'تهران',
+        },
+        'tradingCodes': [{'code': f'TC{sh_id[-6:]}'}],
+        'accounts': [{
+            'sheba': f'IR{sh_id.zfill(24)}',
+            'accountNumber': sh_id,
+            'branchCode': '123',
+            'branchName': 'مرکزی',
+            'bank': {'name': 'ملی'},
+            'branchCity': {'name': 'تهران'},
+        }],
+    }
+
+
+def legal_person(sh_id, shareholders=5):
+    """Build a Sejam profiles payload for a legal person with ``shareholders`` members."""
+    return {
+        'uniqueIdentifier': sh_id,
+        'type': 'IranianLegalPerson',
+        'mobile': '09120000000',
+        'email': 'info@example.com',
+        'legalPerson': {
+            'companyName': f'شرکت نمونه {sh_id}',
+            'economicCode': sh_id.zfill(12),
+            'registerDate': '1390-01-01',
+            'registerPlace': 'تهران',
+            'registerNumber': sh_id[-6:],
+        },
+        'legalPersonShareholders': [
+            {
+                'uniqueIdentifier': f'{sh_id[-6:]}{i:05d}',
+                'firstName': 'رضا',
+                'lastName': f'احمدی {i}',
+                'positionType': SHAREHOLDER_POSITIONS[i % len(SHAREHOLDER_POSITIONS)],
+            }
+            for i in range(shareholders)
+        ],
+        'tradingCodes': [{'code': f'TC{sh_id[-6:]}'}],
+        'accounts': [{
+            'sheba': f'IR{sh_id.zfill(24)}',
+            'accountNumber': sh_id,
+            'branchCode': '123',
+            'branchName': 'مرکزی',
+            'bank': {'name': 'ملت'},
+            'branchCity': {'name': 'تهران'},
+        }],
+    }
+
+
+def is_legal(sh_id, legal_ratio):
+    """Decide deterministically whether ``sh_id`` is served as a legal person."""
+    return zlib.crc32(sh_id.encode()) % 10000 < legal_ratio * 10000
+
+
+def build_profile(sh_id, config):
+    """Build the profiles payload for ``sh_id`` according to ``config``."""
+    if is_legal(sh_id, config.legal_ratio):
+        payload = legal_person(sh_id, config.shareholders)
+    else:
+        payload = private_person(sh_id)
+    if config.padding:
+        payload['padding'] = 'x' * config.padding
+    return payload
+
+
+class FakeSejamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _fail(self):
+        """Answer with a 503 for a ``error_rate`` share of calls."""
+        if self.server.config.error_rate and random.random() < self.server.config.error_rate:
+            self._send(503, {'error': {'customMessage': 'service unavailable'}})
+            return True
+        return False
+
+    def do_POST(self):
+        self._read_body()
+        time.sleep(self.server.config.latency)
+        path = urlsplit(self.path).path
+        if path == '/accessToken':
+            self._send(200, {'data': {'accessToken': 'fake-token', 'ttl': '01:00:00'}})
+        elif path == '/kycOtp':
+            if not self._fail():
+                self._send(200, {'data': True})
+        else:
+            self._send(404, {'error': {'customMessage': 'not found'}})
+
+    def do_GET(self):
+        time.sleep(self.server.config.latency)
+        path = urlsplit(self.path).path
+        if path.startswith(PROFILE_PATH):
+            if not self._fail():
+                self._send(200, {'data': build_profile(path[len(PROFILE_PATH):], self.server.config)})
+        else:
+            self._send(404, {'error': {'customMessage': 'not found'}})
+
+
+class FakeSejamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve(host='127.0.0.1', port=0, latency=0.0, **options):
+    """
+    Start the fake API in a background thread.
+
+    Args:
+        **options: Further ``FakeConfig`` fields
+
+    Returns:
+        FakeSejamServer: The running server; ``server_address`` holds the bound port
+    """
+    server = FakeSejamServer((host, port), FakeSejamHandler)
+    server.config = FakeConfig(latency=latency, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _serve_forever(queue, host, port, options):
+    server = serve(host, port, **options)
+    queue.put(server.server_address[1])
+    threading.Event().wait()
+
+
+def spawn(host='127.0.0.1', port=0, latency=0.0, **options):
+    """
+    Start the fake API in a child process so it does not share the GIL
+    with the code being measured.
+
+    Args:
+        **options: Further ``FakeConfig`` fields
+
+    Returns:
+        tuple: The ``multiprocessing.Process`` and the bound port
+    """
+    queue = multiprocessing.Queue()
+    options = asdict(FakeConfig(latency=latency, **options))
+    process = multiprocessing.Process(
+        target=_serve_forever, args=(queue, host, port, options), daemon=True
+    )
+    process.start()
+    return process, queue.get(timeout=10)
+
+
+def add_config_arguments(parser):
+    """Add the ``FakeConfig`` options to an ``argparse`` parser."""
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls answered with a 503')
+    parser.add_argument('--legal-ratio', type=float, default=0.0, help='share of ids that are legal persons')
+    parser.add_argument('--shareholders', type=int, default=5, help='shareholders per legal person')
+    parser.add_argument('--padding', type=int, default=0, help='extra bytes per profile payload')
+
+
+def config_from_args(args):
+    """Return the ``FakeConfig`` fields set by ``add_config_arguments``."""
+    return {field.name: getattr(args, field.name) for field in fields(FakeConfig)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = serve(args.host, args.port, **config_from_args(args))
+    print(f"Fake Sejam API listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,217 @@
+"""
+Load test of the OTP and profile endpoints against a local fake Sejam API.
+
+Requests go through the full Django stack (URL routing, middleware, DRF
+views, ORM) with the test client, one client per worker thread, or one
+event loop of ``AsyncClient`` requests with ``--async-views``. For each
+endpoint and concurrency level it reports latency percentiles,
+throughput, failed requests and database queries per request. Usage:
+
+    python benchmarks/load_test.py --requests 1000 --concurrency 10 50 \\
+        --latency 0.05 --error-rate 0.01 --legal-ratio 0.3 --shareholders 50
+
+``--save results.json`` stores the run; ``--compare results.json`` checks a
+later run against it and exits non-zero if p95 latency, throughput or
+queries per request regressed by more than ``--tolerance``.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fake_sejam
+from common import percentile, setup_django
+
+ENDPOINTS = {
+    'otp': '/otp/get_otp/{id}/',
+    'profile': '/otp/validate_otp/{id}/123456/',
+}
+
+HEADER = (
+    f"{'scenario':<20} {'reqs':>6} {'failed':>6} {'req/s':>9} {'p50 ms':>8} "
+    f"{'p95 ms':>8} {'p99 ms':>8} {'queries':>8}"
+)
+
+
+class QueryCounter:
+    """Count queries on every database connection, across threads."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+
+        def attach(sender, connection, **kwargs):
+            if self not in connection.execute_wrappers:
+                connection.execute_wrappers.append(self)
+
+        connection_created.connect(attach, weak=False)
+        for connection in connections.all():
+            attach(None, connection)
+
+
+def failed(response):
+    if response.status_code != 200:
+        return True
+    body = json.loads(response.content)
+    return 'error' in body or body.get('status', 200) != 200
+
+
+def run_sync(urls, concurrency):
+    from django.db import connection
+    from django.test import Client
+
+    local = threading.local()
+
+    def call(url):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = Client()
+        start = time.perf_counter()
+        try:
+            response = client.get(url)
+        finally:
+            connection.close()
+        return time.perf_counter() - start, failed(response)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, urls))
+    return results, time.perf_counter() - start
+
+
+def run_async(urls, concurrency):
+    from django.test import AsyncClient
+    from profiling.sejam_client import get_async_client
+
+    async def main():
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(url):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(url)
+                return time.perf_counter() - start, failed(response)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(call(url) for url in urls))
+        elapsed = time.perf_counter() - start
+        await get_async_client().aclose()
+        return results, elapsed
+
+    return asyncio.run(main())
+
+
+def measure(runner, urls, concurrency, counter):
+    queries_before = counter.count
+    results, elapsed = runner(urls, concurrency)
+    latencies = [latency for latency, _ in results]
+    return {
+        'requests': len(results),
+        'failed': sum(is_failed for _, is_failed in results),
+        'rps': len(results) / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'queries': (counter.count - queries_before) / len(results),
+    }
+
+
+def format_row(label, result):
+    return (
+        f"{label:<20} {result['requests']:>6} {result['failed']:>6} {result['rps']:>9.1f} "
+        f"{result['p50'] * 1000:>8.1f} {result['p95'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f} "
+        f"{result['queries']:>8.2f}"
+    )
+
+
+def regressions(results, baseline, tolerance):
+    """Yield a message for every metric that is worse than ``baseline`` by more than ``tolerance``."""
+    for label, result in results.items():
+        before = baseline.get(label)
+        if before is None:
+            continue
+        if result['p95'] > before['p95'] * (1 + tolerance):
+            yield f"{label}: p95 {before['p95'] * 1000:.1f} ms -> {result['p95'] * 1000:.1f} ms"
+        if result['rps'] < before['rps'] * (1 - tolerance):
+            yield f"{label}: req/s {before['rps']:.1f} -> {result['rps']:.1f}"
+        # Query counts are deterministic; any increase is a regression
+        if result['queries'] > before['queries'] + 0.01:
+            yield f"{label}: queries/request {before['queries']:.2f} -> {result['queries']:.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+    parser.add_argument('--async-views', action='store_true', help='serve the async views')
+    parser.add_argument('--repeat-ids', action='store_true',
+                        help='reuse the same ids in every run, so profiles are updates rather than inserts')
+    fake_sejam.add_config_arguments(parser)
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    args = parser.parse_args()
+
+    server, port = fake_sejam.spawn(**fake_sejam.config_from_args(args))
+    os.environ['SEJAM_ASYNC_VIEWS'] = str(args.async_views)
+    setup_django(f"http://127.0.0.1:{port}")
+
+    from rest_framework.throttling import SimpleRateThrottle
+    from profiling.views import get_valid_token
+
+    # The rate limits would reject all but the first requests
+    SimpleRateThrottle.THROTTLE_RATES = {scope: None for scope in SimpleRateThrottle.THROTTLE_RATES}
+    counter = QueryCounter()
+    counter.install()
+    get_valid_token()
+
+    runner = run_async if args.async_views else run_sync
+    results = {}
+    print(
+        f"upstream latency {args.latency * 1000:.0f} ms, error rate {args.error_rate:.1%}, "
+        f"legal persons {args.legal_ratio:.0%} with {args.shareholders} shareholders, "
+        f"{'async' if args.async_views else 'sync'} views"
+    )
+    print(HEADER)
+    run = 0
+    for concurrency in args.concurrency:
+        for endpoint in args.endpoints:
+            offset = 0 if args.repeat_ids else run * args.requests
+            urls = [ENDPOINTS[endpoint].format(id=f"{offset + i:010d}") for i in range(args.requests)]
+            label = f"{endpoint} c={concurrency}"
+            results[label] = measure(runner, urls, concurrency, counter)
+            print(format_row(label, results[label]))
+            run += 1
+
+    server.terminate()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            problems = list(regressions(results, json.load(f), args.tolerance))
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Micro-benchmarks for mapping Sejam payloads and building responses.
+
+Measures the per-payload cost of ``map_profile``, ``build_response`` and
+``payload_hash`` for a private person and for legal persons with growing
+numbers of shareholders. No database or network is involved. Usage:
+
+    python benchmarks/mapping.py --shareholders 5 50 500
+"""
+
+import argparse
+import timeit
+
+import fake_sejam
+from common import setup_django
+
+ROW = "{:<34} {:>12} {:>12}"
+
+
+def time_per_call(func, repeat=5):
+    """Return the best per-call time in microseconds over ``repeat`` runs."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--shareholders', type=int, nargs='+', default=[5, 50, 500])
+    args = parser.parse_args()
+
+    # No requests are made; the API root only has to be set
+    setup_django('http://127.0.0.1:9/')
+
+    from profiling.mapping import build_response, map_profile
+    from profiling.models import Profile
+    from profiling.views import payload_hash
+
+    payloads = [('private person', fake_sejam.private_person('0012345678'))]
+    payloads += [
+        (f'legal person, {count} shareholders', fake_sejam.legal_person('10100000001', count))
+        for count in args.shareholders
+    ]
+
+    print(ROW.format('payload', 'map µs', 'respond µs'), ' hash µs')
+    for label, payload in payloads:
+        fields, shareholders = map_profile(payload)
+        profile = Profile(unique_identifier=payload['uniqueIdentifier'], **fields)
+        mapping_cost = time_per_call(lambda: map_profile(payload))
+        response_cost = time_per_call(lambda: build_response(profile, shareholders))
+        hash_cost = time_per_call(lambda: payload_hash(payload))
+        print(ROW.format(label, f'{mapping_cost:.1f}', f'{response_cost:.1f}'), f'{hash_cost:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Storage and scan cost of Profile.raw_data, as JSON text versus compressed.
+
+Fills a throwaway database with fake profiles and reports the bytes the
+``raw_data`` column takes in the old JSON encoding and in the compressed
+one, and how long full-table scans take: the old column read and parsed
+for every row (what ``JSONField`` does on load), the compressed column read
+without decoding (loading profiles that never touch ``raw_data``), read
+and decoded, and whole ``Profile`` rows through the ORM. Usage:
+
+    python benchmarks/raw_data_storage.py --profiles 20000 --legal-ratio 0.3 --shareholders 20
+"""
+
+import argparse
+import json
+import time
+
+import fake_sejam
+from common import setup_django
+
+ROW = "{:<40} {:>10}"
+
+
+def timed(func, repeat=3):
+    """Return the best wall time of ``func`` in milliseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--profiles', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    fake_sejam.add_config_arguments(parser)
+    args = parser.parse_args()
+    config = fake_sejam.FakeConfig(**fake_sejam.config_from_args(args))
+
+    # No requests are made; the API root only has to be set
+    setup_django('http://127.0.0.1:9/')
+    from django.db import connection
+
+    from profiling.fields import decompress_json
+    from profiling.importer import ProfileImporter
+    from profiling.models import Profile
+
+    payloads = [fake_sejam.build_profile(str(10**9 + i), config) for i in range(args.profiles)]
+    importer = ProfileImporter(batch_size=args.batch_size)
+    for start in range(0, len(payloads), args.batch_size):
+        importer.import_batch(payloads[start:start + args.batch_size])
+
+    with connection.cursor() as cursor:
+        # The old column, encoded the way JSONField stores it
+        cursor.execute('CREATE TABLE bench_raw_json (unique_identifier varchar(20) PRIMARY KEY, raw_data text)')
+        cursor.executemany(
+            'INSERT INTO bench_raw_json VALUES (%s, %s)',
+            [(p['uniqueIdentifier'], json.dumps(p)) for p in payloads]
+        )
+        cursor.execute('SELECT SUM(LENGTH(CAST(raw_data AS BLOB))) FROM bench_raw_json')
+        json_bytes = cursor.fetchone()[0]
+        cursor.execute('SELECT SUM(LENGTH(raw_data)) FROM profiling_profile')
+        compressed_bytes = cursor.fetchone()[0]
+
+    def scan(sql, decode=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            for (value,) in cursor.fetchall():
+                if decode:
+                    decode(value)
+
+    print(f"{args.profiles} profiles, legal ratio {config.legal_ratio}, {config.shareholders} shareholders")
+    print(ROW.format('raw_data storage', 'MB'))
+    print(ROW.format('JSON text', f'{json_bytes / 1e6:.1f}'))
+    print(ROW.format('compressed', f'{compressed_bytes / 1e6:.1f}'))
+    print(ROW.format('ratio', f'{json_bytes / compressed_bytes:.1f}x'))
+    print()
+    print(ROW.format('full-table scan', 'ms'))
+    print(ROW.format('JSON text, parsed', f"{timed(lambda: scan('SELECT raw_data FROM bench_raw_json', json.loads)):.0f}"))
+    print(ROW.format('compressed, not decoded', f"{timed(lambda: scan('SELECT raw_data FROM profiling_profile')):.0f}"))
+    print(ROW.format('compressed, decoded', f"{timed(lambda: scan('SELECT raw_data FROM profiling_profile', decompress_json)):.0f}"))
+    print(ROW.format('Profile rows, raw_data untouched', f'{timed(lambda: list(Profile.objects.all())):.0f}'))
+    print(ROW.format('Profile rows, raw_data deferred', f"{timed(lambda: list(Profile.objects.defer('raw_data'))):.0f}"))
+    print(ROW.format('Profile rows, raw_data read', f'{timed(lambda: [p.raw_data for p in Profile.objects.all()]):.0f}'))
+
+
+if __name__ == '__main__':
+    main()
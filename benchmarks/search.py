@@ -0,0 +1,94 @@
+"""
+Latency of name search through the index versus ``icontains`` scans.
+
+Fills a throwaway database with fake profiles whose names are drawn from
+small pools of Persian first names, surnames and company words, then
+times the same queries against the ``SearchTerm`` index and against the
+LIKE scan the admin used to run over the name columns. Usage:
+
+    python benchmarks/search.py --profiles 50000 --legal-ratio 0.3 --shareholders 10
+"""
+
+import argparse
+import random
+import time
+
+import fake_sejam
+from common import percentile, setup_django
+
+FIRST_NAMES = ['علی', 'محمد', 'رضا', 'حسین', 'مریم', 'زهرا', 'فاطمه', 'سارا', 'نیما', 'کاوه']
+LAST_NAMES = ['احمدی', 'رضایی', 'کاظمی', 'نیک‌نام', 'حسینی', 'موسوی', 'کریمی', 'جعفری', 'صادقی', 'یزدانی']
+COMPANY_WORDS = ['صنایع', 'فولاد', 'تجارت', 'پارس', 'البرز', 'کیان', 'سپهر', 'آریا', 'نوین', 'گستر']
+QUERIES = ['علی', 'مریم کاظمی', 'نیكنام', 'رضا یزد', 'فولاد پارس', 'کاوه جعفری', 'سپ', 'ناشناس']
+
+
+def randomize(payload, rng):
+    """Give a fake payload and its shareholders random names."""
+    if 'privatePerson' in payload:
+        payload['privatePerson']['firstName'] = rng.choice(FIRST_NAMES)
+        payload['privatePerson']['lastName'] = rng.choice(LAST_NAMES)
+    else:
+        payload['legalPerson']['companyName'] = ' '.join(rng.sample(COMPANY_WORDS, 3))
+        for shareholder in payload['legalPersonShareholders']:
+            shareholder['firstName'] = rng.choice(FIRST_NAMES)
+            shareholder['lastName'] = rng.choice(LAST_NAMES)
+    return payload
+
+
+def timed(func, repeat):
+    """Return wall times of ``repeat`` calls to ``func`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--profiles', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    fake_sejam.add_config_arguments(parser)
+    args = parser.parse_args()
+    config = fake_sejam.FakeConfig(**fake_sejam.config_from_args(args))
+
+    # No requests are made; the API root only has to be set
+    setup_django('http://127.0.0.1:9/')
+    from django.db.models import Q
+
+    from profiling.importer import ProfileImporter
+    from profiling.models import Profile, SearchTerm
+    from profiling.search import search_profiles
+
+    rng = random.Random(0)
+    importer = ProfileImporter(batch_size=args.batch_size)
+    started = time.perf_counter()
+    for start in range(0, args.profiles, args.batch_size):
+        importer.import_batch([
+            randomize(fake_sejam.build_profile(str(10**9 + i), config), rng)
+            for i in range(start, min(start + args.batch_size, args.profiles))
+        ])
+    print(f"{args.profiles} profiles, {SearchTerm.objects.count()} search terms, "
+          f"imported in {time.perf_counter() - started:.1f}s")
+
+    def icontains(query):
+        condition = Q()
+        for word in query.split():
+            condition &= (Q(unique_identifier__icontains=word) | Q(first_name__icontains=word)
+                          | Q(last_name__icontains=word) | Q(company_name__icontains=word)
+                          | Q(mobile__icontains=word))
+        return list(Profile.objects.filter(condition).values_list('pk', flat=True)[:20])
+
+    print(f"{'query':<16} {'hits':>5} {'index p50':>10} {'index p95':>10} {'LIKE p50':>10}")
+    for query in QUERIES:
+        hits = len(search_profiles(query))
+        indexed = timed(lambda: search_profiles(query), args.repeat)
+        scanned = timed(lambda: icontains(query), max(args.repeat // 5, 1))
+        print(f"{query:<16} {hits:>5} {percentile(indexed, 50):>9.1f}ms "
+              f"{percentile(indexed, 95):>9.1f}ms {percentile(scanned, 50):>9.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,53 @@
 from django.contrib import admin
-from .models import AccessToken, Profile, Shareholder, ErrorLog
+from django.db.models import Q
+from .changes import mark_changed
+from .models import AccessToken, Account, Profile, Shareholder, TradingCode, ErrorLog
+from .search import index_profiles, matching_terms
+from .views import profile_document
 
 class ShareholderInline(admin.TabularInline):
     model = Shareholder
     extra = 0
 
+class AccountInline(admin.TabularInline):
+    model = Account
+    extra = 0
+
+class TradingCodeInline(admin.TabularInline):
+    model = TradingCode
+    extra = 0
+
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ['unique_identifier', 'person_type', 'get_name', 'mobile', 'created_at']
     list_filter = ['person_type', 'created_at']
-    search_fields = ['unique_identifier', 'first_name', 'last_name', 'company_name', 'mobile']
-    inlines = [ShareholderInline]
+    # Searched through the name index and exact identifiers; see get_search_results
+    search_fields = ['unique_identifier', 'mobile']
+    readonly_fields = ['payload_hash', 'response_data', 'raw_data']
+    inlines = [ShareholderInline, AccountInline, TradingCodeInline]
+    
+    def get_queryset(self, request):
+        # List pages never show the payload; the change form loads it on access
+        return super().get_queryset(request).defer('raw_data')
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Keep the stored response document in line with manual edits
+        profile = form.instance
+        profile.response_data = None
+        profile_document(profile)
+        index_profiles([(profile, list(profile.shareholders.all()), False)])
+        mark_changed(Profile, [profile.pk])
+    
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        condition = Q(pk=search_term) | Q(mobile=search_term)
+        matches = matching_terms(search_term)
+        if matches is not None:
+            condition |= Q(pk__in=matches.values('profile_id'))
+        return queryset.filter(condition), False
     
     def get_name(self, obj):
         if obj.person_type == 'IranianPrivatePerson':
@@ -26,6 +63,6 @@ class AccessTokenAdmin(admin.ModelAdmin):
 
 @admin.register(ErrorLog)
 class ErrorLogAdmin(admin.ModelAdmin):
-    list_display = ['timestamp', 'error_data']
-    readonly_fields = ['timestamp', 'error_data']
+    list_display = ['timestamp', 'last_seen', 'count', 'error_data']
+    readonly_fields = ['timestamp', 'last_seen', 'window_start', 'count', 'fingerprint', 'error_data']
     list_filter = ['timestamp']
\ No newline at end of file
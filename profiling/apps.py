@@ -4,3 +4,20 @@ from django.apps import AppConfig
 class ProfilingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'profiling'
+
+    def ready(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete
+
+        from .changes import record_tombstone
+        from .models import Profile
+        from .query_budget import install_execute_wrapper
+        from .request_profiler import install_execute_wrapper as install_profiler_wrapper
+
+        post_delete.connect(record_tombstone, sender=Profile, dispatch_uid='profiling.record_tombstone')
+        connection_created.connect(install_execute_wrapper, dispatch_uid='profiling.query_budget')
+        connection_created.connect(install_profiler_wrapper, dispatch_uid='profiling.request_profiler')
+        for connection in connections.all(initialized_only=True):
+            install_execute_wrapper(connection)
+            install_profiler_wrapper(connection)
@@ -0,0 +1,289 @@
+"""
+Async views for the profiling app.
+
+These mirror ``GetOTPView`` and ``ValidateOTPView`` for ASGI deployments.
+Upstream calls go through ``AsyncSejamClient`` and the ORM is reached via
+Django's async API, so a single worker can keep many Sejam requests in
+flight without tying up a thread for each one. Enable them with the
+``SEJAM_ASYNC_VIEWS`` setting.
+"""
+
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .error_sink import arecord_error
+from .metrics import stage_seconds
+from .sejam_client import ASYNC_TRANSPORT_ERRORS, SejamHTTPError, get_async_client
+from .throttling import AnonSlidingWindowThrottle, OTPIdentifierThrottle
+from .upstream_guard import UpstreamUnavailable
+from .views import aget_valid_token, is_invalid_otp, otp_coalescer, parse_batch_ids, persist_profile
+
+logger = logging.getLogger(__name__)
+
+
+async def arequest_otp(sh_id, token=None):
+    """
+    Async counterpart of ``request_otp``, coalescing duplicates the same way.
+
+    Args:
+        sh_id (str): The unique identifier for the user
+        token (str): Access token to use; looked up if not given
+
+    Returns:
+        dict: Response data with status information and ``coalesced``
+    """
+    return await otp_coalescer.arun(sh_id, lambda: asend_otp(sh_id, token))
+
+
+async def asend_otp(sh_id, token=None):
+    """
+    Async counterpart of ``send_otp``.
+
+    Args:
+        sh_id (str): The unique identifier for the user
+        token (str): Access token to use; looked up if not given
+
+    Returns:
+        dict: Response data with status information
+    """
+    if token is None:
+        with stage_seconds.time('otp', 'token'):
+            token = await aget_valid_token()
+
+    try:
+        with stage_seconds.time('otp', 'upstream'):
+            response = await get_async_client().request_otp(token, sh_id)
+        response.raise_for_status()
+        return {'id': sh_id, 'status': response.status_code}
+
+    except SejamHTTPError as e:
+        logger.error(f"HTTP error requesting OTP: {str(e)}")
+        await arecord_error(e.response.text)
+        return {'id': sh_id, 'status': e.response.status_code, 'error': str(e)}
+
+    except ASYNC_TRANSPORT_ERRORS as e:
+        logger.error(f"Error requesting OTP: {e!r}")
+        await arecord_error(repr(e))
+        return {'id': sh_id, 'status': 500, 'error': 'Connection error'}
+
+
+async def adispatch_otps(ids, concurrency, token):
+    """
+    Async counterpart of ``dispatch_otps``.
+
+    Args:
+        ids (list): Unique identifiers to send OTPs to
+        concurrency (int): Maximum number of upstream calls in flight
+        token (str): Access token used for every call
+
+    Yields:
+        dict: ``arequest_otp`` results in completion order
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(sh_id):
+        async with semaphore:
+            try:
+                return await arequest_otp(sh_id, token=token)
+            except UpstreamUnavailable as e:
+                return {'id': sh_id, 'status': 503, 'error': str(e)}
+            except Exception as e:
+                logger.error(f"Error requesting OTP for {sh_id}: {str(e)}")
+                return {'id': sh_id, 'status': 500, 'error': 'Something went wrong'}
+
+    tasks = [asyncio.ensure_future(send(sh_id)) for sh_id in ids]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Stop sending if the client goes away mid-stream
+        for task in tasks:
+            task.cancel()
+
+
+async def aget_profile(sh_id, otp_code):
+    """
+    Async counterpart of ``get_profile``.
+
+    Args:
+        sh_id (str): The unique identifier for the user
+        otp_code (str): The OTP code to validate
+
+    Returns:
+        dict: Structured profile data or error information
+    """
+    with stage_seconds.time('profile', 'token'):
+        token = await aget_valid_token()
+
+    try:
+        with stage_seconds.time('profile', 'upstream'):
+            response = await get_async_client().profile(token, sh_id, otp_code)
+            response.raise_for_status()
+            profile_data = response.json()['data']
+        # Storing a profile is several dependent queries; run them in one
+        # thread hop rather than one per query.
+        with stage_seconds.time('profile', 'store'):
+            return await sync_to_async(persist_profile)(profile_data)
+
+    except SejamHTTPError as e:
+        logger.error(f"HTTP error retrieving profile: {str(e)}")
+        await arecord_error(e.response.text)
+
+        if is_invalid_otp(e.response):
+            return {'error': 'invalid OTP'}
+
+        return {'error': 'Error retrieving profile data'}
+
+    except UpstreamUnavailable:
+        raise
+
+    except Exception as e:
+        logger.error(f"Error retrieving profile: {str(e)}")
+        await arecord_error(str(e))
+        return {'error': 'Something went wrong'}
+
+
+class AsyncAPIView(View):
+    """
+    Minimal async base view applying DRF authentication, permissions,
+    throttles and JSON rendering.
+
+    DRF's ``APIView`` is sync-only, so this keeps the behaviour clients see
+    (the configured authenticators, 401/403 and 429 bodies, ``Retry-After``,
+    unicode JSON) on async views.
+    """
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = []
+    throttle_classes = [AnonSlidingWindowThrottle]
+
+    async def dispatch(self, request, *args, **kwargs):
+        # Authentication, permissions and throttles touch the database and
+        # the cache, both of which may block, so they run off the loop.
+        rejected = await sync_to_async(self.check_request)(request)
+        if rejected is not None:
+            return rejected
+        return await super().dispatch(request, *args, **kwargs)
+
+    def check_request(self, request):
+        """Return an error response if the request is not allowed, else None."""
+        # Authenticate as APIView does, so that credentials accepted by the
+        # sync views (Basic auth included) are accepted here too
+        request = Request(request, authenticators=[auth() for auth in self.authentication_classes])
+        try:
+            # Session authentication also enforces CSRF here
+            request.user
+        except exceptions.APIException as e:
+            return self.denied(request, e)
+
+        for permission_class in self.permission_classes:
+            if not permission_class().has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    return self.denied(request, exceptions.NotAuthenticated())
+                return self.denied(request, exceptions.PermissionDenied())
+        return self.check_throttles(request)
+
+    def denied(self, request, error):
+        """401 or 403 response for an authentication or permission error, as APIView sends."""
+        response = self.render({'detail': str(error.detail)}, status=error.status_code)
+        if isinstance(error, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            authenticators = request.authenticators
+            header = authenticators[0].authenticate_header(request) if authenticators else None
+            if header:
+                response['WWW-Authenticate'] = header
+            else:
+                response.status_code = 403
+        return response
+
+    def check_throttles(self, request):
+        """Return a 429 response if any throttle rejects the request, else None."""
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not throttle.allow_request(request, self):
+                wait = throttle.wait()
+                detail = 'Request was throttled.'
+                if wait is not None:
+                    detail += f' Expected available in {int(wait)} seconds.'
+                response = self.render({'detail': detail}, status=429)
+                if wait is not None:
+                    response['Retry-After'] = str(int(wait))
+                return response
+        return None
+
+    def unavailable(self, error):
+        """503 response matching ``views.unavailable_response``."""
+        response = self.render(
+            {'error': 'Sejam service unavailable', 'retry_after': error.retry_after}, status=503
+        )
+        response['Retry-After'] = str(error.retry_after)
+        return response
+
+    def render(self, data, status=200):
+        # Same output as DRF's JSONRenderer: compact, non-ASCII left as is
+        return JsonResponse(
+            data, status=status, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')}
+        )
+
+
+class AsyncGetOTPView(AsyncAPIView):
+    """Async API view to request an OTP for a user."""
+    throttle_classes = [AnonSlidingWindowThrottle, OTPIdentifierThrottle]
+
+    async def get(self, request, sh_id):
+        try:
+            with stage_seconds.time('otp', 'total'):
+                data = await arequest_otp(str(sh_id))
+        except UpstreamUnavailable as e:
+            return self.unavailable(e)
+        return self.render(data)
+
+
+class AsyncBatchOTPView(AsyncAPIView):
+    """Async API view to send OTPs to many users at once."""
+    permission_classes = [IsAdminUser]
+    throttle_classes = []
+
+    async def post(self, request):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return self.render({'error': 'Invalid JSON body'}, status=400)
+
+        ids, concurrency, error = parse_batch_ids(data)
+        if error:
+            return self.render({'error': error}, status=400)
+
+        # Before the response starts, so a failure still gets an error status
+        try:
+            token = await aget_valid_token()
+        except UpstreamUnavailable as e:
+            return self.unavailable(e)
+        except Exception as e:
+            logger.error(f"Error getting access token for batch OTP: {str(e)}")
+            return self.render({'error': 'Something went wrong'}, status=500)
+
+        async def lines():
+            async for result in adispatch_otps(ids, concurrency, token):
+                yield json.dumps(result, ensure_ascii=False) + '\n'
+
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+
+class AsyncValidateOTPView(AsyncAPIView):
+    """Async API view to validate an OTP and retrieve user profile."""
+
+    async def get(self, request, sh_id, otpCode):
+        try:
+            with stage_seconds.time('profile', 'total'):
+                data = await aget_profile(str(sh_id), str(otpCode))
+        except UpstreamUnavailable as e:
+            return self.unavailable(e)
+        return self.render(data)
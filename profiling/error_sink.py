@@ -0,0 +1,217 @@
+"""
+Buffered recording of upstream errors to ``ErrorLog``.
+
+``record_error`` only touches an in-memory buffer, so it is cheap to call on
+the request path (and from async code). Identical errors within the same
+time window are folded into one entry with a counter, and a background
+thread flushes the buffer to the database in batches. During an upstream
+outage this turns one INSERT per failed request into one row per distinct
+error per window.
+"""
+
+import atexit
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from . import metrics
+from .models import ErrorLog
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingError:
+    """An error waiting to be flushed, with its occurrence count."""
+    error_data: str
+    fingerprint: str
+    window_start: float
+    last_seen: float
+    count: int = 1
+
+
+def _to_datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+
+
+def fingerprint(error_data):
+    """Return a stable identifier for identical error texts."""
+    return hashlib.sha1(error_data.encode('utf-8', 'replace')).hexdigest()
+
+
+class ErrorSink:
+    """
+    In-memory error buffer flushed to ``ErrorLog`` by a background thread.
+
+    Args:
+        flush_interval (float): Seconds between background flushes
+        window (int): Seconds per deduplication window
+        max_pending (int): Maximum distinct errors buffered between flushes;
+            further distinct errors are dropped (and counted) until the next flush
+    """
+
+    def __init__(self, flush_interval=None, window=None, max_pending=None):
+        self.flush_interval = flush_interval or settings.SEJAM_ERROR_LOG_FLUSH_INTERVAL
+        self.window = window or settings.SEJAM_ERROR_LOG_WINDOW
+        self.max_pending = max_pending or settings.SEJAM_ERROR_LOG_MAX_PENDING
+        self.dropped = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def record(self, error_data):
+        """
+        Buffer one occurrence of an error.
+
+        Args:
+            error_data (str): The error text, typically an upstream response body
+        """
+        error_data = str(error_data)
+        metrics.errors_recorded.inc()
+        if not settings.SEJAM_ERROR_LOG_BUFFERED:
+            ErrorLog.objects.create(
+                error_data=error_data,
+                fingerprint=fingerprint(error_data),
+                last_seen=_to_datetime(time.time()),
+            )
+            return
+
+        self._ensure_thread()
+        now = time.time()
+        fp = fingerprint(error_data)
+        window_start = now - now % self.window
+        with self._lock:
+            entry = self._pending.get((fp, window_start))
+            if entry is not None:
+                entry.count += 1
+                entry.last_seen = now
+            elif len(self._pending) >= self.max_pending:
+                self.dropped += 1
+            else:
+                self._pending[fp, window_start] = PendingError(error_data, fp, window_start, now)
+
+    def flush(self):
+        """
+        Write buffered errors to the database.
+
+        Entries whose (fingerprint, window) already has a row, from an earlier
+        flush or another worker's, are added to that row's count instead of
+        creating a new one.
+
+        Returns:
+            int: Number of distinct errors written
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                logger.warning(f"Error log buffer full, dropped {dropped} distinct errors")
+            if not pending:
+                return 0
+
+            try:
+                self._write(pending)
+            except Exception:
+                # Keep the errors for the next flush rather than losing them
+                self._restore(pending)
+                raise
+            return len(pending)
+
+    def _write(self, pending):
+        # Every worker flushes the same outage's errors at about the same
+        # time, so rows are created without counts and then incremented in
+        # the database: concurrent flushes neither duplicate rows (the
+        # fingerprint and window are unique) nor overwrite each other's counts.
+        with transaction.atomic():
+            ErrorLog.objects.bulk_create(
+                [
+                    ErrorLog(
+                        error_data=entry.error_data,
+                        fingerprint=entry.fingerprint,
+                        window_start=_to_datetime(entry.window_start),
+                        last_seen=_to_datetime(entry.last_seen),
+                        count=0,
+                    )
+                    for entry in pending.values()
+                ],
+                ignore_conflicts=True,
+            )
+            for entry in pending.values():
+                last_seen = _to_datetime(entry.last_seen)
+                ErrorLog.objects.filter(
+                    fingerprint=entry.fingerprint, window_start=_to_datetime(entry.window_start)
+                ).update(count=F('count') + entry.count, last_seen=Greatest('last_seen', Value(last_seen)))
+
+    def _restore(self, pending):
+        with self._lock:
+            for key, entry in pending.items():
+                current = self._pending.get(key)
+                if current is not None:
+                    current.count += entry.count
+                    current.last_seen = max(current.last_seen, entry.last_seen)
+                elif len(self._pending) < self.max_pending:
+                    self._pending[key] = entry
+                else:
+                    self.dropped += 1
+
+    def _ensure_thread(self):
+        # Threads do not survive fork; a forked worker starts its own and
+        # does not re-flush what it inherited from the parent.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self._pending = {}
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='error-log-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush error log buffer")
+            finally:
+                connection.close()
+
+    def stop(self):
+        """Stop the background thread and flush what is left."""
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to flush error log buffer on shutdown")
+
+
+error_sink = ErrorSink()
+atexit.register(error_sink.stop)
+
+
+def record_error(error_data):
+    """Record an upstream error via the process-wide ``ErrorSink``."""
+    error_sink.record(error_data)
+
+
+async def arecord_error(error_data):
+    """Async counterpart of ``record_error``; never blocks when buffering is on."""
+    if settings.SEJAM_ERROR_LOG_BUFFERED:
+        error_sink.record(error_data)
+    else:
+        await sync_to_async(error_sink.record)(error_data)
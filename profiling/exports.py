@@ -0,0 +1,186 @@
+"""
+Streaming exports of profiles and shareholders.
+
+Rows are read in fixed-size pages using keyset pagination, so neither the
+database nor this process ever holds more than one page, and are encoded as
+CSV or NDJSON one row at a time. Memory use is the same for ten thousand
+profiles as for ten million.
+"""
+
+import csv
+import datetime
+import json
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Profile, Shareholder
+
+PROFILE_FIELDS = [
+    'unique_identifier', 'person_type', 'mobile', 'email',
+    'first_name', 'last_name', 'father_name', 'gender', 'birth_date',
+    'place_of_birth', 'place_of_issue',
+    'company_name', 'economic_code', 'register_date', 'register_place', 'register_number',
+    'trade_code', 'sheba', 'bank_name', 'bank_branch_code', 'bank_branch_name',
+    'bank_branch_city', 'bank_account_number',
+    'created_at', 'updated_at',
+]
+
+SHAREHOLDER_FIELDS = [
+    'id', 'profile_id', 'unique_identifier', 'first_name', 'last_name', 'position',
+]
+
+EXPORT_KINDS = ('profiles', 'shareholders')
+EXPORT_FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+DEFAULT_BATCH_SIZE = 2000
+
+
+def parse_timestamp(value):
+    """
+    Parse an ISO date or datetime filter value into an aware datetime.
+
+    Args:
+        value (str): e.g. ``2024-01-31`` or ``2024-01-31T12:00:00+03:30``
+
+    Returns:
+        datetime.datetime: The parsed value, or None if ``value`` is empty
+
+    Raises:
+        ValueError: If the value is not a valid date or datetime
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f"Invalid date or datetime: {value!r}")
+        parsed = datetime.datetime.combine(date, datetime.time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def profile_filter(person_type=None, updated_from=None, updated_to=None, prefix=''):
+    """
+    Build the export filter for profiles.
+
+    ``updated_from`` is inclusive and ``updated_to`` exclusive. ``prefix``
+    lets the same filter apply through a relation, e.g. ``'profile__'``.
+    """
+    q = Q()
+    if person_type:
+        q &= Q(**{f'{prefix}person_type': person_type})
+    if updated_from:
+        q &= Q(**{f'{prefix}updated_at__gte': updated_from})
+    if updated_to:
+        q &= Q(**{f'{prefix}updated_at__lt': updated_to})
+    return q
+
+
+def iter_profiles(batch_size=DEFAULT_BATCH_SIZE, **filters):
+    """
+    Yield profile rows as dicts, ordered by ``(updated_at, unique_identifier)``.
+
+    Args:
+        batch_size (int): Rows fetched per query
+        **filters: ``person_type``, ``updated_from`` and ``updated_to``
+
+    Yields:
+        dict: One row per profile with the ``PROFILE_FIELDS`` columns
+    """
+    queryset = Profile.objects.filter(profile_filter(**filters)).order_by('updated_at', 'unique_identifier')
+    last = None
+    while True:
+        page = queryset
+        if last is not None:
+            page = page.filter(
+                Q(updated_at__gt=last['updated_at']) |
+                Q(updated_at=last['updated_at'], unique_identifier__gt=last['unique_identifier'])
+            )
+        rows = list(page.values(*PROFILE_FIELDS)[:batch_size])
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]
+
+
+def iter_shareholders(batch_size=DEFAULT_BATCH_SIZE, **filters):
+    """
+    Yield shareholder rows as dicts, ordered by id, for profiles matching the filters.
+
+    Args:
+        batch_size (int): Rows fetched per query
+        **filters: ``person_type``, ``updated_from`` and ``updated_to``
+
+    Yields:
+        dict: One row per shareholder with the ``SHAREHOLDER_FIELDS`` columns
+    """
+    queryset = Shareholder.objects.filter(profile_filter(prefix='profile__', **filters)).order_by('id')
+    last_id = None
+    while True:
+        page = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        rows = list(page.values(*SHAREHOLDER_FIELDS)[:batch_size])
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['id']
+
+
+class _Echo:
+    """File-like object whose ``write`` returns the value, for ``csv.writer``."""
+
+    def write(self, value):
+        return value
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def encode_csv(rows, fields):
+    """Yield a CSV header line followed by one line per row."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([_encode_value(row[field]) for field in fields])
+
+
+def encode_ndjson(rows, fields):
+    """Yield one JSON document per row, each on its own line."""
+    for row in rows:
+        yield json.dumps(
+            {field: _encode_value(row[field]) for field in fields}, ensure_ascii=False
+        ) + '\n'
+
+
+def export(kind='profiles', format='csv', batch_size=DEFAULT_BATCH_SIZE, **filters):
+    """
+    Stream an export as encoded text chunks.
+
+    Args:
+        kind (str): ``profiles`` or ``shareholders``
+        format (str): ``csv`` or ``ndjson``
+        batch_size (int): Rows fetched per query
+        **filters: ``person_type``, ``updated_from`` and ``updated_to``
+
+    Returns:
+        iterator: Lines of output
+    """
+    if kind not in EXPORT_KINDS:
+        raise ValueError(f"Unknown export kind: {kind!r}")
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {format!r}")
+
+    if kind == 'profiles':
+        rows, fields = iter_profiles(batch_size, **filters), PROFILE_FIELDS
+    else:
+        rows, fields = iter_shareholders(batch_size, **filters), SHAREHOLDER_FIELDS
+
+    encoder = encode_csv if format == 'csv' else encode_ndjson
+    return encoder(rows, fields)
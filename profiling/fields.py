@@ -0,0 +1,89 @@
+"""
+Model fields for the profiling app.
+
+``CompressedJSONField`` stores a JSON document as zlib-compressed UTF-8
+in a binary column. Sejam payloads are mostly repeated keys and Persian
+text, which compress to a fraction of their JSON size. Rows loaded from
+the database keep the compressed bytes and only decompress and parse
+them the first time the attribute is read, so queries that never touch
+the document pay for neither. A document that was loaded but not
+modified is written back as the same bytes, without re-encoding.
+"""
+
+import json
+import zlib
+
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+COMPRESSION_LEVEL = 6
+
+
+class Compressed(bytes):
+    """Encoded document as read from the database, not yet decoded."""
+
+
+def compress_json(value):
+    """Encode ``value`` as compressed JSON."""
+    encoded = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return zlib.compress(encoded, COMPRESSION_LEVEL)
+
+
+def decompress_json(data):
+    """Decode bytes produced by ``compress_json``."""
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+class CompressedJSONAttribute(DeferredAttribute):
+    """Decodes the stored bytes on first access and keeps the result."""
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, Compressed):
+            value = instance.__dict__[self.field.attname] = decompress_json(value)
+        return value
+
+    def __set__(self, instance, value):
+        # Defining __set__ makes this a data descriptor, so __get__ runs even
+        # once the value is in the instance dict
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedJSONField(models.BinaryField):
+    """A JSON document stored compressed and decoded lazily."""
+    descriptor_class = CompressedJSONAttribute
+
+    def __init__(self, *args, **kwargs):
+        # BinaryField is not editable by default; documents are data, not input
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return Compressed(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress_json(bytes(value))
+        if isinstance(value, str):
+            # Serialized by value_to_string, e.g. in a fixture
+            return json.loads(value)
+        return value
+
+    def pre_save(self, model_instance, add):
+        # Read around the descriptor so an untouched document is not decoded
+        # only to be encoded again
+        if self.attname in model_instance.__dict__:
+            return model_instance.__dict__[self.attname]
+        return super().pre_save(model_instance, add)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return None
+        if not isinstance(value, Compressed):
+            value = compress_json(value)
+        return connection.Database.Binary(value)
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj), ensure_ascii=False)
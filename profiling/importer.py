@@ -0,0 +1,183 @@
+"""
+Bulk import of archived Sejam profile payloads.
+
+Reads newline-delimited JSON where each line is either a bare profiles
+``data`` object, a full API response (``{"data": {...}}``) or a document
+exported from the old MongoDB ``profile`` collection (``{"id": ..., "data":
+{...}}``). Payloads are mapped with the same rules as the live
+``get_profile`` path and written in batches with ``bulk_create`` and
+``bulk_update``; unchanged payloads cause no writes.
+"""
+
+import gzip
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.utils import timezone
+
+from .changes import mark_changed
+from .models import Profile
+from .search import index_profiles
+from .mapping import build_response, map_profile
+from .views import apply_profile_fields, map_holdings, payload_hash, sync_holdings, sync_many_shareholders
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+@dataclass
+class ImportStats:
+    """Running totals for an import."""
+    lines: int = 0
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def rate(self):
+        """Lines processed per second so far."""
+        elapsed = time.monotonic() - self.started
+        return self.lines / elapsed if elapsed > 0 else 0.0
+
+
+def open_dump(path):
+    """Open an NDJSON dump for reading, transparently decompressing ``.gz`` files."""
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def extract_payload(document):
+    """Return the profiles ``data`` object from one dump line's document."""
+    if not isinstance(document, dict):
+        raise ValueError("expected a JSON object")
+    data = document.get('data')
+    if isinstance(data, dict) and 'uniqueIdentifier' in data:
+        return data
+    return document
+
+
+class ProfileImporter:
+    """
+    Import profile payloads in batches.
+
+    Args:
+        batch_size (int): Payloads written per transaction
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.stats = ImportStats()
+
+    def run(self, lines, offset=0):
+        """
+        Import payloads from an iterable of NDJSON lines.
+
+        Args:
+            lines (iterable): Lines of the dump
+            offset (int): Number of leading lines to skip, to resume an import
+
+        Yields:
+            int: The offset to resume from after each committed batch
+        """
+        batch = []
+        position = 0
+        for position, line in enumerate(lines, start=1):
+            if position <= offset or not line.strip():
+                continue
+            try:
+                batch.append(extract_payload(json.loads(line)))
+            except ValueError as e:
+                logger.error(f"Line {position}: invalid payload ({e})")
+                self.stats.failed += 1
+            self.stats.lines += 1
+
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+                yield position
+
+        if batch:
+            self.import_batch(batch)
+        yield max(position, offset)
+
+    def import_batch(self, payloads):
+        """
+        Write one batch of payloads in a single transaction.
+
+        Payloads that cannot be mapped are logged and skipped.
+
+        Returns:
+            dict: The error each skipped payload raised, by its position in
+                ``payloads``
+        """
+        mapped = {}
+        skipped = {}
+        for position, payload in enumerate(payloads):
+            try:
+                unique_identifier = payload['uniqueIdentifier']
+                if not isinstance(unique_identifier, str) or not unique_identifier:
+                    raise TypeError(f"uniqueIdentifier must be a non-empty string, not {unique_identifier!r}")
+                fields, shareholders = map_profile(payload)
+                holdings = map_holdings(payload)
+                fields['payload_hash'] = payload_hash(payload)
+            except (KeyError, TypeError, AttributeError) as e:
+                identifier = payload.get('uniqueIdentifier') if isinstance(payload, dict) else None
+                logger.error(f"Skipping unmappable payload {identifier!r}: {e!r}")
+                self.stats.failed += 1
+                skipped[position] = e
+                continue
+            # Later lines are newer snapshots of the same profile
+            mapped[unique_identifier] = (fields, shareholders, holdings)
+
+        with transaction.atomic():
+            existing = Profile.objects.defer('raw_data').in_bulk(list(mapped))
+            to_create = []
+            to_update = []
+            update_fields = set()
+            shareholder_entries = []
+            holding_entries = []
+            search_entries = []
+            now = timezone.now()
+
+            for unique_identifier, (fields, shareholders, holdings) in mapped.items():
+                profile = existing.get(unique_identifier)
+                if profile is None:
+                    profile = Profile(unique_identifier=unique_identifier, **fields)
+                    to_create.append(profile)
+                elif profile.payload_hash == fields['payload_hash']:
+                    self.stats.unchanged += 1
+                    continue
+                else:
+                    update_fields.update(apply_profile_fields(profile, fields))
+                    # bulk_update does not apply auto_now
+                    profile.updated_at = now
+                    to_update.append(profile)
+                profile.response_data = build_response(profile, shareholders)
+                created = unique_identifier not in existing
+                if shareholders is not None:
+                    shareholder_entries.append((profile, shareholders, created))
+                holding_entries.append((profile, holdings, created))
+                search_entries.append((profile, shareholders, created))
+
+            if to_create:
+                Profile.objects.bulk_create(to_create)
+            if to_update:
+                Profile.objects.bulk_update(to_update, sorted(update_fields) + ['response_data', 'updated_at'])
+            if shareholder_entries:
+                sync_many_shareholders(shareholder_entries)
+            if holding_entries:
+                sync_holdings(holding_entries)
+            if search_entries:
+                index_profiles(search_entries)
+            mark_changed(Profile, [profile.pk for profile in to_create + to_update])
+
+        self.stats.created += len(to_create)
+        self.stats.updated += len(to_update)
+        return skipped
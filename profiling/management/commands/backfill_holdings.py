@@ -0,0 +1,40 @@
+"""
+Fill the Account and TradingCode tables from stored profile payloads.
+
+Profiles written before these tables existed only have their accounts and
+trading codes inside ``raw_data``. Safe to re-run: rows are synced by diff.
+
+Example:
+    python manage.py backfill_holdings --batch-size 1000
+"""
+
+from django.core.management.base import BaseCommand
+
+from profiling.models import Profile
+from profiling.views import map_holdings, sync_holdings
+
+
+class Command(BaseCommand):
+    help = "Populate accounts and trading codes of stored profiles from their raw payloads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.only('unique_identifier', 'raw_data').order_by('pk')
+        last = None
+        total = 0
+
+        # Keyset pagination keeps every batch an index range scan
+        while True:
+            batch = profiles.filter(pk__gt=last) if last is not None else profiles
+            batch = list(batch[:options['batch_size']])
+            if not batch:
+                break
+            sync_holdings([
+                (profile, map_holdings(profile.raw_data or {}), False) for profile in batch
+            ])
+            total += len(batch)
+            last = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Synced accounts and trading codes of {total} profiles"))
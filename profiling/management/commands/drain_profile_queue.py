@@ -0,0 +1,56 @@
+"""
+Write queued profiles to the database in batches.
+
+Run with ``--loop`` as one or more long-running worker processes when
+SEJAM_PROFILE_WRITE_MODE is 'queue'; without it, drains what is queued
+and exits.
+
+Example:
+    python manage.py drain_profile_queue --loop --batch-size 500
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from profiling.profile_queue import drain, queue_stats
+
+
+class Command(BaseCommand):
+    help = "Apply queued profile writes, a batch at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep draining until interrupted")
+        parser.add_argument('--batch-size', type=int, default=settings.SEJAM_PROFILE_QUEUE_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to wait when the queue is empty")
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                try:
+                    written = drain(options['batch_size'])
+                except Exception as e:
+                    # Failed payloads are handled by drain; this is the
+                    # queue itself being unreachable
+                    self.stderr.write(f"Draining the profile queue failed: {e!r}")
+                    if not options['loop']:
+                        raise
+                    written = 0
+                total += written
+                if written:
+                    continue
+                if not options['loop']:
+                    break
+                # Do not hold a database connection open while idle
+                connection.close()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        depth, lag, dead = queue_stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"Drained {total} queued profiles; {depth} waiting, oldest {lag:.1f}s, {dead} dead"
+        ))
@@ -0,0 +1,43 @@
+"""
+Export profiles or shareholders as CSV or NDJSON.
+
+Example:
+    python manage.py export_profiles --kind profiles --format ndjson \
+        --person-type IranianLegalPerson --updated-from 2024-01-01 -o legal.ndjson
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from profiling.exports import DEFAULT_BATCH_SIZE, EXPORT_FORMATS, EXPORT_KINDS, export, parse_timestamp
+from profiling.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Stream profiles or shareholders to a CSV or NDJSON file with constant memory use."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=EXPORT_KINDS, default='profiles')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--person-type', choices=[c[0] for c in Profile.PERSON_TYPE_CHOICES])
+        parser.add_argument('--updated-from', help="Inclusive lower bound on updated_at (ISO date or datetime)")
+        parser.add_argument('--updated-to', help="Exclusive upper bound on updated_at (ISO date or datetime)")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('-o', '--output', help="Output file (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            filters = {
+                'person_type': options['person_type'],
+                'updated_from': parse_timestamp(options['updated_from']),
+                'updated_to': parse_timestamp(options['updated_to']),
+            }
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        chunks = export(options['kind'], options['format'], options['batch_size'], **filters)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,38 @@
+"""
+Import archived Sejam profile payloads from an NDJSON dump.
+
+Example:
+    python manage.py import_profiles profiles.ndjson.gz --batch-size 1000
+    python manage.py import_profiles profiles.ndjson.gz --offset 250000
+"""
+
+from django.core.management.base import BaseCommand
+
+from profiling.importer import DEFAULT_BATCH_SIZE, ProfileImporter, open_dump
+
+
+class Command(BaseCommand):
+    help = "Bulk-load Sejam profile payloads (one JSON document per line) into Profile and Shareholder."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file, optionally gzip-compressed (.gz)")
+        parser.add_argument('--offset', type=int, default=0, help="Skip this many lines, to resume an import")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        importer = ProfileImporter(batch_size=options['batch_size'])
+        stats = importer.stats
+        offset = options['offset']
+
+        with open_dump(options['path']) as lines:
+            for offset in importer.run(lines, offset=offset):
+                self.stderr.write(
+                    f"offset {offset}: {stats.created} created, {stats.updated} updated, "
+                    f"{stats.unchanged} unchanged, {stats.failed} failed ({stats.rate:.0f} rows/s)"
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats.lines} lines at {stats.rate:.0f} rows/s: {stats.created} created, "
+            f"{stats.updated} updated, {stats.unchanged} unchanged, {stats.failed} failed. "
+            f"Resume with --offset {offset}."
+        ))
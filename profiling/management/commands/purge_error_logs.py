@@ -0,0 +1,40 @@
+"""
+Delete old ErrorLog rows in batches.
+
+Example:
+    python manage.py purge_error_logs --days 30 --batch-size 5000
+"""
+
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from profiling.models import ErrorLog
+
+
+class Command(BaseCommand):
+    help = "Delete error logs older than the retention period, a batch at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.SEJAM_ERROR_LOG_RETENTION_DAYS,
+            help="Keep errors seen within this many days (default: SEJAM_ERROR_LOG_RETENTION_DAYS)"
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        old = ErrorLog.objects.filter(timestamp__lt=cutoff).order_by('pk')
+        total = 0
+
+        # Short DELETEs keep locks brief while the table is still being written to
+        while True:
+            ids = list(old.values_list('pk', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted, _ = ErrorLog.objects.filter(pk__in=ids).delete()
+            total += deleted
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {total} error logs older than {cutoff:%Y-%m-%d %H:%M}"))
@@ -0,0 +1,45 @@
+"""
+Build the name search index for stored profiles.
+
+Needed once for profiles written before the index existed, and after
+changing the normalization rules. Safe to re-run: terms are synced by diff.
+
+Example:
+    python manage.py rebuild_search_index --batch-size 1000
+"""
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from profiling.models import Profile, Shareholder
+from profiling.search import index_profiles
+
+
+class Command(BaseCommand):
+    help = "Index the names of stored profiles and their shareholders for search."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.only(
+            'unique_identifier', 'person_type', 'first_name', 'last_name', 'company_name'
+        ).prefetch_related(
+            Prefetch('shareholders', queryset=Shareholder.objects.only('profile_id', 'first_name', 'last_name'))
+        ).order_by('pk')
+        last = None
+        total = 0
+
+        # Keyset pagination keeps every batch an index range scan
+        while True:
+            batch = profiles.filter(pk__gt=last) if last is not None else profiles
+            batch = list(batch[:options['batch_size']])
+            if not batch:
+                break
+            index_profiles([
+                (profile, profile.shareholders.all(), False) for profile in batch
+            ])
+            total += len(batch)
+            last = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed the names of {total} profiles"))
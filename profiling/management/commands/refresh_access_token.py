@@ -0,0 +1,34 @@
+"""
+Renew the Sejam access token ahead of its expiry.
+
+Run once (e.g. from cron) or with ``--loop`` as a long-running process,
+typically alongside workers started with SEJAM_TOKEN_BACKGROUND_REFRESH=False.
+
+Example:
+    python manage.py refresh_access_token --loop
+"""
+
+import threading
+
+from django.core.management.base import BaseCommand
+
+from profiling.views import token_cache
+
+
+class Command(BaseCommand):
+    help = "Renew the Sejam access token if it expires within SEJAM_TOKEN_REFRESH_AHEAD seconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep renewing until interrupted")
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            self.stdout.write(f"Renewing the access token {token_cache.refresh_ahead}s before expiry")
+            try:
+                token_cache.run_refresher(threading.Event())
+            except KeyboardInterrupt:
+                pass
+            return
+
+        due_in = token_cache.refresh_if_due()
+        self.stdout.write(self.style.SUCCESS(f"Access token valid; next renewal due in {int(due_in)}s"))
@@ -0,0 +1,71 @@
+"""
+Aggregate request profiles captured by the request profiler middleware.
+
+Prints the hottest functions across all captures (or those whose path
+contains ``--path``) and the SQL statements that took the most time.
+``--token`` prints a header value that turns profiling on for a request.
+
+Example:
+    python manage.py request_profiles --path validate_otp --sort tottime --limit 30
+    curl -H "X-Sejam-Profile: $(python manage.py request_profiles --token)" ...
+"""
+
+import io
+import json
+import pstats
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from profiling.request_profiler import HEADER, make_token
+
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+
+class Command(BaseCommand):
+    help = "Show the hottest functions and SQL statements across captured request profiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.SEJAM_REQUEST_PROFILE_DIR)
+        parser.add_argument('--path', help="Only captures whose request path contains this")
+        parser.add_argument('--sort', choices=SORT_KEYS, default='cumulative')
+        parser.add_argument('--limit', type=int, default=25)
+        parser.add_argument('--token', action='store_true', help=f"Print a signed {HEADER} header value and exit")
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(make_token())
+            return
+
+        captures = []
+        for summary_path in sorted(Path(options['dir']).glob('*.json')):
+            with open(summary_path, encoding='utf-8') as summary_file:
+                summary = json.load(summary_file)
+            profile_path = summary_path.with_suffix('.prof')
+            if profile_path.exists() and (not options['path'] or options['path'] in summary['path']):
+                captures.append((profile_path, summary))
+        if not captures:
+            raise CommandError(f"No captured requests in {options['dir']}")
+
+        seconds = sorted(summary['seconds'] for _, summary in captures)
+        self.stdout.write(
+            f"{len(captures)} requests, median {seconds[len(seconds) // 2] * 1000:.1f}ms, "
+            f"slowest {seconds[-1] * 1000:.1f}ms\n"
+        )
+
+        output = io.StringIO()
+        stats = pstats.Stats(*(str(path) for path, _ in captures), stream=output)
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
+        self.stdout.write(output.getvalue())
+
+        queries = defaultdict(lambda: [0, 0.0])
+        for _, summary in captures:
+            for query in summary['queries']:
+                totals = queries[query['sql']]
+                totals[0] += 1
+                totals[1] += query['seconds']
+        self.stdout.write(f"{'calls':>7} {'total ms':>10}  SQL")
+        for sql, (calls, total) in sorted(queries.items(), key=lambda item: -item[1][1])[:options['limit']]:
+            self.stdout.write(f"{calls:>7} {total * 1000:>10.1f}  {' '.join(sql.split())[:160]}")
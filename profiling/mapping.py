@@ -0,0 +1,320 @@
+"""
+Declarative mapping between Sejam profile payloads, models and responses.
+
+The specs below say which payload value feeds which ``Profile`` or
+``Shareholder`` field and which model attribute feeds which response key.
+At import each spec is split into key-path tuples and attribute getters,
+so mapping a payload is a loop of dictionary lookups with nothing left to
+work out per call.
+
+Mapping rules, unchanged from the original hand-written code:
+
+* string values are stripped, and missing ones become ``''``;
+* the person section (``privatePerson``/``legalPerson``) is required;
+* only the first account and trading code are used for ``Profile``
+  fields. When a payload has none, or an account has no
+  ``bank``/``branchCity`` object, those fields are left out so stored
+  values are kept.
+
+Every account and trading code is also mapped onto ``Account`` and
+``TradingCode`` rows, which back the reverse lookups.
+"""
+
+from dataclasses import dataclass
+from operator import attrgetter
+
+from .models import Account, Shareholder, TradingCode
+
+PRIVATE_PERSON = 'IranianPrivatePerson'
+LEGAL_PERSON = 'IranianLegalPerson'
+
+POSITIONS = {
+    'Chairman': 'رئیس هیئت مدیره',
+    'Ceo': 'مدیرعامل',
+    'Member': 'عضو هیئت مدیره',
+    'DeputyChairman': 'نایب رئیس هیئت مدیره',
+}
+
+
+@dataclass(frozen=True)
+class Section:
+    """
+    Payload object mapped onto model fields.
+
+    Args:
+        key (str): Key of the object in the payload
+        fields (tuple): ``(field, path)`` pairs; ``path`` is a tuple of keys
+            below the section, and a missing intermediate object skips the field
+        first (bool): The key holds a list and only its first item is mapped
+        required (bool): Raise ``KeyError`` if the key is missing
+    """
+    key: str
+    fields: tuple
+    first: bool = False
+    required: bool = True
+
+
+PRIVATE_PERSON_SECTION = Section('privatePerson', (
+    ('first_name', ('firstName',)),
+    ('last_name', ('lastName',)),
+    ('father_name', ('fatherName',)),
+    ('gender', ('gender',)),
+    ('birth_date', ('birthDate',)),
+    ('place_of_birth', ('placeOfBirth',)),
+    ('place_of_issue', ('placeOfIssue',)),
+))
+
+LEGAL_PERSON_SECTION = Section('legalPerson', (
+    ('company_name', ('companyName',)),
+    ('economic_code', ('economicCode',)),
+    ('register_date', ('registerDate',)),
+    ('register_place', ('registerPlace',)),
+    ('register_number', ('registerNumber',)),
+))
+
+TRADING_CODE_SECTION = Section('tradingCodes', (
+    ('trade_code', ('code',)),
+), first=True, required=False)
+
+ACCOUNT_SECTION = Section('accounts', (
+    ('sheba', ('sheba',)),
+    ('bank_account_number', ('accountNumber',)),
+    ('bank_branch_code', ('branchCode',)),
+    ('bank_branch_name', ('branchName',)),
+    ('bank_name', ('bank', 'name')),
+    ('bank_branch_city', ('branchCity', 'name')),
+), first=True, required=False)
+
+PERSON_SECTIONS = {
+    PRIVATE_PERSON: (PRIVATE_PERSON_SECTION,),
+    LEGAL_PERSON: (LEGAL_PERSON_SECTION,),
+}
+COMMON_SECTIONS = (TRADING_CODE_SECTION, ACCOUNT_SECTION)
+
+SHAREHOLDER_FIELDS = (
+    ('unique_identifier', ('uniqueIdentifier',)),
+    ('first_name', ('firstName',)),
+    ('last_name', ('lastName',)),
+)
+
+ACCOUNT_FIELDS = (
+    ('sheba', ('sheba',)),
+    ('account_number', ('accountNumber',)),
+    ('branch_code', ('branchCode',)),
+    ('branch_name', ('branchName',)),
+    ('bank_name', ('bank', 'name')),
+    ('branch_city', ('branchCity', 'name')),
+)
+
+TRADING_CODE_FIELDS = (
+    ('code', ('code',)),
+)
+
+# (response key, Profile attribute, '' when empty)
+PRIVATE_RESPONSE = (
+    ('uniqueIdentifier', 'unique_identifier', False),
+    ('type', 'person_type', False),
+    ('firstName', 'first_name', False),
+    ('lastName', 'last_name', False),
+    ('fatherName', 'father_name', False),
+    ('gender', 'gender', False),
+    ('birthDate', 'birth_date', False),
+    ('placeOfBirth', 'place_of_birth', False),
+    ('placeOfIssue', 'place_of_issue', False),
+)
+LEGAL_RESPONSE = (
+    ('uniqueIdentifier', 'unique_identifier', False),
+    ('type', 'person_type', False),
+    ('companyName', 'company_name', False),
+    ('economicCode', 'economic_code', False),
+    ('registerDate', 'register_date', False),
+    ('registerPlace', 'register_place', False),
+    ('registerNumber', 'register_number', False),
+)
+CONTACT_AND_BANK_RESPONSE = (
+    ('mobile', 'mobile', False),
+    ('email', 'email', True),
+    ('tradeCode', 'trade_code', True),
+    ('sheba', 'sheba', True),
+    ('bank_name', 'bank_name', True),
+    ('bank_branchCode', 'bank_branch_code', True),
+    ('bank_branchName', 'bank_branch_name', True),
+    ('bank_branchCity', 'bank_branch_city', True),
+    ('bank_accountNumber', 'bank_account_number', True),
+)
+
+
+def _strip(value):
+    return str(value).strip() if value is not None else ''
+
+
+def _field_paths(fields):
+    """Split ``(field, path)`` pairs into ``(field, parent keys, key)`` triples."""
+    return tuple((field, path[:-1], path[-1]) for field, path in fields)
+
+
+def _extract(source, paths, fields):
+    """Add the values at ``paths`` below ``source`` to the ``fields`` dict."""
+    for field, parents, key in paths:
+        value = source
+        for parent in parents:
+            value = value.get(parent)
+            if not value:
+                break
+        else:
+            fields[field] = _strip(value.get(key))
+    return fields
+
+
+def section_extractor(sections):
+    """Return ``extract(data, fields)``, adding the values ``sections`` map to ``fields``."""
+    steps = tuple(
+        (section.key, section.first, section.required, _field_paths(section.fields))
+        for section in sections
+    )
+
+    def extract(data, fields):
+        for key, first, required, paths in steps:
+            if required:
+                section = data[key]
+            else:
+                section = data.get(key)
+                if not section:
+                    continue
+            if first:
+                section = section[0]
+            _extract(section, paths, fields)
+        return fields
+    return extract
+
+
+def item_extractor(fields):
+    """Return ``extract(item)``, returning a dict of the values ``fields`` map."""
+    paths = _field_paths(fields)
+
+    def extract(item):
+        return _extract(item, paths, {})
+    return extract
+
+
+def response_builder(keys, shareholders=False):
+    """
+    Return ``build(profile, shareholders)``, returning the response dict for
+    ``keys``; with ``shareholders`` the legal person ``shareHolders`` object
+    is inserted after the person keys.
+    """
+    items = []
+    for key, attribute, blank in keys:
+        items.append((key, attrgetter(attribute), blank))
+        if shareholders and attribute == 'register_number':
+            items.append(('shareHolders', None, False))
+    items = tuple(items)
+
+    def build(profile, shareholders):
+        response = {}
+        for key, get, blank in items:
+            if get is None:
+                response[key] = shareholder_response(shareholders)
+            elif blank:
+                response[key] = get(profile) or ''
+            else:
+                response[key] = get(profile)
+        return response
+    return build
+
+
+_extract_common = section_extractor(COMMON_SECTIONS)
+_extract_person = {
+    person_type: section_extractor(sections)
+    for person_type, sections in PERSON_SECTIONS.items()
+}
+_extract_shareholder = item_extractor(SHAREHOLDER_FIELDS)
+_extract_account = item_extractor(ACCOUNT_FIELDS)
+_extract_trading_code = item_extractor(TRADING_CODE_FIELDS)
+
+
+def map_shareholders(items):
+    """Map ``legalPersonShareholders`` items onto unsaved ``Shareholder`` instances."""
+    shareholders = []
+    for item in items:
+        position = item.get('positionType', '')
+        shareholders.append(Shareholder(
+            position=POSITIONS.get(position, position), **_extract_shareholder(item)
+        ))
+    return shareholders
+
+
+def map_accounts(profile_data):
+    """Map every ``accounts`` item with a sheba onto unsaved ``Account`` instances."""
+    accounts = (Account(**_extract_account(item)) for item in profile_data.get('accounts') or ())
+    return [account for account in accounts if account.sheba]
+
+
+def map_trading_codes(profile_data):
+    """Map every ``tradingCodes`` item with a code onto unsaved ``TradingCode`` instances."""
+    codes = (TradingCode(**_extract_trading_code(item)) for item in profile_data.get('tradingCodes') or ())
+    return [code for code in codes if code.code]
+
+
+def map_profile(profile_data):
+    """
+    Map a Sejam profile payload onto ``Profile`` fields.
+
+    Fields the payload has no data for (e.g. bank details when there are no
+    accounts) are left out, so stored values are kept for them.
+
+    Args:
+        profile_data (dict): The ``data`` object of a Sejam profiles response
+
+    Returns:
+        tuple: (fields, shareholders) where ``fields`` maps ``Profile`` field
+            names to values and ``shareholders`` is a list of unsaved
+            ``Shareholder`` instances, or None for private persons
+    """
+    person_type = profile_data['type']
+    fields = {
+        'person_type': person_type,
+        'mobile': profile_data['mobile'],
+        'email': profile_data.get('email', ''),
+        'raw_data': profile_data,
+    }
+    extract = _extract_person.get(person_type)
+    if extract is not None:
+        extract(profile_data, fields)
+    _extract_common(profile_data, fields)
+
+    shareholders = None
+    if person_type == LEGAL_PERSON:
+        shareholders = map_shareholders(profile_data.get('legalPersonShareholders', []))
+    return fields, shareholders
+
+
+def shareholder_response(shareholders):
+    """Build the ``shareHolders`` object; later duplicates of an identifier win."""
+    return {
+        sh.unique_identifier: {'Name': sh.first_name, 'LastName': sh.last_name, 'position': sh.position}
+        for sh in shareholders or ()
+    }
+
+
+_private_response = response_builder(PRIVATE_RESPONSE + CONTACT_AND_BANK_RESPONSE)
+_legal_response = response_builder(LEGAL_RESPONSE + CONTACT_AND_BANK_RESPONSE, shareholders=True)
+
+
+def build_response(profile, shareholders=None):
+    """
+    Build the API response document for a profile.
+
+    Args:
+        profile (Profile): The profile, saved or not
+        shareholders (list): ``Shareholder`` instances of a legal person, in
+            payload order
+
+    Returns:
+        dict: Structured profile data
+    """
+    if profile.person_type == PRIVATE_PERSON:
+        return _private_response(profile, None)
+    # Anything that is not a private person has always been answered in
+    # the legal person format
+    return _legal_response(profile, shareholders)
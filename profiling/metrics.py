@@ -0,0 +1,241 @@
+"""
+In-process metrics for the Sejam integration, rendered in the Prometheus
+text exposition format.
+
+Counters and histograms are plain Python objects guarded by a lock, so
+recording a value costs a dictionary lookup and a few additions. Each worker
+process keeps its own values and reports them with a ``pid`` label; scrape
+every worker (or aggregate with ``sum without (pid)``) for totals.
+"""
+
+import bisect
+import os
+import threading
+import time
+
+# Seconds; tuned for upstream calls that normally take 50ms-2s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    """Base class holding the name, help text and label names of a metric."""
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _check(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {label_values}")
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self, extra_labels=()):
+        """Yield the exposition lines for this metric."""
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.kind}'
+        with self._lock:
+            items = [(key, self._snapshot(value)) for key, value in self._values.items()]
+        for label_values, value in sorted(items):
+            yield from self._render_series(label_values, value, extra_labels)
+
+
+class Counter(Metric):
+    """A monotonically increasing count."""
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        self._check(label_values)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def _snapshot(self, value):
+        return value
+
+    def _render_series(self, label_values, value, extra_labels):
+        yield f'{self.name}{_format_labels(self.labels, label_values, extra_labels)} {value}'
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down.
+
+    Values owned by something else (e.g. a database table) are set by a
+    collector registered with ``Registry.add_collector``.
+    """
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        self._check(label_values)
+        with self._lock:
+            self._values[label_values] = value
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def _snapshot(self, value):
+        return value
+
+    def _render_series(self, label_values, value, extra_labels):
+        yield f'{self.name}{_format_labels(self.labels, label_values, extra_labels)} {value}'
+
+
+class _Timer:
+    __slots__ = ('histogram', 'label_values', 'start')
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class Histogram(Metric):
+    """A distribution of observed values in cumulative buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels, registry)
+
+    def observe(self, value, *label_values):
+        self._check(label_values)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                state = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def time(self, *label_values):
+        """Context manager observing the duration of its block in seconds."""
+        return _Timer(self, label_values)
+
+    def count(self, *label_values):
+        state = self._values.get(label_values)
+        return sum(state[:-1]) if state else 0
+
+    def _snapshot(self, value):
+        return list(value)
+
+    def _render_series(self, label_values, state, extra_labels):
+        cumulative = 0
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        for bound, bucket_count in zip(bounds, state[:-1]):
+            cumulative += bucket_count
+            labels = _format_labels(self.labels, label_values, list(extra_labels) + [('le', bound)])
+            yield f'{self.name}_bucket{labels} {cumulative}'
+        labels = _format_labels(self.labels, label_values, extra_labels)
+        yield f'{self.name}_sum{labels} {state[-1]}'
+        yield f'{self.name}_count{labels} {cumulative}'
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def add_collector(self, collector):
+        """
+        Call ``collector()`` before every render, to set gauges read from
+        elsewhere; several gauges can then share one read.
+        """
+        self.collectors.append(collector)
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        for collector in self.collectors:
+            collector()
+        extra = [('pid', os.getpid())]
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(extra))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+stage_seconds = Histogram(
+    'sejam_stage_seconds', 'Time spent in each stage of an OTP or profile request.', ['view', 'stage']
+)
+upstream_seconds = Histogram(
+    'sejam_upstream_request_seconds', 'Latency of calls to the Sejam API.', ['endpoint']
+)
+upstream_responses = Counter(
+    'sejam_upstream_responses_total',
+    'Responses from the Sejam API by status code ("error" when none was received).',
+    ['endpoint', 'status'],
+)
+upstream_rejections = Counter(
+    'sejam_upstream_rejections_total',
+    'Sejam API calls refused by the circuit breaker ("open") or concurrency limit ("limit").',
+    ['reason'],
+)
+otp_requests = Counter(
+    'sejam_otp_requests_total',
+    'OTP requests that called Sejam ("sent") or reused a duplicate\'s result ("coalesced").',
+    ['outcome'],
+)
+token_lookups = Counter(
+    'sejam_token_lookups_total', 'Access token lookups by the cache tier that served them.', ['tier']
+)
+token_refreshes = Counter('sejam_token_refreshes_total', 'Access tokens fetched from the Sejam API.')
+errors_recorded = Counter('sejam_errors_recorded_total', 'Upstream errors passed to the error log.')
+profile_writes = Counter(
+    'sejam_profile_writes_total',
+    'Profile writes queued by this process ("queued"), or applied ("applied"), failed ("failed") '
+    'or given up on ("dead") by a queue worker.',
+    ['outcome'],
+)
+profile_queue_depth = Gauge(
+    'sejam_profile_queue_depth', 'Profiles waiting in the persistence queue.'
+)
+profile_queue_lag = Gauge(
+    'sejam_profile_queue_lag_seconds', 'Age of the oldest profile write waiting in the persistence queue.'
+)
+profile_queue_dead = Gauge(
+    'sejam_profile_queue_dead', 'Profile writes given up on after too many failed attempts.'
+)
+request_queries = Histogram(
+    'sejam_request_queries', 'SQL queries sent per request, by endpoint.', ['view'],
+    buckets=(1, 2, 3, 5, 8, 13, 20, 30, 50, 100, 200),
+)
+request_query_seconds = Histogram(
+    'sejam_request_query_seconds', 'Time spent in SQL queries per request, by endpoint.', ['view']
+)
+query_budget_exceeded = Counter(
+    'sejam_query_budget_exceeded_total', 'Requests that sent more SQL queries than their budget.', ['view']
+)
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiling', '0003_errorlog_dedup_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='errorlog',
+            index=models.Index(fields=['timestamp'], name='errorlog_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['mobile'], name='profile_mobile'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['updated_at', 'unique_identifier'], name='profile_updated_at'),
+        ),
+        migrations.AddIndex(
+            model_name='shareholder',
+            index=models.Index(fields=['unique_identifier'], name='shareholder_unique_identifier'),
+        ),
+    ]
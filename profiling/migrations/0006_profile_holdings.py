@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiling', '0005_profile_response_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Account',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sheba', models.CharField(max_length=30)),
+                ('account_number', models.CharField(blank=True, default='', max_length=30)),
+                ('bank_name', models.CharField(blank=True, default='', max_length=100)),
+                ('branch_code', models.CharField(blank=True, default='', max_length=20)),
+                ('branch_name', models.CharField(blank=True, default='', max_length=100)),
+                ('branch_city', models.CharField(blank=True, default='', max_length=100)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accounts', to='profiling.profile')),
+            ],
+            options={
+                'verbose_name': 'Account',
+                'verbose_name_plural': 'Accounts',
+                'indexes': [models.Index(fields=['sheba'], name='account_sheba')],
+                'unique_together': {('profile', 'sheba')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TradingCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=30)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trading_codes', to='profiling.profile')),
+            ],
+            options={
+                'verbose_name': 'Trading Code',
+                'verbose_name_plural': 'Trading Codes',
+                'indexes': [models.Index(fields=['code'], name='tradingcode_code')],
+                'unique_together': {('profile', 'code')},
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+"""
+Move Profile.raw_data from a JSON column to compressed bytes.
+
+The old column is renamed, the new one added and filled in keyset batches,
+each committed on its own so the table is never locked for the whole
+conversion, and the old column is dropped.
+"""
+
+from django.db import migrations, transaction
+
+import profiling.fields
+
+BATCH_SIZE = 1000
+
+
+def copy_documents(apps, source, target):
+    Profile = apps.get_model('profiling', 'Profile')
+    rows = Profile.objects.filter(**{f'{source}__isnull': False}).only('pk', source).order_by('pk')
+    last = None
+    while True:
+        batch = rows.filter(pk__gt=last) if last is not None else rows
+        batch = list(batch[:BATCH_SIZE])
+        if not batch:
+            break
+        for profile in batch:
+            setattr(profile, target, getattr(profile, source))
+        with transaction.atomic():
+            Profile.objects.bulk_update(batch, [target])
+        last = batch[-1].pk
+
+
+def compress(apps, schema_editor):
+    copy_documents(apps, 'raw_data_json', 'raw_data')
+
+
+def decompress(apps, schema_editor):
+    copy_documents(apps, 'raw_data', 'raw_data_json')
+
+
+class Migration(migrations.Migration):
+    # Batches commit separately; see the module docstring
+    atomic = False
+
+    dependencies = [
+        ('profiling', '0006_profile_holdings'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='profile',
+            old_name='raw_data',
+            new_name='raw_data_json',
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='raw_data',
+            field=profiling.fields.CompressedJSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(compress, decompress),
+        migrations.RemoveField(
+            model_name='profile',
+            name='raw_data_json',
+        ),
+    ]
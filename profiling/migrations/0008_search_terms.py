@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiling', '0007_compress_raw_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=20)),
+                ('weight', models.PositiveSmallIntegerField()),
+                ('profile', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='profiling.profile')),
+            ],
+            options={
+                'verbose_name': 'Search Term',
+                'verbose_name_plural': 'Search Terms',
+                'indexes': [models.Index(fields=['term', 'profile', 'weight'], name='searchterm_lookup')],
+                'constraints': [models.UniqueConstraint(fields=('profile', 'term'), name='searchterm_profile_term')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:14
+
+import profiling.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiling', '0008_search_terms'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedProfileWrite',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unique_identifier', models.CharField(max_length=20, unique=True)),
+                ('payload', profiling.fields.CompressedJSONField()),
+                ('token', models.CharField(max_length=32, unique=True)),
+                ('enqueued_at', models.DateTimeField()),
+                ('leased_until', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'verbose_name': 'Queued Profile Write',
+                'verbose_name_plural': 'Queued Profile Writes',
+                'indexes': [models.Index(fields=['enqueued_at'], name='profilequeue_enqueued_at')],
+            },
+        ),
+    ]
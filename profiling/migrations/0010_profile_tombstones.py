@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiling', '0009_profile_write_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unique_identifier', models.CharField(max_length=20, unique=True)),
+                ('deleted_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Profile Tombstone',
+                'verbose_name_plural': 'Profile Tombstones',
+                'indexes': [models.Index(fields=['deleted_at', 'unique_identifier'], name='tombstone_deleted_at')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiling', '0010_profile_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedprofilewrite',
+            name='dead_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
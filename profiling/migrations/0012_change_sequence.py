@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:28
+
+from django.db import migrations, models
+
+
+def create_counter(apps, schema_editor):
+    # Existing rows keep change_seq 0 and come first in the feed
+    apps.get_model('profiling', 'ChangeCounter').objects.create(pk=1, value=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiling', '0011_profile_queue_dead_letters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_counter, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='profiletombstone',
+            name='tombstone_deleted_at',
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profiletombstone',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['change_seq', 'unique_identifier'], name='profile_change_seq'),
+        ),
+        migrations.AddIndex(
+            model_name='profiletombstone',
+            index=models.Index(fields=['change_seq', 'unique_identifier'], name='tombstone_change_seq'),
+        ),
+    ]
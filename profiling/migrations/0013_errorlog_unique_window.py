@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:39
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    # Concurrent flushes could each insert a row for the same window
+    ErrorLog = apps.get_model('profiling', 'ErrorLog')
+    duplicates = list(
+        ErrorLog.objects.filter(window_start__isnull=False).order_by()
+        .values('fingerprint', 'window_start')
+        .annotate(rows=Count('pk'), total=Sum('count'), last_seen=Max('last_seen'), keep=Min('pk'))
+        .filter(rows__gt=1)
+    )
+    for group in duplicates:
+        rows = ErrorLog.objects.filter(fingerprint=group['fingerprint'], window_start=group['window_start'])
+        rows.exclude(pk=group['keep']).delete()
+        rows.filter(pk=group['keep']).update(count=group['total'], last_seen=group['last_seen'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiling', '0012_change_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='errorlog',
+            name='errorlog_fingerprint_window',
+        ),
+        migrations.AddConstraint(
+            model_name='errorlog',
+            constraint=models.UniqueConstraint(fields=('fingerprint', 'window_start'), name='errorlog_fingerprint_window'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
 
+from .fields import CompressedJSONField
+
 class AccessToken(models.Model):
     """Store and manage access tokens for Sejam API."""
     token = models.CharField(max_length=255)
@@ -51,15 +53,28 @@ class Profile(models.Model):
     bank_branch_city = models.CharField(max_length=100, blank=True, null=True)
     bank_account_number = models.CharField(max_length=30, blank=True, null=True)
     
-    # JSON data for full response and additional information
-    raw_data = models.JSONField(blank=True, null=True)
+    # JSON data for full response and additional information, compressed
+    raw_data = CompressedJSONField(blank=True, null=True)
+    # SHA-256 of the canonical raw_data, used to skip unchanged writes
+    payload_hash = models.CharField(max_length=64, blank=True, null=True)
+    # API response document, built when the profile is written
+    response_data = models.JSONField(blank=True, null=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Position in commit order, set by profiling.changes.mark_changed
+    change_seq = models.BigIntegerField(default=0)
     
     class Meta:
         verbose_name = "User Profile"
         verbose_name_plural = "User Profiles"
+        indexes = [
+            models.Index(fields=['mobile'], name='profile_mobile'),
+            # Keyset order used by exports
+            models.Index(fields=['updated_at', 'unique_identifier'], name='profile_updated_at'),
+            # Keyset order used by the change feed
+            models.Index(fields=['change_seq', 'unique_identifier'], name='profile_change_seq'),
+        ]
     
     def __str__(self):
         if self.person_type == 'IranianPrivatePerson':
@@ -80,19 +95,152 @@ class Shareholder(models.Model):
         verbose_name = "Shareholder"
         verbose_name_plural = "Shareholders"
         unique_together = ['profile', 'unique_identifier']
+        indexes = [
+            models.Index(fields=['unique_identifier'], name='shareholder_unique_identifier'),
+        ]
     
     def __str__(self):
         return f"{self.first_name} {self.last_name} - {self.position}"
 
 
+class Account(models.Model):
+    """Store every bank account of a profile, for lookups by sheba."""
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='accounts')
+    sheba = models.CharField(max_length=30)
+    account_number = models.CharField(max_length=30, blank=True, default='')
+    bank_name = models.CharField(max_length=100, blank=True, default='')
+    branch_code = models.CharField(max_length=20, blank=True, default='')
+    branch_name = models.CharField(max_length=100, blank=True, default='')
+    branch_city = models.CharField(max_length=100, blank=True, default='')
+    
+    class Meta:
+        verbose_name = "Account"
+        verbose_name_plural = "Accounts"
+        unique_together = ['profile', 'sheba']
+        indexes = [
+            models.Index(fields=['sheba'], name='account_sheba'),
+        ]
+    
+    def __str__(self):
+        return f"{self.sheba} ({self.bank_name})"
+
+
+class TradingCode(models.Model):
+    """Store every trading code of a profile, for lookups by code."""
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='trading_codes')
+    code = models.CharField(max_length=30)
+    
+    class Meta:
+        verbose_name = "Trading Code"
+        verbose_name_plural = "Trading Codes"
+        unique_together = ['profile', 'code']
+        indexes = [
+            models.Index(fields=['code'], name='tradingcode_code'),
+        ]
+    
+    def __str__(self):
+        return self.code
+
+
+class SearchTerm(models.Model):
+    """Normalized name prefix pointing at the profile it belongs to (see ``profiling.search``)."""
+    term = models.CharField(max_length=20)
+    # Indexed by the unique constraint, which leads with it
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='search_terms', db_index=False)
+    weight = models.PositiveSmallIntegerField()
+    
+    class Meta:
+        verbose_name = "Search Term"
+        verbose_name_plural = "Search Terms"
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'term'], name='searchterm_profile_term'),
+        ]
+        indexes = [
+            # Covers searches: ranking needs no table lookups
+            models.Index(fields=['term', 'profile', 'weight'], name='searchterm_lookup'),
+        ]
+    
+    def __str__(self):
+        return self.term
+
+
+class QueuedProfileWrite(models.Model):
+    """Latest Sejam payload of a profile waiting to be written (see ``profiling.profile_queue``)."""
+    unique_identifier = models.CharField(max_length=20, unique=True)
+    payload = CompressedJSONField()
+    # Changes on every enqueue, so a worker only deletes the payload it wrote
+    token = models.CharField(max_length=32, unique=True)
+    enqueued_at = models.DateTimeField()
+    leased_until = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    # Set once SEJAM_PROFILE_QUEUE_MAX_ATTEMPTS writes failed; such rows are
+    # no longer claimed until a newer payload replaces them
+    dead_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        verbose_name = "Queued Profile Write"
+        verbose_name_plural = "Queued Profile Writes"
+        indexes = [
+            models.Index(fields=['enqueued_at'], name='profilequeue_enqueued_at'),
+        ]
+    
+    def __str__(self):
+        return f"{self.unique_identifier} queued at {self.enqueued_at}"
+
+
+class ProfileTombstone(models.Model):
+    """Record of a deleted profile, served by the change feed (see ``profiling.changes``)."""
+    unique_identifier = models.CharField(max_length=20, unique=True)
+    deleted_at = models.DateTimeField()
+    change_seq = models.BigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Profile Tombstone"
+        verbose_name_plural = "Profile Tombstones"
+        indexes = [
+            # Keyset order used by the change feed
+            models.Index(fields=['change_seq', 'unique_identifier'], name='tombstone_change_seq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.unique_identifier} deleted at {self.deleted_at}"
+
+
+class ChangeCounter(models.Model):
+    """
+    Single-row counter handing out change sequence numbers (see ``profiling.changes``).
+    
+    A writer bumps it last in its transaction and holds the row lock until
+    it commits, so sequence numbers become visible in increasing order.
+    """
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Change {self.value}"
+
+
 class ErrorLog(models.Model):
     """Store error logs from API calls."""
     error_data = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     
+    # Identical errors within one window are stored once with a count
+    fingerprint = models.CharField(max_length=40, blank=True, default='')
+    window_start = models.DateTimeField(blank=True, null=True)
+    last_seen = models.DateTimeField(blank=True, null=True)
+    count = models.PositiveIntegerField(default=1)
+    
     class Meta:
         verbose_name = "Error Log"
         verbose_name_plural = "Error Logs"
+        indexes = [
+            models.Index(fields=['timestamp'], name='errorlog_timestamp'),
+        ]
+        constraints = [
+            # Lets concurrent flushes add to one row instead of each inserting it
+            models.UniqueConstraint(fields=['fingerprint', 'window_start'], name='errorlog_fingerprint_window'),
+        ]
     
     def __str__(self):
         return f"Error at {self.timestamp}"
\ No newline at end of file
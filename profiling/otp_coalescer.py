@@ -0,0 +1,189 @@
+"""
+Collapsing of duplicate OTP requests for the same identifier.
+
+Double taps on "send code" and client retries would otherwise call
+``/kycOtp`` once each, sending the user several SMS. ``OTPCoalescer``
+makes the first request for an identifier the leader; requests that
+arrive while it is in flight wait for its result, in this process through
+a shared future and in other processes through a pending marker in the
+shared cache. A successful result is then kept for
+``SEJAM_OTP_COALESCE_WINDOW`` seconds and returned to later duplicates
+without calling Sejam. Failed sends are not kept, so retrying after an
+error reaches the API again. A duplicate that has waited ``wait_timeout``
+seconds for a slow leader (one refreshing the access token, say) sends
+the OTP itself rather than failing.
+
+Results carry ``coalesced``: False for the call that reached Sejam, True
+for the ones that reused its result.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+PENDING = '__pending__'
+
+
+class OTPCoalescer:
+    """
+    Single-flight and short-lived result cache around OTP sends.
+
+    Args:
+        window (int): Seconds a successful result is reused; 0 only collapses
+            concurrent requests
+        cache_alias (str): Django cache shared by the workers
+        wait_timeout (float): Longest a duplicate waits for the leader before
+            sending itself
+        poll_interval (float): Seconds between checks of the shared cache
+    """
+
+    def __init__(self, window=None, cache_alias=None, wait_timeout=None, poll_interval=0.05):
+        self.window = settings.SEJAM_OTP_COALESCE_WINDOW if window is None else window
+        self.cache_alias = cache_alias or settings.SEJAM_OTP_CACHE_ALIAS
+        self.wait_timeout = wait_timeout or (
+            settings.SEJAM_HTTP_CONNECT_TIMEOUT + settings.SEJAM_HTTP_READ_TIMEOUT
+        )
+        self.poll_interval = poll_interval
+        self._inflight = {}
+        self._ainflight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def key(self, sh_id):
+        return f'sejam:otp:{sh_id}'
+
+    def run(self, sh_id, send):
+        """
+        Return ``send()``'s result for ``sh_id``, or a duplicate's.
+
+        Args:
+            sh_id (str): The identifier the OTP is for
+            send (callable): Calls Sejam and returns the result dict
+
+        Returns:
+            dict: The result, with ``coalesced`` set
+        """
+        with self._lock:
+            future = self._inflight.get(sh_id)
+            leader = future is None
+            if leader:
+                future = self._inflight[sh_id] = Future()
+        if not leader:
+            try:
+                return self._coalesced(future.result(timeout=self.wait_timeout))
+            except FutureTimeoutError:
+                return self._send_alone(sh_id, send)
+
+        try:
+            result = self._run_shared(sh_id, send)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[sh_id]
+
+    def _run_shared(self, sh_id, send):
+        key = self.key(sh_id)
+        deadline = time.monotonic() + self.wait_timeout
+        while not self.cache.add(key, PENDING, self.wait_timeout):
+            cached = self.cache.get(key)
+            if cached is not None and cached != PENDING:
+                return self._coalesced(cached)
+            if time.monotonic() > deadline:
+                break
+            time.sleep(self.poll_interval)
+
+        try:
+            result = send()
+        except BaseException:
+            self.cache.delete(key)
+            raise
+        self._store(key, result)
+        return self._sent(result)
+
+    async def arun(self, sh_id, send):
+        """Async counterpart of ``run``; ``send`` is a coroutine function."""
+        future = self._ainflight.get(sh_id)
+        if future is not None and future.get_loop() is asyncio.get_running_loop():
+            try:
+                return self._coalesced(await asyncio.wait_for(asyncio.shield(future), self.wait_timeout))
+            except asyncio.TimeoutError:
+                return await self._asend_alone(sh_id, send)
+
+        future = self._ainflight[sh_id] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._arun_shared(sh_id, send)
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; do not warn about an unretrieved exception
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._ainflight.get(sh_id) is future:
+                del self._ainflight[sh_id]
+
+    async def _arun_shared(self, sh_id, send):
+        key = self.key(sh_id)
+        deadline = time.monotonic() + self.wait_timeout
+        while not await self.cache.aadd(key, PENDING, self.wait_timeout):
+            cached = await self.cache.aget(key)
+            if cached is not None and cached != PENDING:
+                return self._coalesced(cached)
+            if time.monotonic() > deadline:
+                break
+            await asyncio.sleep(self.poll_interval)
+
+        try:
+            result = await send()
+        except BaseException:
+            await self.cache.adelete(key)
+            raise
+        await self._astore(key, result)
+        return self._sent(result)
+
+    def _send_alone(self, sh_id, send):
+        logger.warning(f"OTP send for {sh_id} still running after {self.wait_timeout}s, sending again")
+        return self._sent(send())
+
+    async def _asend_alone(self, sh_id, send):
+        logger.warning(f"OTP send for {sh_id} still running after {self.wait_timeout}s, sending again")
+        return self._sent(await send())
+
+    def _store(self, key, result):
+        if self.window and result.get('status') == 200:
+            self.cache.set(key, result, self.window)
+        else:
+            self.cache.delete(key)
+
+    async def _astore(self, key, result):
+        if self.window and result.get('status') == 200:
+            await self.cache.aset(key, result, self.window)
+        else:
+            await self.cache.adelete(key)
+
+    def _sent(self, result):
+        metrics.otp_requests.inc('sent')
+        return dict(result, coalesced=False)
+
+    def _coalesced(self, result):
+        metrics.otp_requests.inc('coalesced')
+        return dict(result, coalesced=True)
@@ -0,0 +1,212 @@
+"""
+Durable queue of profile writes, applied off the request path.
+
+With ``SEJAM_PROFILE_WRITE_MODE = 'queue'`` a validated OTP is answered
+from the mapped Sejam payload, and the payload is upserted into
+``QueuedProfileWrite`` (a single INSERT ... ON CONFLICT). The profile,
+shareholder, account, trading code and search term writes are left to
+``drain_profile_queue`` workers, which claim batches and apply them with
+the bulk importer.
+
+The table holds one row per identifier, carrying the latest payload. A
+burst of validations for one person therefore costs one profile write,
+and concurrent workers never apply an identifier's payloads out of order.
+
+Delivery is at-least-once. A claim is a lease: if a worker dies, its rows
+can be claimed again once the lease expires. Replays are cheap because an
+unchanged payload causes no writes. A row is only deleted if its payload
+was not replaced while the worker was writing it; otherwise the newer
+payload stays queued.
+
+A batch that fails to write is split in halves and retried until the
+payloads at fault are isolated, so the rest of the batch is still written.
+A failed payload is retried once its lease expires; after
+``SEJAM_PROFILE_QUEUE_MAX_ATTEMPTS`` attempts it is marked dead and left
+for inspection, until a newer payload for the same identifier replaces it.
+A payload the importer cannot map at all is marked dead straight away,
+since retrying it would fail the same way.
+
+Until a write is applied, stored copies (``ProfileView``, exports) still
+show the previous version. Bank fields missing from a payload are also
+answered blank instead of with stored values.
+"""
+
+import datetime
+import logging
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from . import metrics
+from .models import QueuedProfileWrite
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(profile_data):
+    """
+    Queue a Sejam profile payload to be written, replacing any queued one.
+
+    Args:
+        profile_data (dict): The ``data`` object of a Sejam profiles response
+    """
+    QueuedProfileWrite.objects.bulk_create(
+        [QueuedProfileWrite(
+            unique_identifier=profile_data['uniqueIdentifier'],
+            payload=profile_data,
+            token=uuid.uuid4().hex,
+            enqueued_at=timezone.now(),
+        )],
+        update_conflicts=True,
+        unique_fields=['unique_identifier'],
+        # A new payload gets a fresh set of attempts, even if the old one died
+        update_fields=['payload', 'token', 'enqueued_at', 'attempts', 'last_error', 'dead_at'],
+    )
+    metrics.profile_writes.inc('queued')
+
+
+def claim(batch_size=None, lease=None):
+    """
+    Lease up to ``batch_size`` queued writes, oldest first.
+
+    Args:
+        batch_size (int): Largest number of writes claimed
+        lease (int): Seconds before unfinished writes may be claimed again
+
+    Returns:
+        list: The claimed ``QueuedProfileWrite`` rows
+    """
+    batch_size = batch_size or settings.SEJAM_PROFILE_QUEUE_BATCH_SIZE
+    lease = settings.SEJAM_PROFILE_QUEUE_LEASE if lease is None else lease
+    now = timezone.now()
+    with transaction.atomic():
+        # SQLite serializes this transaction; other databases skip rows
+        # another worker is claiming at the same moment
+        entries = list(
+            QueuedProfileWrite.objects
+            .filter(Q(leased_until__isnull=True) | Q(leased_until__lt=now), dead_at__isnull=True)
+            .order_by('enqueued_at')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if entries:
+            leased_until = now + datetime.timedelta(seconds=lease)
+            QueuedProfileWrite.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+                leased_until=leased_until, attempts=F('attempts') + 1
+            )
+            for entry in entries:
+                entry.leased_until = leased_until
+                entry.attempts += 1
+    return entries
+
+
+def complete(entries):
+    """
+    Remove applied writes from the queue.
+
+    Rows whose payload was replaced while they were being written are kept,
+    with their lease released so the newer payload is written next.
+    """
+    ids = [entry.pk for entry in entries]
+    with transaction.atomic():
+        QueuedProfileWrite.objects.filter(token__in=[entry.token for entry in entries]).delete()
+        QueuedProfileWrite.objects.filter(pk__in=ids).update(leased_until=None, last_error='')
+
+
+def fail(entry, error, permanent=False):
+    """
+    Record why writing ``entry`` failed.
+
+    It is retried when its lease expires, or marked dead once it has used
+    up ``SEJAM_PROFILE_QUEUE_MAX_ATTEMPTS``, or at once if ``permanent``.
+    """
+    dead = permanent or entry.attempts >= settings.SEJAM_PROFILE_QUEUE_MAX_ATTEMPTS
+    changes = {'last_error': str(error)[:2000]}
+    if dead:
+        changes.update(dead_at=timezone.now(), leased_until=None)
+    # Matched by token: a payload queued since then gets its own attempts
+    QueuedProfileWrite.objects.filter(token=entry.token).update(**changes)
+    metrics.profile_writes.inc('dead' if dead else 'failed')
+
+
+def _write(importer_class, entries):
+    """
+    Write ``entries``, bisecting a failed batch to isolate the bad payloads.
+
+    Payloads the importer skipped as unmappable are marked dead rather than
+    counted as written.
+
+    Returns:
+        list: The entries that were written
+    """
+    try:
+        skipped = importer_class(batch_size=len(entries)).import_batch([entry.payload for entry in entries])
+    except Exception as e:
+        if len(entries) == 1:
+            logger.exception(f"Writing queued profile {entries[0].unique_identifier} failed")
+            fail(entries[0], e)
+            return []
+        middle = len(entries) // 2
+        return _write(importer_class, entries[:middle]) + _write(importer_class, entries[middle:])
+    for position, error in skipped.items():
+        fail(entries[position], error, permanent=True)
+    return [entry for position, entry in enumerate(entries) if position not in skipped]
+
+
+def drain(batch_size=None, lease=None):
+    """
+    Claim and write one batch of queued profiles.
+
+    Returns:
+        int: Number of writes claimed; 0 when the queue had nothing ready
+    """
+    # Imported here: the importer depends on views, which enqueue
+    from .importer import ProfileImporter
+
+    entries = claim(batch_size, lease)
+    if not entries:
+        return 0
+    written = _write(ProfileImporter, entries)
+    if written:
+        complete(written)
+        metrics.profile_writes.inc('applied', amount=len(written))
+    return len(entries)
+
+
+def queue_stats():
+    """
+    Return the queue depth, the age in seconds of its oldest write, and
+    the number of dead writes, from one query.
+
+    Returns:
+        tuple: (depth, lag, dead)
+    """
+    live = Q(dead_at__isnull=True)
+    stats = QueuedProfileWrite.objects.aggregate(
+        depth=Count('pk', filter=live),
+        oldest=Min('enqueued_at', filter=live),
+        dead=Count('pk', filter=~live),
+    )
+    lag = 0.0
+    if stats['oldest'] is not None:
+        lag = max((timezone.now() - stats['oldest']).total_seconds(), 0.0)
+    return stats['depth'], lag, stats['dead']
+
+
+def collect_metrics():
+    """Set the queue gauges from a single ``queue_stats`` query."""
+    gauges = (metrics.profile_queue_depth, metrics.profile_queue_lag, metrics.profile_queue_dead)
+    try:
+        stats = queue_stats()
+    except Exception:
+        # A failing database must not break the whole scrape
+        for gauge in gauges:
+            gauge.clear()
+        return
+    for gauge, value in zip(gauges, stats):
+        gauge.set(value)
+
+
+metrics.REGISTRY.add_collector(collect_metrics)
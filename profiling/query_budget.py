@@ -0,0 +1,183 @@
+"""
+Per-request SQL query counting with budgets.
+
+``QueryBudgetMiddleware`` counts and times the SQL statements every request
+to a profiling view sends, records them in the ``sejam_request_queries``
+and ``sejam_request_query_seconds`` histograms, and logs a warning for a
+request over its endpoint's budget (``SEJAM_QUERY_BUDGETS``, by URL name,
+falling back to ``SEJAM_QUERY_BUDGET``). Endpoints are named by URL rather
+than view class because the sync and async views of one share a URL. The warning breaks the count down by code path
+and names the most repeated statement, which is where an N+1 shows up.
+With ``SEJAM_QUERY_BUDGET_STRICT`` the request fails instead, for test
+and development runs.
+
+Code paths are named with ``code_path``; nested paths are joined with
+``/`` (``store/shareholders``) and statements outside any path count under
+``view``. ``track_queries`` gives the same breakdown for any block of code,
+which is what the tests use to pin the queries of each person type.
+Statements sent while a streamed response body is iterated (exports,
+batch OTPs) happen after the middleware returns and are not counted.
+
+Each database connection gets ``execute_wrapper`` once, when it is opened.
+It only does work while a tracker is set in a context variable, which the
+middleware does once the URL has resolved to a profiling view, so other
+requests are not tracked at all. A context variable rather than a wrapper
+per request follows the request into the threads that run sync code under
+ASGI, where Django opens a separate connection. The middleware runs
+natively in both sync and async handlers.
+"""
+
+import contextvars
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+
+from .metrics import query_budget_exceeded, request_queries, request_query_seconds
+
+logger = logging.getLogger(__name__)
+
+_path = contextvars.ContextVar('sejam_code_path', default=None)
+_tracker = contextvars.ContextVar('sejam_query_tracker', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a request sends more queries than its budget."""
+
+
+@contextmanager
+def code_path(name):
+    """Count the queries sent inside this block under ``name``."""
+    parent = _path.get()
+    token = _path.set(f'{parent}/{name}' if parent else name)
+    try:
+        yield
+    finally:
+        _path.reset(token)
+
+
+class QueryTracker:
+    """``connection.execute_wrapper`` hook counting and timing statements by code path."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.paths = Counter()
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+            self.paths[_path.get() or 'view'] += 1
+            self.statements[sql] += 1
+
+    def summary(self):
+        """One line listing the queries per code path and the most repeated statement."""
+        paths = ', '.join(f'{path}={count}' for path, count in sorted(self.paths.items()))
+        line = f"{self.count} queries in {self.seconds * 1000:.1f}ms ({paths})"
+        if self.statements:
+            sql, repeats = self.statements.most_common(1)[0]
+            if repeats > 1:
+                line += f"; repeated {repeats}x: {' '.join(sql.split())[:200]}"
+        return line
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """Hand statements to the tracker of the current request, if it has one."""
+    tracker = _tracker.get()
+    if tracker is None:
+        return execute(sql, params, many, context)
+    return tracker(execute, sql, params, many, context)
+
+
+def install_execute_wrapper(connection, **kwargs):
+    """``connection_created`` receiver adding ``execute_wrapper`` to a connection."""
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+@contextmanager
+def track_queries(using=None):
+    """
+    Track the queries sent inside this block.
+
+    Example:
+        with track_queries() as tracker:
+            store_profile(payload)
+        tracker.count, tracker.paths['shareholders']
+    """
+    tracker = QueryTracker()
+    with (using or connection).execute_wrapper(tracker):
+        yield tracker
+
+
+def budget_for(endpoint):
+    return settings.SEJAM_QUERY_BUDGETS.get(endpoint, settings.SEJAM_QUERY_BUDGET)
+
+
+class QueryBudgetMiddleware:
+    """Count the queries of each request to a profiling view against its budget."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Django calls process_view in the handler's mode; a sync one
+            # would send every request through a thread
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            # Sync workers reuse one context for every request
+            _tracker.set(None)
+        self.check(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        self.check(request)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.start(request, view_func)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        self.start(request, view_func)
+
+    def start(self, request, view_func):
+        """Track the queries of the rest of the request if it is for a profiling view."""
+        view = getattr(view_func, 'view_class', view_func)
+        if view.__module__.startswith('profiling.'):
+            tracker = QueryTracker()
+            request.query_budget = (request.resolver_match.url_name or view.__name__, tracker)
+            _tracker.set(tracker)
+
+    def check(self, request):
+        """Record the request's queries and enforce its endpoint's budget."""
+        tracked = getattr(request, 'query_budget', None)
+        if tracked is None:
+            return
+        endpoint, tracker = tracked
+        request_queries.observe(tracker.count, endpoint)
+        request_query_seconds.observe(tracker.seconds, endpoint)
+        budget = budget_for(endpoint)
+        if tracker.count > budget:
+            query_budget_exceeded.inc(endpoint)
+            message = f"{request.method} {request.path} over its budget of {budget}: {tracker.summary()}"
+            if settings.SEJAM_QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
@@ -0,0 +1,194 @@
+"""
+On-demand cProfile capture of requests to the profiling app's views.
+
+A request is profiled when it carries a valid ``X-Sejam-Profile`` header
+(a signed token from ``manage.py request_profiles --token``) or is picked
+by ``SEJAM_REQUEST_PROFILE_SAMPLE_RATE``. For each captured request the
+view runs under ``cProfile`` while every SQL statement it sends is timed,
+and two files are written to ``SEJAM_REQUEST_PROFILE_DIR``:
+
+* ``<id>.prof``: the ``pstats`` dump, for ``snakeviz``, ``pstats`` or
+  ``request_profiles``;
+* ``<id>.json``: request line, status, wall time and the SQL statements
+  (text and duration; parameters are left out as they hold personal data).
+
+Only the newest ``SEJAM_REQUEST_PROFILE_MAX_FILES`` captures are kept.
+Requests that are not captured only pay for a header lookup.
+
+The middleware wraps the rest of the handler rather than calling the view
+itself, so a view that raises goes through ``process_exception`` and
+Django's error handling as usual, and the capture records the resulting
+status. It runs natively in both sync and async (ASGI) handlers. cProfile
+follows one thread: under ASGI the dump covers the event loop, so an async
+view is profiled (together with anything else the loop ran meanwhile, and
+one capture at a time), while a sync view, which Django runs in a worker
+thread, gets the SQL and timing breakdown only. Statements are recorded
+through a context variable, which follows the request into that thread.
+"""
+
+import cProfile
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Sejam-Profile'
+SIGNING_SALT = 'profiling.request_profiler'
+TOKEN_MAX_AGE = 7 * 24 * 3600
+
+_recorder = contextvars.ContextVar('sejam_query_recorder', default=None)
+
+
+def make_token():
+    """Return a value for the ``X-Sejam-Profile`` header, valid for a week."""
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign('profile')
+
+
+def has_valid_token(request):
+    token = request.headers.get(HEADER)
+    if not token:
+        return False
+    try:
+        signing.TimestampSigner(salt=SIGNING_SALT).unsign(token, max_age=TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class QueryRecorder:
+    """Hook timing every SQL statement sent while it is the current recorder."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'sql': sql, 'many': many, 'seconds': round(time.perf_counter() - start, 6)})
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """Hand statements to the recorder of the request being profiled, if any."""
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_execute_wrapper(connection, **kwargs):
+    """``connection_created`` receiver adding ``execute_wrapper`` to a connection."""
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+class RequestProfilerMiddleware:
+    """Profile selected requests to views of the profiling app."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # cProfile allows one active profiler per thread: the event loop's
+        self._loop_busy = False
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        recorder = QueryRecorder()
+        token = _recorder.set(recorder)
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+            _recorder.reset(token)
+        return self.finish(request, response, profiler, recorder, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if self._loop_busy or not self.should_profile(request):
+            return await self.get_response(request)
+
+        profiler = cProfile.Profile()
+        recorder = QueryRecorder()
+        token = _recorder.set(recorder)
+        self._loop_busy = True
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiler.disable()
+            self._loop_busy = False
+            _recorder.reset(token)
+        return await sync_to_async(self.finish)(request, response, profiler, recorder, time.perf_counter() - start)
+
+    def should_profile(self, request):
+        """Whether the request is selected and goes to a view of the profiling app."""
+        if not has_valid_token(request):
+            rate = settings.SEJAM_REQUEST_PROFILE_SAMPLE_RATE
+            if not (rate > 0 and random.random() < rate):
+                return False
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return False
+        return getattr(match.func, '__module__', '').startswith('profiling.')
+
+    def finish(self, request, response, profiler, recorder, elapsed):
+        """Save the capture and name it in the response; returns the response."""
+        try:
+            capture_id = self.save(request, response, profiler, recorder.queries, elapsed)
+        except OSError:
+            logger.exception("Could not write request profile")
+        else:
+            response['X-Sejam-Profile-Id'] = capture_id
+        return response
+
+    def save(self, request, response, profiler, queries, elapsed):
+        """Write the capture files and prune old ones; returns the capture id."""
+        directory = Path(settings.SEJAM_REQUEST_PROFILE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        capture_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        profiler.dump_stats(directory / f'{capture_id}.prof')
+        summary = {
+            'id': capture_id,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'seconds': round(elapsed, 6),
+            'query_count': len(queries),
+            'query_seconds': round(sum(query['seconds'] for query in queries), 6),
+            'queries': queries,
+        }
+        with open(directory / f'{capture_id}.json', 'w', encoding='utf-8') as output:
+            json.dump(summary, output, ensure_ascii=False, indent=1)
+        prune(directory, settings.SEJAM_REQUEST_PROFILE_MAX_FILES)
+        return capture_id
+
+
+def prune(directory, keep):
+    """Delete all but the newest ``keep`` captures in ``directory``."""
+    captures = sorted(Path(directory).glob('*.prof'), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in captures[keep:]:
+        path.unlink(missing_ok=True)
+        path.with_suffix('.json').unlink(missing_ok=True)
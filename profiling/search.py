@@ -0,0 +1,212 @@
+"""
+Persian name search over profiles and their shareholders.
+
+Names are normalized (Arabic Yeh and Kaf folded to their Persian forms,
+ZWNJ, diacritics and tatweel removed, Alef variants and digits unified)
+and every prefix of every word, from ``MIN_TERM_LENGTH`` characters up,
+is stored in ``SearchTerm`` against the profile it belongs to. A query is
+normalized the same way and each of its words becomes one exact lookup
+on the indexed ``term`` column, so search cost depends on how many
+profiles match, not on table size.
+
+Each term carries a weight: a profile's own name outranks a shareholder's
+name, and a whole word outranks a prefix. Results must match every query
+word and are ordered by the summed weight.
+"""
+
+import re
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import Profile, SearchTerm
+
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = SearchTerm._meta.get_field('term').max_length
+SEARCH_LIMIT = 20
+
+# (own name, shareholder name) x (prefix, whole word)
+NAME_PREFIX, NAME_WORD = 3, 4
+SHAREHOLDER_PREFIX, SHAREHOLDER_WORD = 1, 2
+
+CHARACTER_MAP = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی',
+    'ك': 'ک',
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ؤ': 'و',
+    'ة': 'ه', 'ۀ': 'ه',
+    '\u200c': None,  # ZWNJ
+    '\u200d': None,  # ZWJ
+    '\u0640': None,  # tatweel
+    **{chr(code): None for code in range(0x064B, 0x0653)},  # diacritics
+    **{chr(0x06F0 + digit): str(digit) for digit in range(10)},
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+})
+WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Return the normalized words of ``text``."""
+    return WORD.findall((text or '').translate(CHARACTER_MAP).casefold())
+
+
+def query_terms(query):
+    """Return the distinct index terms a search query looks up."""
+    terms = {word[:MAX_TERM_LENGTH] for word in normalize(query) if len(word) >= MIN_TERM_LENGTH}
+    return sorted(terms)
+
+
+def name_terms(names, prefix_weight, word_weight, terms=None):
+    """
+    Add the index terms of ``names`` to ``terms``, keeping the highest weight.
+
+    Returns:
+        dict: term -> weight
+    """
+    terms = {} if terms is None else terms
+    for name in names:
+        for word in normalize(name):
+            for length in range(MIN_TERM_LENGTH, min(len(word), MAX_TERM_LENGTH) + 1):
+                weight = word_weight if length == len(word) else prefix_weight
+                term = word[:length]
+                if weight > terms.get(term, 0):
+                    terms[term] = weight
+    return terms
+
+
+def profile_terms(profile, shareholders=None):
+    """
+    Return the index terms of a profile.
+
+    Args:
+        profile (Profile): The profile
+        shareholders (list): ``Shareholder`` instances of a legal person
+
+    Returns:
+        dict: term -> weight
+    """
+    terms = name_terms(
+        (profile.first_name, profile.last_name, profile.company_name), NAME_PREFIX, NAME_WORD
+    )
+    for shareholder in shareholders or ():
+        name_terms((shareholder.first_name, shareholder.last_name),
+                   SHAREHOLDER_PREFIX, SHAREHOLDER_WORD, terms)
+    return terms
+
+
+def index_profiles(entries):
+    """
+    Make the stored search terms of several profiles match their names.
+
+    Existing terms are read in one query and only the difference is
+    written, so re-indexing an unchanged profile causes no writes.
+
+    Args:
+        entries (list): ``(profile, shareholders, created)`` tuples, as for
+            ``sync_many_shareholders``; ``shareholders`` may be None
+
+    Returns:
+        tuple: Number of terms (created, updated, deleted)
+    """
+    to_create = []
+    to_update = []
+    to_delete = []
+
+    # Inside a caller's transaction (store_profile, the importer) this joins
+    # it rather than costing a SAVEPOINT and RELEASE round trip
+    with transaction.atomic(savepoint=False):
+        existing_ids = [profile.pk for profile, _, created in entries if not created]
+        existing = {}
+        if existing_ids:
+            for row in SearchTerm.objects.filter(profile_id__in=existing_ids):
+                existing.setdefault(row.profile_id, {})[row.term] = row
+
+        for profile, shareholders, _ in entries:
+            current_rows = existing.pop(profile.pk, {})
+            for term, weight in profile_terms(profile, shareholders).items():
+                current = current_rows.pop(term, None)
+                if current is None:
+                    to_create.append(SearchTerm(profile=profile, term=term, weight=weight))
+                elif current.weight != weight:
+                    current.weight = weight
+                    to_update.append(current)
+            to_delete.extend(row.pk for row in current_rows.values())
+
+        if to_delete:
+            SearchTerm.objects.filter(pk__in=to_delete).delete()
+        if to_create:
+            SearchTerm.objects.bulk_create(to_create)
+        if to_update:
+            SearchTerm.objects.bulk_update(to_update, ['weight'])
+
+    return len(to_create), len(to_update), len(to_delete)
+
+
+def matching_terms(query):
+    """
+    Return the profiles matching every word of ``query``, best first.
+
+    Args:
+        query (str): Words of a name, in any order, possibly partial
+
+    Returns:
+        QuerySet: Unevaluated ``{'profile_id', 'matched', 'score'}`` rows, or
+            None if the query has no searchable words
+    """
+    terms = query_terms(query)
+    if not terms:
+        return None
+    return (
+        SearchTerm.objects.filter(term__in=terms)
+        .values('profile_id')
+        .annotate(matched=Count('term'), score=Sum('weight'))
+        .filter(matched=len(terms))
+        .order_by('-score', 'profile_id')
+    )
+
+
+def matching_profile_ids(query, limit=SEARCH_LIMIT):
+    """
+    Return the identifiers of the best matches for ``query``, best first.
+
+    Returns:
+        list: ``(unique_identifier, score)`` tuples, at most ``limit``
+    """
+    matches = matching_terms(query)
+    if matches is None:
+        return []
+    return list(matches.values_list('profile_id', 'score')[:limit])
+
+
+def search_profiles(query, limit=SEARCH_LIMIT):
+    """
+    Search profiles by their own or their shareholders' names.
+
+    Args:
+        query (str): Words of a name, in any order, possibly partial
+        limit (int): Largest number of results
+
+    Returns:
+        list: ``{'uniqueIdentifier', 'type', 'name', 'score'}`` dicts, best first
+    """
+    matches = matching_profile_ids(query, limit)
+    profiles = Profile.objects.only(
+        'unique_identifier', 'person_type', 'first_name', 'last_name', 'company_name'
+    ).in_bulk([unique_identifier for unique_identifier, _ in matches])
+    results = []
+    for unique_identifier, score in matches:
+        profile = profiles.get(unique_identifier)
+        if profile is None:
+            # Deleted since its terms were matched
+            continue
+        if profile.person_type == 'IranianPrivatePerson':
+            name = f"{profile.first_name or ''} {profile.last_name or ''}".strip()
+        else:
+            name = profile.company_name or ''
+        results.append({
+            'uniqueIdentifier': unique_identifier,
+            'type': profile.person_type,
+            'name': name,
+            'score': score,
+        })
+    return results
@@ -0,0 +1,323 @@
+"""
+HTTP client for the Sejam API.
+
+All calls to ``SEJAM_API_BASE_URL`` go through a single ``requests.Session``
+per worker process, so TCP and TLS connections are pooled and kept alive
+between requests. Every call has connect and read timeouts, and idempotent
+calls are retried with exponential backoff on connection errors and
+transient upstream statuses. The OTP-bearing profile fetch is only retried
+when the connection could not be made, since Sejam may consume the OTP of
+a request whose response is lost. Each attempt passes through the process's
+``UpstreamGuard`` (circuit breaker and adaptive concurrency limit), which
+raises ``UpstreamUnavailable`` instead of calling a failing upstream.
+
+``AsyncSejamClient`` offers the same calls on top of ``aiohttp`` for the
+ASGI views in ``profiling.async_views``.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from django.conf import settings
+
+from . import metrics
+from .upstream_guard import upstream_guard
+
+logger = logging.getLogger(__name__)
+
+# Upstream statuses worth retrying for idempotent calls
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+DEFAULT_HEADERS = {
+    "accept": "application/json",
+    "Content-Type": "application/json-patch+json",
+}
+
+
+def connect_failed(error):
+    """Whether a ``requests`` error was raised before the request was sent."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class BaseSejamClient:
+    """
+    Configuration and endpoint definitions shared by the sync and async clients.
+
+    Args:
+        base_url (str): API root, defaults to ``SEJAM_API_BASE_URL``
+        pool_size (int): Maximum kept-alive connections to the API host
+        connect_timeout (float): Seconds to wait for a connection
+        read_timeout (float): Seconds to wait for response data
+        retries (int): Extra attempts for idempotent calls
+        backoff (float): Base delay in seconds between retries
+        guard (UpstreamGuard): Circuit breaker and concurrency limit, defaults
+            to the process-wide one
+    """
+
+    def __init__(self, base_url=None, pool_size=None, connect_timeout=None,
+                 read_timeout=None, retries=None, backoff=None, guard=None):
+        self.base_url = (base_url or settings.SEJAM_API_BASE_URL).rstrip('/')
+        self.pool_size = pool_size or settings.SEJAM_HTTP_POOL_SIZE
+        self.connect_timeout = connect_timeout or settings.SEJAM_HTTP_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.SEJAM_HTTP_READ_TIMEOUT
+        self.retries = settings.SEJAM_HTTP_RETRIES if retries is None else retries
+        self.backoff = settings.SEJAM_HTTP_BACKOFF if backoff is None else backoff
+        self.guard = guard or upstream_guard
+
+    def request(self, method, path, token=None, data=None, params=None, idempotent=False,
+                retry_connect=False, name=None):
+        raise NotImplementedError
+
+    def _observe(self, name, started, status):
+        """Record one attempt's outcome in the metrics and the guard."""
+        elapsed = time.perf_counter() - started
+        metrics.upstream_seconds.observe(elapsed, name)
+        metrics.upstream_responses.inc(name, str(status))
+        self.guard.release(elapsed, status == 'error' or status >= 500)
+
+    def _prepare(self, path, token, data):
+        url = f"{self.base_url}{path}"
+        headers = {"Authorization": f"bearer {token}"} if token else None
+        body = json.dumps(data) if data is not None else None
+        return url, headers, body
+
+    def access_token(self):
+        """Exchange the configured credentials for an access token."""
+        data = {
+            "username": settings.SEJAM_API_USERNAME,
+            "password": settings.SEJAM_API_PASSWORD
+        }
+        # Issuing a token has no side effects, so it is safe to retry.
+        return self.request('POST', '/accessToken', data=data, idempotent=True, name='accessToken')
+
+    def request_otp(self, token, sh_id):
+        """Ask Sejam to send an OTP to the given identifier."""
+        # Not retried: every successful call sends the user another SMS.
+        return self.request('POST', '/kycOtp', token=token, data={"uniqueIdentifier": sh_id}, name='kycOtp')
+
+    def profile(self, token, sh_id, otp_code):
+        """Fetch the profile for an identifier using its OTP."""
+        # Sejam may consume the OTP even if the response is lost, so only a
+        # call that never reached it is retried.
+        return self.request(
+            'GET', f'/servicesWithOtp/profiles/{sh_id}', token=token,
+            params={"otp": otp_code}, retry_connect=True, name='profiles'
+        )
+
+
+class SejamClient(BaseSejamClient):
+    """Pooled, keep-alive client for the Sejam API built on ``requests``."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The pooled session for the current process."""
+        # Connections must not be shared across a fork, so a worker that
+        # inherits a session from its parent builds its own.
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._build_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def _build_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update(DEFAULT_HEADERS)
+        return session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def request(self, method, path, token=None, data=None, params=None, idempotent=False,
+                retry_connect=False, name=None):
+        """
+        Send a request to the Sejam API.
+
+        Args:
+            method (str): HTTP method
+            path (str): Path relative to the API root
+            token (str): Bearer token, if the endpoint requires one
+            data (dict): JSON body
+            params (dict): Query string parameters
+            idempotent (bool): Whether the call may be safely retried
+            retry_connect (bool): Whether the call may be retried when the
+                connection could not be made, so the request was never sent
+            name (str): Endpoint name for metrics, defaults to ``path``
+
+        Returns:
+            requests.Response: The upstream response (status not checked)
+        """
+        url, headers, body = self._prepare(path, token, data)
+        name = name or path
+        attempts = 1 + (self.retries if idempotent or retry_connect else 0)
+
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            self.guard.acquire()
+            started = time.perf_counter()
+            status = 'error'
+            try:
+                response = self.session.request(
+                    method, url, headers=headers, data=body, params=params, timeout=self.timeout
+                )
+                status = response.status_code
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if last or not (idempotent or connect_failed(e)):
+                    raise
+                logger.warning(f"Sejam {method} {path} failed ({e}), retrying")
+            else:
+                if last or not idempotent or status not in RETRY_STATUSES:
+                    return response
+                logger.warning(f"Sejam {method} {path} returned {status}, retrying")
+                response.close()
+            finally:
+                self._observe(name, started, status)
+            time.sleep(self.backoff * (2 ** attempt))
+
+
+class SejamResponse:
+    """
+    Fully read response returned by ``AsyncSejamClient``.
+
+    Mirrors the parts of ``requests.Response`` the views rely on.
+    """
+
+    def __init__(self, status_code, text, url):
+        self.status_code = status_code
+        self.text = text
+        self.url = url
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise SejamHTTPError(self)
+
+
+class SejamHTTPError(Exception):
+    """Raised by ``SejamResponse.raise_for_status`` for 4xx and 5xx responses."""
+
+    def __init__(self, response):
+        self.response = response
+        super().__init__(f"{response.status_code} Error for url: {response.url}")
+
+
+# Errors raised by AsyncSejamClient when no response was received
+ASYNC_TRANSPORT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+# The subset raised before the request was sent
+ASYNC_CONNECT_ERRORS = (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+
+
+class AsyncSejamClient(BaseSejamClient):
+    """
+    Non-blocking client for the Sejam API built on ``aiohttp``.
+
+    The underlying ``aiohttp.ClientSession`` is bound to the event loop that
+    created it, so a new one is built if the client is used from another
+    loop. Up to ``max_connections`` calls may be in flight at once; idle
+    connections are kept alive and reused.
+    """
+
+    def __init__(self, *args, max_connections=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_connections = max_connections or settings.SEJAM_HTTP_ASYNC_MAX_CONNECTIONS
+        self.timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+        self._session = None
+        self._loop = None
+
+    @property
+    def session(self):
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._loop is not loop:
+            self._session = aiohttp.ClientSession(
+                headers=DEFAULT_HEADERS,
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+            )
+            self._loop = loop
+        return self._session
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, method, path, token=None, data=None, params=None, idempotent=False,
+                      retry_connect=False, name=None):
+        """Async counterpart of ``SejamClient.request`` returning a ``SejamResponse``."""
+        url, headers, body = self._prepare(path, token, data)
+        name = name or path
+        attempts = 1 + (self.retries if idempotent or retry_connect else 0)
+
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            self.guard.acquire()
+            started = time.perf_counter()
+            status = 'error'
+            try:
+                async with self.session.request(
+                    method, url, headers=headers, data=body, params=params
+                ) as response:
+                    result = SejamResponse(response.status, await response.text(), str(response.url))
+                status = result.status_code
+            except ASYNC_TRANSPORT_ERRORS as e:
+                if last or not (idempotent or isinstance(e, ASYNC_CONNECT_ERRORS)):
+                    raise
+                logger.warning(f"Sejam {method} {path} failed ({e!r}), retrying")
+            else:
+                if last or not idempotent or status not in RETRY_STATUSES:
+                    return result
+                logger.warning(f"Sejam {method} {path} returned {status}, retrying")
+            finally:
+                self._observe(name, started, status)
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide ``SejamClient``."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SejamClient()
+    return _client
+
+
+_async_client = None
+
+
+def get_async_client():
+    """Return the process-wide ``AsyncSejamClient``."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncSejamClient()
+    return _async_client
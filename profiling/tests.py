@@ -1,3 +1,1286 @@
-from django.test import TestCase
+import asyncio
+import base64
+import contextlib
+import csv
+import datetime
+import importlib
+import io
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from sejam import urls as project_urls
+
+from . import urls as otp_urls
+from .async_views import AsyncBatchOTPView, AsyncGetOTPView, AsyncValidateOTPView
+from .changes import get_changes
+from .error_sink import ErrorSink
+from .exports import export
+from .fields import Compressed
+from .importer import ProfileImporter
+from .mapping import build_response, map_profile
+from .metrics import REGISTRY, Counter, Histogram, Registry, query_budget_exceeded, upstream_responses
+from .models import (
+    AccessToken, Account, ErrorLog, Profile, QueuedProfileWrite, SearchTerm, Shareholder, TradingCode,
+)
+from .otp_coalescer import OTPCoalescer
+from .profile_queue import claim, complete, drain, enqueue, queue_stats
+from .query_budget import QueryBudgetExceeded, QueryBudgetMiddleware, track_queries
+from .request_profiler import RequestProfilerMiddleware, make_token
+from .search import matching_profile_ids, normalize, search_profiles
+from .sejam_client import SejamClient, SejamResponse
+from .throttling import OTPIdentifierThrottle
+from .token_cache import RELEASE_LOCK_SCRIPT, TokenCache
+from .upstream_guard import AdaptiveLimiter, CircuitBreaker, UpstreamGuard, UpstreamUnavailable
+from .views import get_profile_document, persist_profile, save_profile, store_profile
+
+
+def legal_person_payload(shareholders):
+    """Build a Sejam profiles payload for a legal person."""
+    return {
+        'uniqueIdentifier': '10100000001',
+        'type': 'IranianLegalPerson',
+        'mobile': '09120000000',
+        'legalPerson': {'companyName': 'شرکت نمونه', 'economicCode': '411111111111'},
+        'legalPersonShareholders': [
+            {'uniqueIdentifier': uid, 'firstName': first, 'lastName': 'احمدی', 'positionType': position}
+            for uid, first, position in shareholders
+        ],
+        'accounts': [],
+        'tradingCodes': [],
+    }
+
+
+def private_person_payload():
+    """Build a Sejam profiles payload for a private person with one account."""
+    return {
+        'uniqueIdentifier': '0012345678',
+        'type': 'IranianPrivatePerson',
+        'mobile': '09120000000',
+        'privatePerson': {'firstName': 'مریم', 'lastName': 'کاظمی'},
+        'accounts': [{'sheba': 'IR000000000000000000000001', 'accountNumber': '1', 'bank': {'name': 'ملت'}}],
+        'tradingCodes': [{'code': 'کاظ12345'}],
+    }
+
+
+def basic_auth(username, password):
+    """Build an ``Authorization`` header value for HTTP Basic auth."""
+    return 'Basic ' + base64.b64encode(f'{username}:{password}'.encode()).decode()
+
+
+@override_settings(SEJAM_TOKEN_BACKGROUND_REFRESH=False)
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.refresh = mock.Mock(side_effect=self._make_token)
+
+    def _make_token(self, ttl=3600):
+        AccessToken.objects.all().delete()
+        return AccessToken.objects.create(
+            token='fresh-token',
+            token_end_time=timezone.now() + datetime.timedelta(seconds=ttl),
+        )
+
+    def test_refreshes_when_no_token_exists(self):
+        token_cache = TokenCache(self.refresh)
+        self.assertEqual(token_cache.get(), 'fresh-token')
+        self.assertEqual(self.refresh.call_count, 1)
+
+    def test_cached_token_skips_database(self):
+        token_cache = TokenCache(self.refresh)
+        token_cache.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(token_cache.get(), 'fresh-token')
+
+    def test_shared_copy_is_used_by_other_instances(self):
+        TokenCache(self.refresh).get()
+        with self.assertNumQueries(0):
+            self.assertEqual(TokenCache(self.refresh).get(), 'fresh-token')
+        self.assertEqual(self.refresh.call_count, 1)
+
+    def test_stale_token_is_served_while_refresh_is_locked(self):
+        AccessToken.objects.create(
+            token='stale-token',
+            token_end_time=timezone.now() + datetime.timedelta(seconds=10),
+        )
+        token_cache = TokenCache(self.refresh, margin=60)
+        cache.add(token_cache.lock_key, 1)
+        self.assertEqual(token_cache.get(), 'stale-token')
+        self.refresh.assert_not_called()
+
+    def test_lock_taken_over_by_another_owner_is_not_released(self):
+        token_cache = TokenCache(self.refresh)
+
+        def slow_refresh():
+            # Our lock expired mid-refresh and another worker took it
+            cache.set(token_cache.lock_key, 'other-owner')
+            return self._make_token()
+
+        token_cache.refresh = slow_refresh
+        self.assertEqual(token_cache.get(), 'fresh-token')
+        self.assertEqual(cache.get(token_cache.lock_key), 'other-owner')
+
+    def test_lock_is_released_by_script_when_redis_url_is_set(self):
+        client = mock.Mock()
+        token_cache = TokenCache(self.refresh, lock_redis_url='redis://lock-host/0')
+        with mock.patch('profiling.token_cache.lock_client', return_value=client) as lock_client:
+            self.assertEqual(token_cache.get(), 'fresh-token')
+        lock_client.assert_called_once_with('redis://lock-host/0')
+        script, numkeys, key, owner = client.eval.call_args.args
+        self.assertEqual((script, numkeys), (RELEASE_LOCK_SCRIPT, 1))
+        self.assertEqual(key, cache.make_and_validate_key(token_cache.lock_key))
+        # The cache API was not used to release it
+        self.assertEqual(cache.get(token_cache.lock_key), owner)
+
+    def test_waiter_takes_the_lock_when_holder_gives_up(self):
+        token_cache = TokenCache(self.refresh, lock_timeout=5)
+        cache.add(token_cache.lock_key, 'failed-holder')
+        timer = threading.Timer(0.1, cache.delete, [token_cache.lock_key])
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(token_cache.get(), 'fresh-token')
+        self.assertEqual(self.refresh.call_count, 1)
+        self.assertIsNone(cache.get(token_cache.lock_key))
+
+    def test_expired_token_is_replaced(self):
+        AccessToken.objects.create(
+            token='old-token',
+            token_end_time=timezone.now() - datetime.timedelta(seconds=1),
+        )
+        self.assertEqual(TokenCache(self.refresh).get(), 'fresh-token')
+        self.assertEqual(self.refresh.call_count, 1)
+
+    def test_refresher_renews_ahead_of_request_margin(self):
+        AccessToken.objects.create(
+            token='expiring-token',
+            token_end_time=timezone.now() + datetime.timedelta(seconds=200),
+        )
+        token_cache = TokenCache(self.refresh, margin=60, refresh_ahead=300)
+        self.assertEqual(token_cache.get(), 'expiring-token')
+        self.refresh.assert_not_called()
+
+        due_in = token_cache.refresh_if_due()
+        self.assertEqual(self.refresh.call_count, 1)
+        self.assertAlmostEqual(due_in, 3300, delta=5)
+        self.assertEqual(token_cache.get(), 'fresh-token')
+
+        # Not due again until refresh_ahead seconds before the new expiry
+        token_cache.refresh_if_due()
+        self.assertEqual(self.refresh.call_count, 1)
+
+
+class SejamClientTests(TestCase):
+    def _response(self, status_code):
+        return mock.Mock(status_code=status_code)
+
+    def test_idempotent_calls_are_retried(self):
+        client = SejamClient(base_url='http://sejam.test', retries=2, backoff=0)
+        with mock.patch.object(requests.Session, 'request', side_effect=[
+            requests.exceptions.ConnectionError(), self._response(503), self._response(200),
+        ]) as send:
+            response = client.access_token()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual(send.call_args.kwargs['timeout'], client.timeout)
+
+    def test_profile_is_retried_only_when_never_sent(self):
+        client = SejamClient(base_url='http://sejam.test', retries=2, backoff=0)
+        with mock.patch.object(requests.Session, 'request', side_effect=[
+            requests.exceptions.ConnectTimeout(), self._response(200),
+        ]) as send:
+            self.assertEqual(client.profile('token', '0012345678', '123456').status_code, 200)
+        self.assertEqual(send.call_count, 2)
+
+        with mock.patch.object(requests.Session, 'request', side_effect=requests.exceptions.ReadTimeout()) as send:
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                client.profile('token', '0012345678', '123456')
+        self.assertEqual(send.call_count, 1)
+
+        with mock.patch.object(requests.Session, 'request', return_value=self._response(503)) as send:
+            self.assertEqual(client.profile('token', '0012345678', '123456').status_code, 503)
+        self.assertEqual(send.call_count, 1)
+
+    def test_otp_requests_are_not_retried(self):
+        client = SejamClient(base_url='http://sejam.test', retries=2, backoff=0)
+        with mock.patch.object(requests.Session, 'request', return_value=self._response(503)) as send:
+            response = client.request_otp('token', '0012345678')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(send.call_count, 1)
+
+    def test_session_is_reused(self):
+        client = SejamClient(base_url='http://sejam.test')
+        self.assertIs(client.session, client.session)
+
+
+@override_settings(SEJAM_ERROR_LOG_BUFFERED=False)
+# Basic auth checks a password on every request; skip the slow hasher
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    async def _get_otp(self, status_code):
+        client = mock.Mock()
+        client.request_otp = mock.AsyncMock(return_value=SejamResponse(status_code, '{}', 'http://sejam.test'))
+        request = RequestFactory().get('/otp/get_otp/0012345678/')
+        request.user = AnonymousUser()
+        with mock.patch('profiling.async_views.aget_valid_token', mock.AsyncMock(return_value='token')), \
+                mock.patch('profiling.async_views.get_async_client', return_value=client):
+            return await AsyncGetOTPView.as_view()(request, sh_id='0012345678')
+
+    async def test_get_otp(self):
+        response = await self._get_otp(200)
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {'id': '0012345678', 'status': 200, 'coalesced': False})
+
+    async def test_get_otp_upstream_error_is_logged(self):
+        response = await self._get_otp(500)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await ErrorLog.objects.acount(), 1)
+
+    async def test_batch_token_failure_is_reported_before_streaming(self):
+        await sync_to_async(User.objects.create_user)('ops', password='secret', is_staff=True)
+        request = RequestFactory().post('/otp/batch_otp/', {'ids': ['1']}, content_type='application/json',
+                                        HTTP_AUTHORIZATION=basic_auth('ops', 'secret'))
+        with mock.patch('profiling.async_views.aget_valid_token',
+                        mock.AsyncMock(side_effect=UpstreamUnavailable('open', 7))):
+            response = await AsyncBatchOTPView.as_view()(request)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+
+
+    async def test_credentials_are_authenticated_as_by_the_sync_views(self):
+        await sync_to_async(User.objects.create_user)('ops', password='secret', is_staff=True)
+        # An empty batch is rejected after authentication and before any upstream call
+        for password, status in (('secret', 400), ('wrong', 403)):
+            headers = {'HTTP_AUTHORIZATION': basic_auth('ops', password)}
+            sync_response = await sync_to_async(APIClient().post)(
+                '/otp/batch_otp/', {'ids': []}, format='json', **headers
+            )
+            request = RequestFactory().post('/otp/batch_otp/', {'ids': []}, content_type='application/json',
+                                            **headers)
+            async_response = await AsyncBatchOTPView.as_view()(request)
+            for response in (sync_response, async_response):
+                self.assertEqual(response.status_code, status)
+            self.assertEqual(async_response.get('WWW-Authenticate'), sync_response.get('WWW-Authenticate'))
+
+    async def test_session_without_csrf_token_is_rejected(self):
+        request = RequestFactory().post('/otp/batch_otp/', {'ids': ['1']}, content_type='application/json')
+        request.user = User(username='ops', is_staff=True)
+        response = await AsyncBatchOTPView.as_view()(request)
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('CSRF Failed', json.loads(response.content)['detail'])
+
+
+class BatchOTPViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User(username='ops', is_staff=True))
+        self.sejam = mock.Mock()
+        self.sejam.request_otp.side_effect = lambda token, sh_id: mock.Mock(
+            status_code=200, raise_for_status=mock.Mock()
+        )
+        patches = [
+            mock.patch('profiling.views.get_valid_token', return_value='token'),
+            mock.patch('profiling.views.get_client', return_value=self.sejam),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _post(self, body):
+        return self.client.post('/otp/batch_otp/', body, format='json')
+
+    def test_streams_one_line_per_unique_id(self):
+        response = self._post({'ids': ['1', '2', '2', 3], 'concurrency': 2})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted(line['id'] for line in lines), ['1', '2', '3'])
+        self.assertTrue(all(line['status'] == 200 for line in lines))
+        for call in self.sejam.request_otp.call_args_list:
+            self.assertEqual(call.args[0], 'token')
+
+    def test_token_failure_is_reported_before_streaming(self):
+        for error, status_code in [
+            (UpstreamUnavailable('open', 7), 503), (requests.exceptions.ConnectionError(), 500),
+        ]:
+            with mock.patch('profiling.views.get_valid_token', side_effect=error):
+                response = self._post({'ids': ['1']})
+            self.assertEqual(response.status_code, status_code)
+            self.assertFalse(response.streaming)
+        self.sejam.request_otp.assert_not_called()
+
+    def test_rejects_invalid_body(self):
+        self.assertEqual(self._post({'ids': []}).status_code, 400)
+        self.assertEqual(self._post({'ids': ['1'], 'concurrency': 0}).status_code, 400)
+
+    def test_requires_staff(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self._post({'ids': ['1']}).status_code, 403)
+
+
+class ShareholderSyncTests(TestCase):
+    def setUp(self):
+        save_profile(legal_person_payload([
+            ('001', 'علی', 'Ceo'), ('002', 'مریم', 'Member'), ('003', 'رضا', 'Member'),
+        ]))
+
+    def _shareholders(self):
+        return {
+            sh.unique_identifier: (sh.first_name, sh.position)
+            for sh in Shareholder.objects.all()
+        }
+
+    def test_unchanged_shareholders_are_not_written(self):
+        ids = set(Shareholder.objects.values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            save_profile(legal_person_payload([
+                ('001', 'علی', 'Ceo'), ('002', 'مریم', 'Member'), ('003', 'رضا', 'Member'),
+            ]))
+        self.assertFalse([q for q in queries if 'profiling_shareholder' in q['sql']
+                          and not q['sql'].startswith('SELECT')])
+        self.assertEqual(set(Shareholder.objects.values_list('pk', flat=True)), ids)
+
+    def test_diff_is_applied(self):
+        save_profile(legal_person_payload([
+            ('001', 'علی', 'Chairman'), ('003', 'رضا', 'Member'), ('004', 'سارا', 'Member'),
+        ]))
+        self.assertEqual(self._shareholders(), {
+            '001': ('علی', 'رئیس هیئت مدیره'),
+            '003': ('رضا', 'عضو هیئت مدیره'),
+            '004': ('سارا', 'عضو هیئت مدیره'),
+        })
+        self.assertEqual(Profile.objects.count(), 1)
+
+
+class MappingTests(TestCase):
+    """Pin the mapping rules of the original hand-written code."""
+
+    def _map(self, payload):
+        fields, shareholders = map_profile(payload)
+        del fields['raw_data']
+        return fields, shareholders
+
+    def test_private_person(self):
+        payload = private_person_payload()
+        payload['privatePerson']['fatherName'] = ' رضا '
+        payload['accounts'][0].update(branchCode=' 12 ', branchCity={'name': 'تهران'})
+        fields, shareholders = self._map(payload)
+        self.assertIsNone(shareholders)
+        self.assertEqual(fields, {
+            'person_type': 'IranianPrivatePerson', 'mobile': '09120000000', 'email': '',
+            'first_name': 'مریم', 'last_name': 'کاظمی', 'father_name': 'رضا', 'gender': '',
+            'birth_date': '', 'place_of_birth': '', 'place_of_issue': '',
+            'trade_code': 'کاظ12345', 'sheba': 'IR000000000000000000000001', 'bank_account_number': '1',
+            'bank_branch_code': '12', 'bank_branch_name': '', 'bank_name': 'ملت', 'bank_branch_city': 'تهران',
+        })
+        response = build_response(Profile(unique_identifier='0012345678', **fields))
+        self.assertEqual(list(response), [
+            'uniqueIdentifier', 'type', 'firstName', 'lastName', 'fatherName', 'gender', 'birthDate',
+            'placeOfBirth', 'placeOfIssue', 'mobile', 'email', 'tradeCode', 'sheba', 'bank_name',
+            'bank_branchCode', 'bank_branchName', 'bank_branchCity', 'bank_accountNumber',
+        ])
+        self.assertEqual((response['fatherName'], response['bank_branchCity']), ('رضا', 'تهران'))
+
+    def test_legal_person(self):
+        payload = legal_person_payload([('001', ' علی ', 'Ceo'), ('002', 'مریم', 'Auditor'), ('001', 'رضا', 'Member')])
+        fields, shareholders = self._map(payload)
+        self.assertEqual(fields, {
+            'person_type': 'IranianLegalPerson', 'mobile': '09120000000', 'email': '',
+            'company_name': 'شرکت نمونه', 'economic_code': '411111111111',
+            'register_date': '', 'register_place': '', 'register_number': '',
+        })
+        self.assertEqual(
+            [(sh.unique_identifier, sh.first_name, sh.position) for sh in shareholders],
+            [('001', 'علی', 'مدیرعامل'), ('002', 'مریم', 'Auditor'), ('001', 'رضا', 'عضو هیئت مدیره')],
+        )
+        response = build_response(Profile(unique_identifier='10100000001', **fields), shareholders)
+        self.assertEqual(list(response)[:8], [
+            'uniqueIdentifier', 'type', 'companyName', 'economicCode', 'registerDate', 'registerPlace',
+            'registerNumber', 'shareHolders',
+        ])
+        self.assertEqual(response['shareHolders'], {
+            '001': {'Name': 'رضا', 'LastName': 'احمدی', 'position': 'عضو هیئت مدیره'},
+            '002': {'Name': 'مریم', 'LastName': 'احمدی', 'position': 'Auditor'},
+        })
+
+    def test_missing_bank_objects_keep_stored_values(self):
+        payload = private_person_payload()
+        payload['accounts'][0]['branchCity'] = None
+        del payload['accounts'][0]['bank']
+        fields, _ = self._map(payload)
+        self.assertEqual(fields['sheba'], 'IR000000000000000000000001')
+        self.assertNotIn('bank_name', fields)
+        self.assertNotIn('bank_branch_city', fields)
+
+        fields, _ = self._map(dict(payload, accounts=[], tradingCodes=None))
+        for field in ('trade_code', 'sheba', 'bank_account_number', 'bank_name', 'bank_branch_city'):
+            self.assertNotIn(field, fields)
+
+    def test_person_section_is_required(self):
+        payload = private_person_payload()
+        del payload['privatePerson']
+        with self.assertRaises(KeyError):
+            map_profile(payload)
+
+    def test_unknown_person_type(self):
+        fields, shareholders = self._map(dict(private_person_payload(), type='ForeignPerson'))
+        self.assertIsNone(shareholders)
+        self.assertNotIn('first_name', fields)
+        self.assertEqual(fields['sheba'], 'IR000000000000000000000001')
+        # Answered in the legal person format, as it always was
+        response = build_response(Profile(unique_identifier='0012345678', **fields))
+        self.assertEqual((response['type'], response['shareHolders']), ('ForeignPerson', {}))
+
+
+class StoreProfileTests(TestCase):
+    def setUp(self):
+        self.payload = legal_person_payload([('001', 'علی', 'Ceo')])
+        store_profile(self.payload)
+
+    def test_unchanged_payload_causes_no_writes(self):
+        with CaptureQueriesContext(connection) as queries:
+            store_profile(json.loads(json.dumps(self.payload)))
+        self.assertEqual([q['sql'] for q in queries if not q['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))], [])
+
+    def test_changed_payload_updates_only_changed_fields(self):
+        self.payload['mobile'] = '09121111111'
+        with CaptureQueriesContext(connection) as queries:
+            store_profile(self.payload)
+        # The change feed's sequence number is stamped separately, at the end
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE') and 'change_seq' not in q['sql']
+                   and 'profiling_changecounter' not in q['sql']]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"mobile"', updates[0])
+        self.assertNotIn('"company_name"', updates[0])
+        self.assertEqual(Profile.objects.get().mobile, '09121111111')
+
+
+class ProfileDocumentTests(TestCase):
+    def setUp(self):
+        self.payload = legal_person_payload([('001', 'علی', 'Ceo'), ('002', 'مریم', 'Member')])
+
+    def test_response_needs_no_query_after_store(self):
+        document = save_profile(self.payload)
+        self.assertEqual(list(document['shareHolders']), ['001', '002'])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(save_profile(json.loads(json.dumps(self.payload))), document)
+        self.assertFalse([q for q in queries if 'profiling_shareholder' in q['sql']])
+
+    def test_stored_document_is_served_in_one_query(self):
+        document = save_profile(self.payload)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_profile_document('10100000001'), document)
+
+    def test_document_is_built_for_older_rows(self):
+        document = save_profile(self.payload)
+        Profile.objects.update(response_data=None)
+        self.assertEqual(get_profile_document('10100000001'), document)
+        self.assertEqual(Profile.objects.get().response_data, document)
+
+    def test_endpoint_requires_staff(self):
+        save_profile(self.payload)
+        client = APIClient()
+        self.assertEqual(client.get('/otp/profiles/10100000001/').status_code, 403)
+        client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(client.get('/otp/profiles/10100000001/').data['companyName'], 'شرکت نمونه')
+        self.assertEqual(client.get('/otp/profiles/missing/').status_code, 404)
+
+
+class LookupTests(TestCase):
+    def setUp(self):
+        self.payload = legal_person_payload([])
+        self.payload['accounts'] = [
+            {'sheba': 'IR01', 'accountNumber': '1', 'bank': {'name': 'ملت'}},
+            {'sheba': 'IR02', 'accountNumber': '2'},
+        ]
+        self.payload['tradingCodes'] = [{'code': 'TC1'}, {'code': 'TC2'}]
+        save_profile(self.payload)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+
+    def _lookup(self, kind, value):
+        return self.client.get(f'/otp/lookup/{kind}/{value}/')
+
+    def test_every_account_and_code_is_stored(self):
+        self.assertEqual(dict(Account.objects.values_list('sheba', 'bank_name')), {'IR01': 'ملت', 'IR02': ''})
+        self.assertEqual(set(TradingCode.objects.values_list('code', flat=True)), {'TC1', 'TC2'})
+        # Only the first account still feeds the profile fields
+        self.assertEqual(Profile.objects.get().sheba, 'IR01')
+
+    def test_finds_owners_by_any_value(self):
+        owner = [{'uniqueIdentifier': '10100000001', 'type': 'IranianLegalPerson'}]
+        self.assertEqual(self._lookup('sheba', 'IR02').data['profiles'], owner)
+        self.assertEqual(self._lookup('trade_code', 'TC2').data['profiles'], owner)
+        self.assertEqual(self._lookup('mobile', '09120000000').data['profiles'], owner)
+        self.assertEqual(self._lookup('sheba', 'IR03').data['profiles'], [])
+        self.assertEqual(self._lookup('email', 'x').status_code, 400)
+
+    def test_changed_payload_is_synced(self):
+        self.payload['accounts'] = [{'sheba': 'IR02', 'accountNumber': '22'}]
+        self.payload['tradingCodes'] = []
+        save_profile(self.payload)
+        self.assertEqual(list(Account.objects.values_list('sheba', 'account_number')), [('IR02', '22')])
+        self.assertFalse(TradingCode.objects.exists())
+
+    def test_backfill_from_raw_data(self):
+        Account.objects.all().delete()
+        call_command('backfill_holdings', stdout=io.StringIO())
+        self.assertEqual(self._lookup('sheba', 'IR01').data['profiles'][0]['uniqueIdentifier'], '10100000001')
+
+
+class CompressedRawDataTests(TestCase):
+    def setUp(self):
+        self.payload = legal_person_payload([('001', 'علی', 'Ceo')])
+        store_profile(self.payload)
+
+    def test_stored_compressed_and_decoded_on_access(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT raw_data FROM profiling_profile')
+            stored = bytes(cursor.fetchone()[0])
+        self.assertLess(len(stored), len(json.dumps(self.payload)))
+        profile = Profile.objects.get()
+        self.assertIsInstance(profile.__dict__['raw_data'], Compressed)
+        self.assertEqual(profile.raw_data, self.payload)
+
+    def test_unread_document_is_saved_unchanged(self):
+        profile = Profile.objects.get()
+        profile.mobile = '09121111111'
+        profile.save()
+        self.assertIsInstance(profile.__dict__['raw_data'], Compressed)
+        self.assertEqual(Profile.objects.get().raw_data, self.payload)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        save_profile(legal_person_payload([('001', 'علی', 'Ceo'), ('002', 'مريم', 'Member')]))
+        save_profile(dict(legal_person_payload([]), uniqueIdentifier='0012345678', type='IranianPrivatePerson',
+                          privatePerson={'firstName': 'علی', 'lastName': 'نیک‌نام'}))
+
+    def _ids(self, query):
+        return [result['uniqueIdentifier'] for result in search_profiles(query)]
+
+    def test_normalizes_persian_variants(self):
+        self.assertEqual(normalize('مريم  كاظمی نیک‌نام'), ['مریم', 'کاظمی', 'نیکنام'])
+        # Stored with Arabic Yeh, found with Persian Yeh and a prefix
+        self.assertEqual(self._ids('مری'), ['10100000001'])
+        self.assertEqual(self._ids('نيكنام'), ['0012345678'])
+
+    def test_own_name_ranks_above_shareholder(self):
+        self.assertEqual(self._ids('علی'), ['0012345678', '10100000001'])
+        self.assertEqual(self._ids('علی نیک'), ['0012345678'])
+        self.assertEqual(self._ids('نمونه'), ['10100000001'])
+        self.assertEqual(self._ids('ع'), [])
+
+    def test_index_follows_changes(self):
+        save_profile(legal_person_payload([('001', 'رضا', 'Ceo')]))
+        self.assertEqual(self._ids('مریم'), [])
+        self.assertEqual(self._ids('رضا'), ['10100000001'])
+        SearchTerm.objects.all().delete()
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(self._ids('رضا'), ['10100000001'])
+
+    def test_profile_deleted_after_matching_is_skipped(self):
+        matches = matching_profile_ids('علی', 20)
+        Profile.objects.filter(pk='0012345678').delete()
+        with mock.patch('profiling.search.matching_profile_ids', return_value=matches):
+            self.assertEqual(self._ids('علی'), ['10100000001'])
+
+    def test_admin_search_uses_index(self):
+        self.client.force_login(User.objects.create_superuser('root'))
+        response = self.client.get('/admin/profiling/profile/', {'q': 'مری'})
+        self.assertEqual([p.pk for p in response.context['cl'].result_list], ['10100000001'])
+
+    def test_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        results = client.get('/otp/search/', {'q': 'شرکت'}).data['results']
+        self.assertEqual([(r['uniqueIdentifier'], r['name']) for r in results], [('10100000001', 'شرکت نمونه')])
+
+
+@override_settings(SEJAM_PROFILE_WRITE_MODE='queue')
+class ProfileQueueTests(TestCase):
+    def setUp(self):
+        self.payload = legal_person_payload([('001', 'علی', 'Ceo')])
+
+    def test_response_is_built_before_writing(self):
+        document = persist_profile(self.payload)
+        self.assertFalse(Profile.objects.exists())
+        self.assertEqual(queue_stats()[0], 1)
+
+        self.assertEqual(drain(), 1)
+        self.assertEqual(get_profile_document('10100000001'), document)
+        self.assertEqual(Shareholder.objects.count(), 1)
+        self.assertFalse(QueuedProfileWrite.objects.exists())
+
+    def test_latest_payload_per_identifier_is_kept(self):
+        persist_profile(self.payload)
+        persist_profile(dict(self.payload, mobile='09121111111'))
+        self.assertEqual(QueuedProfileWrite.objects.get().payload['mobile'], '09121111111')
+
+    def test_payload_replaced_while_writing_stays_queued(self):
+        persist_profile(self.payload)
+        entries = claim()
+        self.assertEqual(claim(), [])
+        persist_profile(dict(self.payload, mobile='09121111111'))
+        complete(entries)
+        entry = QueuedProfileWrite.objects.get()
+        self.assertEqual((entry.payload['mobile'], entry.leased_until), ('09121111111', None))
+
+    def test_expired_lease_is_claimed_again(self):
+        persist_profile(self.payload)
+        claim()
+        QueuedProfileWrite.objects.update(leased_until=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual([entry.attempts for entry in claim()], [2])
+
+    @override_settings(SEJAM_PROFILE_QUEUE_MAX_ATTEMPTS=2)
+    def test_poison_payload_is_isolated_and_given_up_on(self):
+        for uid in ('1', 'poison', '2', '3'):
+            persist_profile(dict(self.payload, uniqueIdentifier=uid))
+        import_batch = ProfileImporter.import_batch
+
+        def failing_import_batch(importer, payloads):
+            if any(payload['uniqueIdentifier'] == 'poison' for payload in payloads):
+                raise ValueError("bad payload")
+            return import_batch(importer, payloads)
+
+        with mock.patch.object(ProfileImporter, 'import_batch', failing_import_batch), \
+                self.assertLogs('profiling.profile_queue', 'ERROR'):
+            self.assertEqual(drain(), 4)
+            self.assertEqual(sorted(Profile.objects.values_list('pk', flat=True)), ['1', '2', '3'])
+            entry = QueuedProfileWrite.objects.get()
+            self.assertEqual((entry.attempts, entry.last_error, entry.dead_at), (1, 'bad payload', None))
+
+            QueuedProfileWrite.objects.update(leased_until=timezone.now() - datetime.timedelta(seconds=1))
+            self.assertEqual(drain(), 1)
+        self.assertIsNotNone(QueuedProfileWrite.objects.get().dead_at)
+        self.assertEqual(claim(), [])
+        self.assertEqual(queue_stats(), (0, 0.0, 1))
+
+        # A newer payload gets a fresh set of attempts
+        persist_profile(dict(self.payload, uniqueIdentifier='poison'))
+        self.assertEqual(drain(), 1)
+        self.assertTrue(Profile.objects.filter(pk='poison').exists())
+
+    def test_unmappable_payload_is_marked_dead_not_dropped(self):
+        persist_profile(self.payload)
+        malformed = dict(self.payload, uniqueIdentifier='malformed')
+        del malformed['legalPerson']
+        enqueue(malformed)
+        with self.assertLogs('profiling.importer', 'ERROR'):
+            self.assertEqual(drain(), 2)
+        self.assertEqual(list(Profile.objects.values_list('pk', flat=True)), ['10100000001'])
+        entry = QueuedProfileWrite.objects.get()
+        self.assertEqual(entry.unique_identifier, 'malformed')
+        self.assertIsNotNone(entry.dead_at)
+        self.assertIn('legalPerson', entry.last_error)
+
+    def test_lag_is_exported(self):
+        persist_profile(self.payload)
+        QueuedProfileWrite.objects.update(enqueued_at=timezone.now() - datetime.timedelta(seconds=30))
+        with CaptureQueriesContext(connection) as queries:
+            rendered = REGISTRY.render()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('sejam_profile_queue_depth{pid=', rendered)
+        self.assertIn('sejam_profile_queue_dead{pid=', rendered)
+        lag = next(line for line in rendered.splitlines() if line.startswith('sejam_profile_queue_lag_seconds{'))
+        self.assertGreaterEqual(float(lag.split()[-1]), 30)
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        for uid in ('1', '2', '3'):
+            save_profile(dict(legal_person_payload([('001', 'علی', 'Ceo')]), uniqueIdentifier=uid))
+
+    def _sync(self, cursor=None, limit=2):
+        changes = []
+        while True:
+            page, cursor, has_more = get_changes(cursor, limit=limit)
+            changes.extend((change['op'], change['uniqueIdentifier']) for change in page)
+            if not has_more:
+                return changes, cursor
+
+    def test_pages_through_everything_then_only_new_changes(self):
+        changes, cursor = self._sync()
+        self.assertEqual(changes, [('upsert', '1'), ('upsert', '2'), ('upsert', '3')])
+        self.assertEqual(self._sync(cursor)[0], [])
+
+        save_profile(dict(legal_person_payload([('002', 'رضا', 'Ceo')]), uniqueIdentifier='2'))
+        Profile.objects.filter(pk='1').delete()
+        changes, cursor = self._sync(cursor)
+        self.assertEqual(changes, [('upsert', '2'), ('delete', '1')])
+        self.assertEqual(get_changes(since=timezone.now() + datetime.timedelta(minutes=1))[0], [])
+        page, _, _ = get_changes(since=timezone.now() - datetime.timedelta(minutes=1), limit=5)
+        self.assertEqual(page[1]['profile']['shareHolders'], {'002': {'Name': 'رضا', 'LastName': 'احمدی', 'position': 'مدیرعامل'}})
+
+    def test_changes_follow_commit_order_not_timestamps(self):
+        _, cursor = self._sync()
+        # A long import stamps its rows with the time its batch started
+        started = timezone.now() - datetime.timedelta(hours=1)
+        with mock.patch('django.utils.timezone.now', return_value=started):
+            ProfileImporter().import_batch([
+                dict(legal_person_payload([]), uniqueIdentifier='4'),
+                dict(legal_person_payload([('003', 'سارا', 'Ceo')]), uniqueIdentifier='1'),
+            ])
+        self.assertEqual(self._sync(cursor)[0], [('upsert', '1'), ('upsert', '4')])
+
+    def test_documents_of_older_rows_are_built_without_writes(self):
+        expected = get_changes()[0]
+        Profile.objects.update(response_data=None)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(get_changes()[0], expected)
+        self.assertEqual(len(queries), 3)  # profiles, tombstones, shareholders
+        self.assertFalse(Profile.objects.exclude(response_data=None).exists())
+
+    def test_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        data = client.get('/otp/changes/', {'limit': 2}).data
+        self.assertEqual([c['uniqueIdentifier'] for c in data['changes']], ['1', '2'])
+        self.assertTrue(data['has_more'])
+        data = client.get('/otp/changes/', {'cursor': data['cursor']}).data
+        self.assertEqual(([c['uniqueIdentifier'] for c in data['changes']], data['has_more']), (['3'], False))
+        self.assertEqual(client.get('/otp/changes/', {'cursor': 'bogus'}).status_code, 400)
+
+
+class RequestProfilerTests(TestCase):
+    def setUp(self):
+        save_profile(legal_person_payload([('001', 'علی', 'Ceo')]))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(SEJAM_REQUEST_PROFILE_DIR=self.directory, SEJAM_REQUEST_PROFILE_MAX_FILES=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _get(self, **headers):
+        return self.client.get('/otp/profiles/10100000001/', headers=headers)
+
+    def test_only_signed_requests_are_captured(self):
+        self.assertNotIn('X-Sejam-Profile-Id', self._get())
+        self.assertNotIn('X-Sejam-Profile-Id', self._get(**{'X-Sejam-Profile': 'profile:forged:sig'}))
+        self.assertEqual(os.listdir(self.directory), [])
+
+        response = self._get(**{'X-Sejam-Profile': make_token()})
+        self.assertEqual(response.data['companyName'], 'شرکت نمونه')
+        capture_id = response['X-Sejam-Profile-Id']
+        with open(os.path.join(self.directory, f'{capture_id}.json'), encoding='utf-8') as summary:
+            summary = json.load(summary)
+        self.assertEqual((summary['status'], summary['query_count']), (200, len(summary['queries'])))
+        self.assertTrue(any('profiling_profile' in query['sql'] for query in summary['queries']))
+
+    def test_captures_are_rotated_and_aggregated(self):
+        for _ in range(3):
+            self._get(**{'X-Sejam-Profile': make_token()})
+        self.assertEqual(len([name for name in os.listdir(self.directory) if name.endswith('.prof')]), 2)
+        out = io.StringIO()
+        call_command('request_profiles', path='profiles', stdout=out)
+        self.assertIn('2 requests', out.getvalue())
+        self.assertIn('get_profile_document', out.getvalue())
+        self.assertIn('profiling_profile', out.getvalue())
+
+    def _summary(self, response):
+        with open(os.path.join(self.directory, f"{response['X-Sejam-Profile-Id']}.json"), encoding='utf-8') as summary:
+            return json.load(summary)
+
+    def test_view_errors_are_handled_as_usual(self):
+        client = APIClient(raise_request_exception=False)
+        client.force_authenticate(self.user)
+        with mock.patch('profiling.views.get_profile_document', side_effect=RuntimeError):
+            response = client.get('/otp/profiles/10100000001/', headers={'X-Sejam-Profile': make_token()})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self._summary(response)['status'], 500)
+
+    async def test_runs_natively_under_asgi(self):
+        async def get_response(request):
+            return None
+
+        self.assertTrue(iscoroutinefunction(RequestProfilerMiddleware(get_response)))
+
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get('/otp/profiles/10100000001/', headers={'X-Sejam-Profile': make_token()})
+        self.assertEqual(response.status_code, 200)
+        # The sync view runs in a worker thread; its statements are still recorded
+        summary = await sync_to_async(self._summary)(response)
+        self.assertTrue(any('profiling_profile' in query['sql'] for query in summary['queries']))
+
+    async def test_async_views_are_profiled(self):
+        client = mock.Mock()
+        client.request_otp = mock.AsyncMock(return_value=SejamResponse(200, '{}', 'http://sejam.test'))
+
+        async def get_response(request):
+            return await AsyncGetOTPView.as_view()(request, sh_id='0012345678')
+
+        request = RequestFactory().get('/otp/get_otp/0012345678/', headers={'X-Sejam-Profile': make_token()})
+        request.user = AnonymousUser()
+        with mock.patch('profiling.async_views.aget_valid_token', mock.AsyncMock(return_value='token')), \
+                mock.patch('profiling.async_views.get_async_client', return_value=client):
+            response = await RequestProfilerMiddleware(get_response)(request)
+        self.assertEqual(response.status_code, 200)
+        out = io.StringIO()
+        await sync_to_async(call_command)('request_profiles', path='get_otp', limit=500, stdout=out)
+        self.assertIn('asend_otp', out.getvalue())
+
+
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @contextlib.contextmanager
+    def assertQueriesByPath(self, expected):
+        """Assert the number of queries sent in the block under each code path."""
+        with track_queries() as tracker:
+            yield tracker
+        self.assertEqual(dict(tracker.paths), expected, tracker.summary())
+
+    def _validate(self, payload):
+        response = mock.Mock()
+        response.json.return_value = {'data': payload}
+        client = mock.Mock()
+        client.profile.return_value = response
+        with mock.patch('profiling.views.get_valid_token', return_value='token'), \
+                mock.patch('profiling.views.get_client', return_value=client):
+            response = self.client.get(f"/otp/validate_otp/{payload['uniqueIdentifier']}/123456/")
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    # 'store' is store_profile's transaction: a SAVEPOINT and RELEASE inside
+    # the test's own transaction
+    def test_private_person_queries(self):
+        with self.assertQueriesByPath({'store': 2, 'store/profile': 4, 'store/holdings': 2, 'store/search': 1,
+                                       'store/changes': 2}):
+            self._validate(private_person_payload())
+        # An unchanged payload is recognised without opening a transaction
+        with self.assertQueriesByPath({'store/profile': 1}):
+            self._validate(private_person_payload())
+
+    def test_legal_person_queries_do_not_grow_with_shareholders(self):
+        for size in (1, 10):
+            Profile.objects.all().delete()
+            shareholders = [(f'{i:03}', 'علی', 'Member') for i in range(size)]
+            with self.assertQueriesByPath({'store': 2, 'store/profile': 4, 'store/shareholders': 1, 'store/search': 1,
+                                           'store/changes': 2}):
+                self._validate(legal_person_payload(shareholders))
+
+    @override_settings(SEJAM_QUERY_BUDGET_STRICT=True)
+    def test_endpoints_stay_within_their_budgets(self):
+        self._validate(legal_person_payload([(f'{i:03}', 'علی', 'Member') for i in range(10)]))
+        self.client.force_login(User.objects.create_user('admin', is_staff=True))
+        self.assertEqual(self.client.get('/otp/profiles/10100000001/').status_code, 200)
+        self.assertEqual(self.client.get('/otp/search/', {'q': 'علی'}).status_code, 200)
+
+    def test_only_profiling_views_are_tracked(self):
+        self.assertFalse(hasattr(self.client.get('/admin/login/').wsgi_request, 'query_budget'))
+        response = self._validate(private_person_payload())
+        self.assertEqual(response.wsgi_request.query_budget[0], 'validate_otp')
+
+    @override_settings(SEJAM_QUERY_BUDGETS={'profile': 0})
+    async def test_runs_natively_under_asgi(self):
+        async def get_response(request):
+            return None
+
+        self.assertTrue(iscoroutinefunction(QueryBudgetMiddleware(get_response)))
+
+        await sync_to_async(save_profile)(legal_person_payload([]))
+        client = AsyncClient()
+        await client.aforce_login(await User.objects.acreate(username='admin', is_staff=True))
+        # The view's queries run on a worker thread's connection and are still counted
+        with self.assertLogs('profiling.query_budget', 'WARNING') as logs:
+            response = await client.get('/otp/profiles/10100000001/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('over its budget of 0', logs.output[0])
+
+    def _use_async_views(self):
+        def reload_urls():
+            # The project URLconf holds the resolver built from the old module
+            importlib.reload(otp_urls)
+            importlib.reload(project_urls)
+            clear_url_caches()
+
+        with override_settings(SEJAM_ASYNC_VIEWS=True):
+            reload_urls()
+        self.addCleanup(reload_urls)
+
+    @override_settings(SEJAM_QUERY_BUDGETS={'validate_otp': 2})
+    async def test_async_views_share_the_budgets(self):
+        await sync_to_async(self._use_async_views)()
+        client = mock.Mock()
+        client.profile = mock.AsyncMock(return_value=SejamResponse(
+            200, json.dumps({'data': private_person_payload()}), 'http://sejam.test'
+        ))
+        with mock.patch('profiling.async_views.aget_valid_token', mock.AsyncMock(return_value='token')), \
+                mock.patch('profiling.async_views.get_async_client', return_value=client), \
+                self.assertLogs('profiling.query_budget', 'WARNING') as logs:
+            response = await AsyncClient().get('/otp/validate_otp/0012345678/123456/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIs(response.asgi_request.resolver_match.func.view_class, AsyncValidateOTPView)
+        self.assertIn('over its budget of 2', logs.output[0])
+
+    def test_request_over_budget_is_reported(self):
+        before = query_budget_exceeded.value('validate_otp')
+        with override_settings(SEJAM_QUERY_BUDGETS={'validate_otp': 2}):
+            with self.assertLogs('profiling.query_budget', 'WARNING') as logs:
+                self._validate(private_person_payload())
+            self.assertIn('store/holdings=2', logs.output[0])
+            self.assertEqual(query_budget_exceeded.value('validate_otp'), before + 1)
+            with override_settings(SEJAM_QUERY_BUDGET_STRICT=True), self.assertRaises(QueryBudgetExceeded):
+                self._validate(legal_person_payload([('001', 'علی', 'Ceo')]))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        for i in range(5):
+            Profile.objects.create(
+                unique_identifier=f'00{i}', person_type='IranianPrivatePerson',
+                mobile='0912', first_name=f'نام {i}',
+            )
+        legal = Profile.objects.create(unique_identifier='101', person_type='IranianLegalPerson', mobile='0912')
+        Shareholder.objects.create(profile=legal, unique_identifier='001', first_name='a', last_name='b', position='c')
+
+    def test_keyset_pages_cover_every_row_once(self):
+        rows = [json.loads(line) for line in export('profiles', 'ndjson', batch_size=2)]
+        self.assertEqual(sorted(row['unique_identifier'] for row in rows), ['000', '001', '002', '003', '004', '101'])
+
+    def test_person_type_filter(self):
+        rows = list(csv.DictReader(export('profiles', 'csv', person_type='IranianLegalPerson')))
+        self.assertEqual([row['unique_identifier'] for row in rows], ['101'])
+
+    def test_updated_range_filter(self):
+        future = timezone.now() + datetime.timedelta(days=1)
+        self.assertEqual(list(export('profiles', 'ndjson', updated_from=future)), [])
+
+    def test_command_exports_shareholders(self):
+        out = io.StringIO()
+        call_command('export_profiles', kind='shareholders', format='csv', stdout=out)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual([(row['profile_id'], row['unique_identifier']) for row in rows], [('101', '001')])
+
+    def test_endpoint_requires_staff(self):
+        self.assertEqual(APIClient().get('/otp/export/').status_code, 403)
+
+    def test_endpoint_streams_export(self):
+        client = APIClient()
+        client.force_authenticate(User(username='ops', is_staff=True))
+        response = client.get('/otp/export/', {'output': 'ndjson', 'person_type': 'IranianPrivatePerson'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+
+
+class ImportProfilesTests(TestCase):
+    def _dump(self, documents):
+        handle, path = tempfile.mkstemp(suffix='.ndjson')
+        with os.fdopen(handle, 'w', encoding='utf-8') as dump:
+            for document in documents:
+                dump.write(json.dumps(document, ensure_ascii=False) + '\n')
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_imports_payloads_in_batches(self):
+        legal = legal_person_payload([('001', 'علی', 'Ceo'), ('002', 'مریم', 'Member')])
+        private = dict(legal_person_payload([]), uniqueIdentifier='0012345678', type='IranianPrivatePerson',
+                       privatePerson={'firstName': 'سارا'})
+        path = self._dump([{'id': '0912', 'data': legal}, private])
+        call_command('import_profiles', path, batch_size=1, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Profile.objects.get(pk='0012345678').first_name, 'سارا')
+        self.assertEqual(Shareholder.objects.filter(profile_id=legal['uniqueIdentifier']).count(), 2)
+
+        # Re-importing the same dump writes nothing; a changed payload is updated
+        legal['mobile'] = '09121111111'
+        path = self._dump([legal, private])
+        out = io.StringIO()
+        call_command('import_profiles', path, stdout=out, stderr=io.StringIO())
+        self.assertIn('0 created, 1 updated, 1 unchanged', out.getvalue())
+        self.assertEqual(Profile.objects.get(pk=legal['uniqueIdentifier']).mobile, '09121111111')
+
+    def test_payloads_without_identifier_are_skipped(self):
+        path = self._dump([{'type': 'IranianPrivatePerson'}, dict(legal_person_payload([]), uniqueIdentifier=7),
+                           legal_person_payload([])])
+        out = io.StringIO()
+        with self.assertLogs('profiling.importer', 'ERROR'):
+            call_command('import_profiles', path, stdout=out, stderr=io.StringIO())
+        self.assertIn('2 failed', out.getvalue())
+        self.assertEqual(list(Profile.objects.values_list('pk', flat=True)), ['10100000001'])
+
+    def test_resumes_from_offset(self):
+        path = self._dump([
+            dict(legal_person_payload([]), uniqueIdentifier=str(i)) for i in range(3)
+        ])
+        call_command('import_profiles', path, offset=2, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(list(Profile.objects.values_list('pk', flat=True)), ['2'])
+
+
+class ErrorSinkTests(TestCase):
+    def setUp(self):
+        self.sink = ErrorSink(flush_interval=3600, window=60, max_pending=2)
+
+    def test_identical_errors_are_counted_once_per_window(self):
+        for _ in range(3):
+            self.sink.record('503 Service Unavailable')
+        self.sink.record('timeout')
+        with self.assertNumQueries(5):  # savepoint, insert, one increment per error, release
+            self.assertEqual(self.sink.flush(), 2)
+        self.assertEqual(
+            dict(ErrorLog.objects.values_list('error_data', 'count')),
+            {'503 Service Unavailable': 3, 'timeout': 1},
+        )
+
+        # A later flush in the same window adds to the existing row
+        self.sink.record('503 Service Unavailable')
+        self.sink.flush()
+        self.assertEqual(ErrorLog.objects.get(error_data='503 Service Unavailable').count, 4)
+
+    def test_flushes_of_other_workers_add_to_the_same_row(self):
+        other = ErrorSink(flush_interval=3600, window=60, max_pending=2)
+        with mock.patch('profiling.error_sink.time.time', return_value=1200.0):
+            self.sink.record('503 Service Unavailable')
+            other.record('503 Service Unavailable')
+            other.record('503 Service Unavailable')
+        self.sink.flush()
+        other.flush()
+        self.assertEqual(list(ErrorLog.objects.values_list('count', flat=True)), [3])
+
+    def test_buffer_is_bounded(self):
+        for i in range(3):
+            self.sink.record(f'error {i}')
+        self.assertEqual(self.sink.dropped, 1)
+        self.assertEqual(self.sink.flush(), 2)
+
+    def test_purge_deletes_old_rows(self):
+        ErrorLog.objects.create(error_data='old')
+        ErrorLog.objects.create(error_data='new')
+        ErrorLog.objects.filter(error_data='old').update(timestamp=timezone.now() - datetime.timedelta(days=31))
+        call_command('purge_error_logs', days=30, batch_size=1, stdout=io.StringIO())
+        self.assertEqual(list(ErrorLog.objects.values_list('error_data', flat=True)), ['new'])
+
+
+class MetricsTests(TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = Registry()
+        histogram = Histogram('test_seconds', 'Test.', ['stage'], buckets=(0.1, 1.0), registry=registry)
+        Counter('test_total', 'Test.', registry=registry).inc()
+        histogram.observe(0.05, 'store')
+        histogram.observe(0.5, 'store')
+        output = registry.render()
+        self.assertIn('test_seconds_bucket{stage="store",pid="%d",le="0.1"} 1' % os.getpid(), output)
+        self.assertIn('test_seconds_bucket{stage="store",pid="%d",le="+Inf"} 2' % os.getpid(), output)
+        self.assertIn('test_seconds_count{stage="store",pid="%d"} 2' % os.getpid(), output)
+        self.assertIn('test_total{pid="%d"} 1' % os.getpid(), output)
+
+    def test_client_records_upstream_status(self):
+        client = SejamClient(base_url='http://sejam.test', retries=0)
+        before = upstream_responses.value('kycOtp', '503')
+        with mock.patch.object(requests.Session, 'request', return_value=mock.Mock(status_code=503)):
+            client.request_otp('token', '0012345678')
+        self.assertEqual(upstream_responses.value('kycOtp', '503'), before + 1)
+
+    @override_settings(SEJAM_METRICS_TOKEN='secret')
+    def test_endpoint_requires_token_when_configured(self):
+        self.assertEqual(self.client.get('/otp/metrics/').status_code, 401)
+        response = self.client.get('/otp/metrics/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE sejam_stage_seconds histogram', response.content)
+
+
+class UpstreamGuardTests(TestCase):
+    def _guard(self, **limiter):
+        breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, window=30, slow_call=1,
+                                 open_seconds=10, half_open_calls=2)
+        limiter = AdaptiveLimiter(**dict({'min_limit': 1, 'max_limit': 10, 'latency_target': 0.5}, **limiter))
+        return UpstreamGuard(breaker, limiter)
+
+    def _call(self, guard, elapsed=0.01, failed=False):
+        guard.acquire()
+        guard.release(elapsed, failed)
+
+    def test_breaker_opens_on_failures_and_recovers_after_probes(self):
+        guard = self._guard()
+        with mock.patch('profiling.upstream_guard.time.monotonic', return_value=100.0) as now:
+            self._call(guard)
+            self._call(guard, failed=True)
+            self._call(guard, elapsed=2)  # slow calls count as failures
+            self._call(guard)
+            self.assertEqual(guard.breaker.state, 'open')
+            with self.assertRaises(UpstreamUnavailable) as raised:
+                guard.acquire()
+            self.assertEqual((raised.exception.reason, raised.exception.retry_after), ('open', 10))
+
+            now.return_value = 111.0
+            self._call(guard)
+            self.assertEqual(guard.breaker.state, 'half_open')
+            self._call(guard)
+            self.assertEqual(guard.breaker.state, 'closed')
+
+    def test_failed_probe_reopens(self):
+        guard = self._guard()
+        with mock.patch('profiling.upstream_guard.time.monotonic', return_value=100.0) as now:
+            for _ in range(4):
+                self._call(guard, failed=True)
+            now.return_value = 111.0
+            self._call(guard, failed=True)
+            self.assertEqual(guard.breaker.state, 'open')
+
+    def test_limit_shrinks_when_slow_and_rejects_excess_calls(self):
+        guard = self._guard(max_limit=2)
+        guard.acquire()
+        guard.release(1.0, False)
+        self.assertEqual(int(guard.limiter.limit), 1)
+        guard.acquire()
+        with self.assertRaises(UpstreamUnavailable) as raised:
+            guard.acquire()
+        self.assertEqual(raised.exception.reason, 'limit')
+
+    def test_view_returns_503_while_unavailable(self):
+        with mock.patch('profiling.views.request_otp', side_effect=UpstreamUnavailable('open', 7)):
+            response = APIClient().get('/otp/get_otp/0012345678/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+
+
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _allow(self, now, sh_id='0012345678', ip='10.0.0.1'):
+        throttle = OTPIdentifierThrottle()
+        throttle.rate = '3/10m'
+        throttle.num_requests, throttle.duration = throttle.parse_rate(throttle.rate)
+        throttle.timer = lambda: now
+        request = RequestFactory().get('/', REMOTE_ADDR=ip)
+        view = mock.Mock(kwargs={'sh_id': sh_id})
+        return throttle.allow_request(request, view), throttle.wait()
+
+    def test_parse_rate_accepts_period_multiples(self):
+        throttle = OTPIdentifierThrottle()
+        self.assertEqual(throttle.parse_rate('3/10m'), (3, 600))
+        self.assertEqual(throttle.parse_rate('100/day'), (100, 86400))
+
+    def test_limit_applies_per_identifier_across_clients(self):
+        for ip in ('10.0.0.1', '10.0.0.2', '10.0.0.3'):
+            self.assertTrue(self._allow(6000, ip=ip)[0])
+        allowed, wait = self._allow(6000, ip='10.0.0.4')
+        self.assertFalse(allowed)
+        self.assertEqual(wait, 600)
+        self.assertTrue(self._allow(6000, sh_id='0087654321')[0])
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        for _ in range(3):
+            self._allow(6599)
+        # Halfway through the next window the old requests count as 1.5
+        self.assertTrue(self._allow(6900)[0])
+        allowed, wait = self._allow(6900)
+        self.assertFalse(allowed)
+        # One more fits once the old requests count as 1
+        self.assertEqual(wait, 100)
+
+    def test_get_otp_view_is_limited_per_identifier(self):
+        with mock.patch('profiling.views.request_otp', return_value={'id': '0012345678', 'status': 200}):
+            statuses = [APIClient().get('/otp/get_otp/0012345678/').status_code for _ in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+
+
+class OTPCoalescerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.coalescer = OTPCoalescer(window=30, wait_timeout=5)
+
+    def test_concurrent_duplicates_share_one_send(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_send():
+            started.set()
+            release.wait()
+            return {'id': '1', 'status': 200}
+
+        send = mock.Mock(side_effect=slow_send)
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            leader = pool.submit(self.coalescer.run, '1', send)
+            started.wait()
+            followers = [pool.submit(self.coalescer.run, '1', send) for _ in range(2)]
+            release.set()
+            results = [leader.result()] + [f.result() for f in followers]
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual([r['coalesced'] for r in results], [False, True, True])
+
+    def test_duplicate_sends_itself_when_leader_is_too_slow(self):
+        self.coalescer.wait_timeout = 0.05
+        started = threading.Event()
+        release = threading.Event()
+
+        def send():
+            if not started.is_set():
+                started.set()
+                release.wait()
+            return {'id': '1', 'status': 200}
+
+        with ThreadPoolExecutor(max_workers=2) as pool, \
+                self.assertLogs('profiling.otp_coalescer', 'WARNING'):
+            leader = pool.submit(self.coalescer.run, '1', send)
+            started.wait()
+            follower = self.coalescer.run('1', send)
+            release.set()
+            leader.result()
+        self.assertEqual(follower, {'id': '1', 'status': 200, 'coalesced': False})
+
+    async def test_async_duplicate_sends_itself_when_leader_is_too_slow(self):
+        self.coalescer.wait_timeout = 0.05
+        release = asyncio.Event()
+        calls = []
+
+        async def send():
+            calls.append(1)
+            if len(calls) == 1:
+                await release.wait()
+            return {'id': '1', 'status': 200}
+
+        with self.assertLogs('profiling.otp_coalescer', 'WARNING'):
+            leader = asyncio.ensure_future(self.coalescer.arun('1', send))
+            await asyncio.sleep(0)
+            follower = await self.coalescer.arun('1', send)
+            release.set()
+            await leader
+        self.assertEqual((follower['coalesced'], len(calls)), (False, 2))
+
+    def test_success_is_reused_within_window(self):
+        send = mock.Mock(return_value={'id': '1', 'status': 200})
+        self.assertFalse(self.coalescer.run('1', send)['coalesced'])
+        self.assertTrue(self.coalescer.run('1', send)['coalesced'])
+        self.assertFalse(self.coalescer.run('2', send)['coalesced'])
+        self.assertEqual(send.call_count, 2)
+
+    def test_failures_are_not_reused(self):
+        send = mock.Mock(return_value={'id': '1', 'status': 500, 'error': 'Connection error'})
+        self.coalescer.run('1', send)
+        self.coalescer.run('1', send)
+        self.assertEqual(send.call_count, 2)
+
+    async def test_async_duplicates_share_one_send(self):
+        calls = []
+
+        async def send():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'id': '1', 'status': 200}
+
+        results = await asyncio.gather(*(self.coalescer.arun('1', send) for _ in range(3)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(r['coalesced'] for r in results), [False, True, True])
@@ -0,0 +1,125 @@
+"""
+Sliding-window rate limits backed by a shared Django cache.
+
+DRF's ``SimpleRateThrottle`` keeps a list of every request timestamp in the
+window and rewrites the whole list on each request, in whatever cache is
+the default. The throttles here approximate a sliding window with two
+fixed-window counters (the current and the previous window, the latter
+weighted by how much of it still overlaps the sliding window), so each
+identity costs two integers in the cache and each check is one
+``get_many`` and one ``incr`` regardless of the rate.
+
+Counters live in ``SEJAM_THROTTLE_CACHE_ALIAS``. Point it at a shared
+backend with atomic increments (Redis or Memcached) so every worker
+enforces the same limit.
+"""
+
+import math
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    Base class for sliding-window counter throttles.
+
+    Subclasses set ``scope`` and implement ``get_cache_key``. Rates use the
+    DRF format (``100/day``) and may give a multiple of the period, e.g.
+    ``3/10m`` for three requests per ten minutes.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.SEJAM_THROTTLE_CACHE_ALIAS]
+
+    def parse_rate(self, rate):
+        if rate is None:
+            return (None, None)
+        num, period = rate.split('/')
+        multiplier, unit = re.fullmatch(r'(\d*)([a-z]+)', period.strip()).groups()
+        return (int(num), int(multiplier or 1) * PERIODS[unit[0]])
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        current_key = f'{self.key}:{window}'
+        previous_key = f'{self.key}:{window - 1}'
+
+        counts = self.cache.get_many([current_key, previous_key])
+        previous = counts.get(previous_key, 0)
+        overlap = 1 - (self.now % self.duration) / self.duration
+        if previous * overlap + counts.get(current_key, 0) >= self.num_requests:
+            return self._deny(previous, counts.get(current_key, 0), overlap)
+
+        # Increment atomically and re-check, so concurrent requests from
+        # other workers cannot all slip in under the limit together.
+        current = self._incr(current_key)
+        if previous * overlap + current > self.num_requests:
+            self.cache.decr(current_key)
+            return self._deny(previous, current - 1, overlap)
+        return True
+
+    def _incr(self, key):
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Kept for two windows: it is the "previous" counter in the next one
+            if self.cache.add(key, 1, self.duration * 2):
+                return 1
+            return self.cache.incr(key)
+
+    def _deny(self, previous, current, overlap):
+        self._wait = self._wait_for(previous, current, overlap)
+        return False
+
+    def _wait_for(self, previous, current, overlap):
+        remaining = overlap * self.duration
+        if current >= self.num_requests or not previous:
+            # Only the start of the next window frees capacity
+            return remaining
+        # The previous window's weight must fall until one more request fits:
+        # previous * (overlap - t / duration) + current <= num_requests - 1
+        needed = overlap - (self.num_requests - 1 - current) / previous
+        return max(min(needed * self.duration, remaining), 0)
+
+    def wait(self):
+        # Rounded first so float noise does not add a second
+        return math.ceil(round(getattr(self, '_wait', 0), 6)) or None
+
+
+class AnonSlidingWindowThrottle(SlidingWindowThrottle):
+    """Limit unauthenticated requests per client IP (``anon`` rate)."""
+    scope = 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return f'throttle:{self.scope}:{self.get_ident(request)}'
+
+
+class OTPIdentifierThrottle(SlidingWindowThrottle):
+    """
+    Limit OTP sends per identifier (``otp_identifier`` rate), whoever asks.
+
+    Stops repeated SMS to one person even when the requests come from many
+    addresses.
+    """
+    scope = 'otp_identifier'
+
+    def get_cache_key(self, request, view):
+        sh_id = view.kwargs.get('sh_id')
+        if not sh_id:
+            return None
+        return f'throttle:{self.scope}:{str(sh_id).strip()}'
@@ -0,0 +1,333 @@
+"""
+Access token caching for the Sejam API.
+
+Tokens are looked up in three tiers: a process-local copy, a copy in the
+shared Django cache (visible to every worker when a shared backend such as
+Redis, Memcached or the file cache is configured), and finally the
+``AccessToken`` table. Refreshes are single-flight: one caller holds the
+refresh lock while the others either keep using the still-valid token or
+wait for the new one to be published.
+
+With ``SEJAM_TOKEN_BACKGROUND_REFRESH`` on, each worker also runs a
+refresher thread that renews the token ``SEJAM_TOKEN_REFRESH_AHEAD``
+seconds before it expires, well before requests would consider it stale,
+so request handlers do not wait on ``/accessToken`` in steady state. The
+``refresh_access_token --loop`` management command does the same from a
+separate process.
+
+The refresh lock is released with a compare-and-delete so a holder whose
+lock expired cannot delete the next holder's. Django's cache API has no
+such operation, so by default the lock is read and deleted only if it
+still holds our owner token, which leaves a small race between the two
+calls. Set ``SEJAM_TOKEN_LOCK_REDIS_URL`` to the Redis server behind the
+token cache to close it: the release then runs as one Lua script there
+(this needs the ``redis`` package).
+"""
+
+import logging
+import os
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+from . import metrics
+from .models import AccessToken
+
+logger = logging.getLogger(__name__)
+
+# Deletes the lock only if it still holds the caller's owner token
+RELEASE_LOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+_lock_clients = {}
+_lock_clients_lock = threading.Lock()
+
+
+def lock_client(url):
+    """Return a Redis client for ``url``, shared by the whole process."""
+    if url not in _lock_clients:
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("SEJAM_TOKEN_LOCK_REDIS_URL requires the redis package") from None
+        with _lock_clients_lock:
+            if url not in _lock_clients:
+                _lock_clients[url] = redis.Redis.from_url(url)
+    return _lock_clients[url]
+
+
+@dataclass(frozen=True)
+class CachedToken:
+    """An access token together with its expiry as a UNIX timestamp."""
+    token: str
+    expires_at: float
+
+    @classmethod
+    def from_model(cls, instance):
+        return cls(token=instance.token, expires_at=instance.token_end_time.timestamp())
+
+    def is_fresh(self, margin, now=None):
+        """Return True if the token is valid for at least ``margin`` more seconds."""
+        return self.expires_at - margin > (now if now is not None else time.time())
+
+    def is_alive(self, now=None):
+        return self.is_fresh(0, now)
+
+
+class TokenCache:
+    """
+    Tiered, single-flight cache around a token refresh function.
+
+    Args:
+        refresh (callable): Fetches a new token and returns an ``AccessToken``
+        cache_alias (str): Django cache used for the cross-process copy
+        key (str): Cache key for the shared copy
+        margin (int): Seconds before expiry at which a token counts as stale
+        lock_timeout (int): Seconds a refresh may hold the shared lock
+        lock_redis_url (str): Redis server holding ``cache_alias``'s keys,
+            used to release the lock atomically; empty to use the cache API
+        refresh_ahead (int): Seconds before expiry at which the background
+            refresher renews the token; at least ``margin``
+    """
+
+    # Upper bound on how long the refresher sleeps, so it notices tokens
+    # renewed or deleted elsewhere; and its pause after a failed refresh.
+    max_sleep = 60
+    retry_interval = 10
+
+    def __init__(self, refresh, cache_alias=None, key='sejam:access_token',
+                 margin=None, lock_timeout=None, refresh_ahead=None, lock_redis_url=None):
+        self.refresh = refresh
+        self.cache_alias = cache_alias or settings.SEJAM_TOKEN_CACHE_ALIAS
+        self.key = key
+        self.lock_key = f'{key}:lock'
+        self.margin = settings.SEJAM_TOKEN_REFRESH_MARGIN if margin is None else margin
+        self.lock_timeout = settings.SEJAM_TOKEN_LOCK_TIMEOUT if lock_timeout is None else lock_timeout
+        self.lock_redis_url = settings.SEJAM_TOKEN_LOCK_REDIS_URL if lock_redis_url is None else lock_redis_url
+        refresh_ahead = settings.SEJAM_TOKEN_REFRESH_AHEAD if refresh_ahead is None else refresh_ahead
+        self.refresh_ahead = max(refresh_ahead, self.margin)
+        self._local = None
+        self._thread_lock = threading.Lock()
+        self._refresher = None
+        self._refresher_pid = None
+        self._refresher_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias]
+
+    def get(self):
+        """
+        Return a usable access token string, refreshing it if necessary.
+
+        Returns:
+            str: Valid access token
+        """
+        self._ensure_refresher()
+        entry = self._local
+        if entry is not None and entry.is_fresh(self.margin):
+            metrics.token_lookups.inc('local')
+            return entry.token
+
+        tier = 'shared'
+        entry = self._read_shared()
+        if entry is None:
+            tier = 'db'
+            entry = self._read_db()
+        if entry is not None and entry.is_fresh(self.margin):
+            metrics.token_lookups.inc(tier)
+            self._local = entry
+            return entry.token
+
+        metrics.token_lookups.inc('refresh')
+        stale = entry if entry is not None and entry.is_alive() else None
+        return self._refresh(stale)
+
+    async def aget(self):
+        """
+        Async counterpart of ``get`` for the ASGI views.
+
+        A fresh process-local token is returned without leaving the event
+        loop; anything else runs ``get`` in a worker thread.
+
+        Returns:
+            str: Valid access token
+        """
+        self._ensure_refresher()
+        entry = self._local
+        if entry is not None and entry.is_fresh(self.margin):
+            metrics.token_lookups.inc('local')
+            return entry.token
+        return await sync_to_async(self.get)()
+
+    def store(self, instance):
+        """Publish a freshly generated ``AccessToken`` to both cache tiers."""
+        entry = CachedToken.from_model(instance)
+        metrics.token_refreshes.inc()
+        self._local = entry
+        timeout = max(int(entry.expires_at - time.time()), 1)
+        self.shared.set(self.key, (entry.token, entry.expires_at), timeout)
+        return entry
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after the API rejects it."""
+        self._local = None
+        self.shared.delete(self.key)
+
+    def _read_shared(self):
+        value = self.shared.get(self.key)
+        if value is None:
+            return None
+        return CachedToken(*value)
+
+    def _read_db(self):
+        try:
+            instance = AccessToken.objects.latest('created_at')
+        except AccessToken.DoesNotExist:
+            return None
+        entry = CachedToken.from_model(instance)
+        if entry.is_alive():
+            self.shared.set(self.key, (entry.token, entry.expires_at),
+                            max(int(entry.expires_at - time.time()), 1))
+        return entry
+
+    def _refresh(self, stale, margin=None):
+        # With a stale-but-alive token in hand there is no reason to queue
+        # behind another thread's refresh; only block when we have nothing.
+        margin = self.margin if margin is None else margin
+        if stale is not None:
+            if not self._thread_lock.acquire(blocking=False):
+                return stale.token
+        elif not self._thread_lock.acquire(timeout=self.lock_timeout):
+            raise TimeoutError("Timed out waiting for access token refresh")
+
+        try:
+            entry = self._local
+            if entry is not None and entry.is_fresh(margin):
+                return entry.token
+
+            # Django's Redis backends store an int as-is rather than
+            # pickled, so the release script can compare it with ARGV
+            owner = secrets.randbits(62)
+            # Long enough for the lock of a holder that died to expire
+            deadline = time.monotonic() + 2 * self.lock_timeout
+            while not self.shared.add(self.lock_key, owner, self.lock_timeout):
+                if stale is not None:
+                    return stale.token
+                entry = self._wait_for_shared(deadline)
+                if entry is not None:
+                    self._local = entry
+                    return entry.token
+                if time.monotonic() >= deadline:
+                    raise TimeoutError("Timed out waiting for access token refresh")
+                # The holder let go without publishing a token; take the
+                # lock ourselves rather than refresh alongside others
+                logger.warning("Token refresh lock holder did not publish a token, retrying")
+
+            try:
+                # Another process may have refreshed between our miss and
+                # taking the lock; the DB is the source of truth for that.
+                entry = self._read_db()
+                if entry is not None and entry.is_fresh(margin):
+                    self._local = entry
+                    return entry.token
+                logger.info("Access token missing or expiring, generating new one")
+                return self.store(self.refresh()).token
+            finally:
+                self._release_lock(owner)
+        finally:
+            self._thread_lock.release()
+
+    def _release_lock(self, owner):
+        """Delete the shared refresh lock if ``owner`` still holds it."""
+        shared = self.shared
+        if self.lock_redis_url:
+            key = shared.make_and_validate_key(self.lock_key)
+            lock_client(self.lock_redis_url).eval(RELEASE_LOCK_SCRIPT, 1, key, owner)
+        elif shared.get(self.lock_key) == owner:
+            # Without Redis there is no compare-and-delete; the lock can only
+            # be lost in the moment between this read and the delete
+            shared.delete(self.lock_key)
+
+    def _wait_for_shared(self, deadline, interval=0.05):
+        """
+        Wait until another caller publishes a fresh token.
+
+        Returns None if the lock is released without one, or at ``deadline``.
+        """
+        while time.monotonic() < deadline:
+            entry = self._read_shared()
+            if entry is not None and entry.is_fresh(self.margin):
+                return entry
+            if self.shared.get(self.lock_key) is None:
+                entry = self._read_db()
+                if entry is not None and entry.is_fresh(self.margin):
+                    return entry
+                return None
+            time.sleep(interval)
+        return None
+
+    def refresh_if_due(self):
+        """
+        Renew the token if it expires within ``refresh_ahead`` seconds.
+
+        Safe to call from every worker at once: only one of them fetches a
+        new token, the others pick it up from the shared cache or database.
+
+        Returns:
+            float: Seconds until the token is next due for renewal
+        """
+        entry = self._read_shared() or self._local or self._read_db()
+        if entry is not None and entry.is_fresh(self.refresh_ahead):
+            self._local = entry
+            return entry.expires_at - self.refresh_ahead - time.time()
+
+        stale = entry if entry is not None and entry.is_alive() else None
+        self._refresh(stale, margin=self.refresh_ahead)
+        entry = self._local
+        if entry is None or not entry.is_fresh(self.refresh_ahead):
+            # Another worker holds the refresh lock, or the API issued a
+            # token shorter-lived than refresh_ahead; look again shortly.
+            return self.retry_interval
+        return entry.expires_at - self.refresh_ahead - time.time()
+
+    def run_refresher(self, stop=None):
+        """
+        Keep the token renewed until ``stop`` is set.
+
+        Args:
+            stop (threading.Event): Ends the loop when set; defaults to ``self``'s
+        """
+        stop = stop or self._stop
+        while not stop.is_set():
+            try:
+                delay = min(self.refresh_if_due(), self.max_sleep)
+            except Exception:
+                logger.exception("Background access token refresh failed")
+                delay = self.retry_interval
+            finally:
+                # Do not hold a database connection open while sleeping
+                connection.close()
+            stop.wait(max(delay, 0))
+
+    def _ensure_refresher(self):
+        # Threads do not survive fork, so each worker starts its own
+        if self._refresher_pid == os.getpid() or not settings.SEJAM_TOKEN_BACKGROUND_REFRESH:
+            return
+        with self._refresher_lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+            self._refresher = threading.Thread(target=self.run_refresher, name='token-refresher', daemon=True)
+            self._refresher.start()
+
+    def stop_refresher(self):
+        """Stop the background refresher thread, if running."""
+        self._stop.set()
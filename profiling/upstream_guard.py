@@ -0,0 +1,215 @@
+"""
+Protection against a slow or failing Sejam API.
+
+``UpstreamGuard`` wraps every upstream call made by the Sejam clients with
+two mechanisms:
+
+* a circuit breaker that opens when too many recent calls failed or were
+  slow, rejects calls while open, and lets a few probe calls through
+  (half-open) once ``open_seconds`` have passed;
+* an adaptive concurrency limit (additive increase, multiplicative
+  decrease) on calls in flight, which shrinks when latency rises above the
+  target or calls fail and grows back while the upstream is healthy.
+
+Rejected calls raise ``UpstreamUnavailable`` immediately instead of
+queueing behind a struggling upstream, so workers stay free and the views
+can answer with a 503. State is kept per process.
+"""
+
+import collections
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised instead of calling the Sejam API when it is considered unavailable.
+
+    Attributes:
+        reason (str): ``open`` (circuit breaker) or ``limit`` (too many calls in flight)
+        retry_after (int): Suggested seconds before trying again
+    """
+
+    def __init__(self, reason, retry_after):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"Sejam API unavailable ({reason}), retry after {retry_after}s")
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker over a sliding time window.
+
+    Args:
+        failure_rate (float): Share of failed or slow calls that opens the circuit
+        min_calls (int): Calls needed in the window before the rate is considered
+        window (float): Seconds of history used for the failure rate
+        slow_call (float): Calls taking longer than this many seconds count as failures
+        open_seconds (float): Seconds to reject calls before probing
+        half_open_calls (int): Successful probes needed to close the circuit
+    """
+
+    def __init__(self, failure_rate=None, min_calls=None, window=None, slow_call=None,
+                 open_seconds=None, half_open_calls=None):
+        self.failure_rate = failure_rate or settings.SEJAM_BREAKER_FAILURE_RATE
+        self.min_calls = min_calls or settings.SEJAM_BREAKER_MIN_CALLS
+        self.window = window or settings.SEJAM_BREAKER_WINDOW
+        self.slow_call = slow_call or settings.SEJAM_BREAKER_SLOW_CALL
+        self.open_seconds = open_seconds or settings.SEJAM_BREAKER_OPEN_SECONDS
+        self.half_open_calls = half_open_calls or settings.SEJAM_BREAKER_HALF_OPEN_CALLS
+        self.state = CLOSED
+        self._calls = collections.deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+
+    def allow(self, now):
+        """Return None if a call may proceed, else the seconds until it may."""
+        if self.state == OPEN:
+            remaining = self._opened_at + self.open_seconds - now
+            if remaining > 0:
+                return remaining
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                return self.open_seconds
+            self._probes += 1
+        return None
+
+    def record(self, now, elapsed, failed):
+        """Record the outcome of a call allowed by ``allow``."""
+        failed = failed or elapsed > self.slow_call
+        if self.state == HALF_OPEN:
+            # May also be a call that started before the circuit opened
+            self._probes = max(self._probes - 1, 0)
+            if failed:
+                self._open(now)
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._transition(CLOSED)
+            return
+        if self.state == OPEN:
+            # A call that started before the circuit opened
+            return
+
+        self._calls.append((now, failed))
+        self._failures += failed
+        cutoff = now - self.window
+        while self._calls and self._calls[0][0] < cutoff:
+            self._failures -= self._calls.popleft()[1]
+        if len(self._calls) >= self.min_calls and self._failures / len(self._calls) >= self.failure_rate:
+            self._open(now)
+
+    def _open(self, now):
+        self._opened_at = now
+        self._transition(OPEN)
+
+    def _transition(self, state):
+        logger.warning(f"Sejam circuit breaker {self.state} -> {state}")
+        self.state = state
+        self._calls.clear()
+        self._failures = 0
+        self._probes = 0
+        self._probe_successes = 0
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on the number of upstream calls in flight.
+
+    Args:
+        min_limit (int): Lowest the limit may shrink to
+        max_limit (int): Highest the limit may grow to
+        latency_target (float): Calls slower than this many seconds shrink the limit
+        backoff_ratio (float): Factor applied to the limit on each decrease
+    """
+
+    def __init__(self, min_limit=None, max_limit=None, latency_target=None, backoff_ratio=0.9):
+        self.min_limit = min_limit or settings.SEJAM_UPSTREAM_MIN_CONCURRENCY
+        self.max_limit = max_limit or settings.SEJAM_UPSTREAM_MAX_CONCURRENCY
+        self.latency_target = latency_target or settings.SEJAM_UPSTREAM_LATENCY_TARGET
+        self.backoff_ratio = backoff_ratio
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+
+    @property
+    def full(self):
+        return self.in_flight >= int(self.limit)
+
+    def acquire(self):
+        """Take a slot; check ``full`` first."""
+        self.in_flight += 1
+
+    def release(self, now, elapsed, failed):
+        """Give back a slot and adjust the limit from the call's outcome."""
+        self.in_flight -= 1
+        if failed or elapsed > self.latency_target:
+            # Calls in flight together see the same incident; shrink once per
+            # target interval rather than once per call.
+            if now - self._last_decrease >= self.latency_target:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class UpstreamGuard:
+    """
+    Circuit breaker and concurrency limit applied together to each upstream call.
+
+    Usage from a client::
+
+        guard.acquire()          # may raise UpstreamUnavailable
+        started = time.perf_counter()
+        ...                      # make the call
+        guard.release(time.perf_counter() - started, failed)
+    """
+
+    def __init__(self, breaker=None, limiter=None):
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or AdaptiveLimiter()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Reserve permission for one upstream call.
+
+        Raises:
+            UpstreamUnavailable: If the circuit is open or the limit is reached
+        """
+        with self._lock:
+            if self.limiter.full:
+                reason, wait = 'limit', 1
+            else:
+                wait = self.breaker.allow(time.monotonic())
+                if wait is None:
+                    self.limiter.acquire()
+                    return
+                reason = 'open'
+        metrics.upstream_rejections.inc(reason)
+        raise UpstreamUnavailable(reason, max(math.ceil(wait), 1))
+
+    def release(self, elapsed, failed):
+        """Record the outcome of a call reserved with ``acquire``."""
+        now = time.monotonic()
+        with self._lock:
+            self.limiter.release(now, elapsed, failed)
+            self.breaker.record(now, elapsed, failed)
+
+
+upstream_guard = UpstreamGuard()
@@ -1,7 +1,27 @@
+from django.conf import settings
 from django.urls import path
-from .views import GetOTPView, ValidateOTPView
 
+from .views import ChangesView, ExportView, LookupView, ProfileView, SearchView, metrics_view
+
+if settings.SEJAM_ASYNC_VIEWS:
+    from .async_views import (
+        AsyncBatchOTPView as BatchOTPView,
+        AsyncGetOTPView as GetOTPView,
+        AsyncValidateOTPView as ValidateOTPView,
+    )
+else:
+    from .views import BatchOTPView, GetOTPView, ValidateOTPView
+
+# The names key SEJAM_QUERY_BUDGETS and the per-endpoint query metrics,
+# whichever of the sync and async views serves the endpoint
 urlpatterns = [
-    path('get_otp/<str:sh_id>/', GetOTPView.as_view()),
-    path('validate_otp/<str:sh_id>/<str:otpCode>/', ValidateOTPView.as_view()),
-]
\ No newline at end of file
+    path('get_otp/<str:sh_id>/', GetOTPView.as_view(), name='get_otp'),
+    path('batch_otp/', BatchOTPView.as_view(), name='batch_otp'),
+    path('validate_otp/<str:sh_id>/<str:otpCode>/', ValidateOTPView.as_view(), name='validate_otp'),
+    path('profiles/<str:sh_id>/', ProfileView.as_view(), name='profile'),
+    path('lookup/<str:kind>/<str:value>/', LookupView.as_view(), name='lookup'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('export/', ExportView.as_view(), name='export'),
+    path('changes/', ChangesView.as_view(), name='changes'),
+    path('metrics/', metrics_view, name='metrics'),
+]
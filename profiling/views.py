@@ -6,19 +6,36 @@ including requesting OTPs and validating them to retrieve user profiles.
 """
 
 import json
+import hashlib
 import logging
 import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pytz
 import requests
 
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.conf import settings
+from django.db import IntegrityError, connection, transaction
 from rest_framework.views import APIView
-from rest_framework.throttling import AnonRateThrottle
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
 
-from .models import AccessToken, Profile, Shareholder, ErrorLog
+from .changes import CHANGES_LIMIT, MAX_CHANGES_LIMIT, get_changes, mark_changed
+from .exports import CONTENT_TYPES, EXPORT_FORMATS, EXPORT_KINDS, export, parse_timestamp
+from .error_sink import record_error
+from .mapping import build_response, map_accounts, map_profile, map_trading_codes
+from .metrics import REGISTRY, stage_seconds
+from .models import AccessToken, Account, Profile, Shareholder, TradingCode
+from .otp_coalescer import OTPCoalescer
+from .profile_queue import enqueue as enqueue_profile
+from .query_budget import code_path
+from .search import SEARCH_LIMIT, index_profiles, search_profiles
+from .sejam_client import get_client
+from .throttling import AnonSlidingWindowThrottle, OTPIdentifierThrottle
+from .token_cache import TokenCache
+from .upstream_guard import UpstreamUnavailable
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -33,20 +50,9 @@ def generate_access_token():
         AccessToken: The new access token object
     """
     current_datetime = datetime.datetime.now(iran_tz)
-    url = f"{settings.SEJAM_API_BASE_URL}/accessToken"
-    
-    headers = {
-        "accept": "application/json",
-        "Content-Type": "application/json-patch+json"
-    }
-    
-    data = {
-        "username": settings.SEJAM_API_USERNAME,
-        "password": settings.SEJAM_API_PASSWORD
-    }
     
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
+        response = get_client().access_token()
         response.raise_for_status()  # Raise an exception for HTTP errors
         response_data = response.json()
         
@@ -62,79 +68,515 @@ def generate_access_token():
         ttl_time = ttl_time.astimezone(iran_tz)
         
         # Delete old tokens and save new one
-        AccessToken.objects.all().delete()
-        token = AccessToken.objects.create(
-            token=response_data['data']['accessToken'],
-            token_end_time=ttl_time
-        )
+        with transaction.atomic():
+            AccessToken.objects.all().delete()
+            token = AccessToken.objects.create(
+                token=response_data['data']['accessToken'],
+                token_end_time=ttl_time
+            )
         
         return token
         
     except requests.exceptions.RequestException as e:
         logger.error(f"Error generating access token: {str(e)}")
-        ErrorLog.objects.create(error_data=str(e))
+        record_error(str(e))
         raise
 
 
+token_cache = TokenCache(generate_access_token)
+
+
 def get_valid_token():
     """
     Get a valid access token. If no valid token exists, generate a new one.
+
+    The token is served from the process-local or shared cache when possible;
+    see ``profiling.token_cache`` for the lookup and refresh rules.
     
     Returns:
         str: Valid access token
     """
-    try:
-        # Try to get the latest token
-        token = AccessToken.objects.latest('created_at')
+    return token_cache.get()
+
+
+async def aget_valid_token():
+    """
+    Async counterpart of ``get_valid_token``.
+    
+    Returns:
+        str: Valid access token
+    """
+    return await token_cache.aget()
+
+
+otp_coalescer = OTPCoalescer()
+
+
+def request_otp(sh_id, token=None):
+    """
+    Request an OTP from the Sejam API for a given identifier.
+    
+    Duplicate requests for the same identifier, concurrent or within
+    ``SEJAM_OTP_COALESCE_WINDOW`` seconds of a successful send, share one
+    Sejam call; see ``profiling.otp_coalescer``.
+    
+    Args:
+        sh_id (str): The unique identifier for the user
+        token (str): Access token to use; looked up if not given
         
-        # Check if token is expired
-        if token.token_end_time < datetime.datetime.now(iran_tz):
-            logger.info("Access token expired, generating new one")
-            token = generate_access_token()
-            
-    except AccessToken.DoesNotExist:
-        logger.info("No access token found, generating new one")
-        token = generate_access_token()
+    Returns:
+        dict: Response data with status information and ``coalesced``
         
-    return token.token
+    Raises:
+        UpstreamUnavailable: If the Sejam API is not being called right now
+    """
+    return otp_coalescer.run(sh_id, lambda: send_otp(sh_id, token))
 
 
-def request_otp(sh_id):
+def send_otp(sh_id, token=None):
     """
-    Request an OTP from the Sejam API for a given identifier.
+    Call Sejam's ``/kycOtp`` for an identifier, without coalescing.
     
     Args:
         sh_id (str): The unique identifier for the user
+        token (str): Access token to use; looked up if not given
         
     Returns:
         dict: Response data with status information
     """
-    token = get_valid_token()
-    
-    url = f"{settings.SEJAM_API_BASE_URL}/kycOtp"
-    data = {"uniqueIdentifier": sh_id}
-    headers = {
-        "accept": "application/json",
-        "Content-Type": "application/json-patch+json",
-        "Authorization": f"bearer {token}"
-    }
+    if token is None:
+        with stage_seconds.time('otp', 'token'):
+            token = get_valid_token()
     
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
+        with stage_seconds.time('otp', 'upstream'):
+            response = get_client().request_otp(token, sh_id)
         response.raise_for_status()
         return {'id': sh_id, 'status': response.status_code}
         
     except requests.exceptions.HTTPError as e:
         logger.error(f"HTTP error requesting OTP: {str(e)}")
-        ErrorLog.objects.create(error_data=response.text if 'response' in locals() else str(e))
+        record_error(response.text if 'response' in locals() else str(e))
         return {'id': sh_id, 'status': e.response.status_code if hasattr(e, 'response') else 500, 'error': str(e)}
         
     except requests.exceptions.RequestException as e:
         logger.error(f"Error requesting OTP: {str(e)}")
-        ErrorLog.objects.create(error_data=str(e))
+        record_error(str(e))
         return {'id': sh_id, 'status': 500, 'error': 'Connection error'}
 
 
+def parse_batch_ids(data):
+    """
+    Validate the body of a batch OTP request.
+    
+    Args:
+        data (dict): Parsed request body with ``ids`` and optional ``concurrency``
+        
+    Returns:
+        tuple: (ids, concurrency, error) where ``error`` is None on success
+    """
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not ids:
+        return None, None, "'ids' must be a non-empty list"
+    if len(ids) > settings.SEJAM_BATCH_OTP_MAX_IDS:
+        return None, None, f"at most {settings.SEJAM_BATCH_OTP_MAX_IDS} ids per batch"
+    if not all(isinstance(sh_id, (str, int)) for sh_id in ids):
+        return None, None, "'ids' must contain strings"
+    
+    max_concurrency = settings.SEJAM_BATCH_OTP_CONCURRENCY
+    concurrency = data.get('concurrency', max_concurrency)
+    if not isinstance(concurrency, int) or concurrency < 1:
+        return None, None, "'concurrency' must be a positive integer"
+    
+    # Each id is sent once, in the order given
+    ids = list(dict.fromkeys(str(sh_id).strip() for sh_id in ids))
+    return ids, min(concurrency, max_concurrency), None
+
+
+def dispatch_otps(ids, concurrency, token):
+    """
+    Request OTPs for many identifiers, at most ``concurrency`` at a time.
+    
+    The whole batch shares one access token and the pooled Sejam client.
+    The token is fetched by the caller before the response starts, so a
+    failure to get one is still reported with an error status.
+    
+    Args:
+        ids (list): Unique identifiers to send OTPs to
+        concurrency (int): Maximum number of upstream calls in flight
+        token (str): Access token used for every call
+        
+    Yields:
+        dict: ``request_otp`` results in completion order
+    """
+    def send(sh_id):
+        try:
+            return request_otp(sh_id, token=token)
+        except UpstreamUnavailable as e:
+            return {'id': sh_id, 'status': 503, 'error': str(e)}
+        except Exception as e:
+            logger.error(f"Error requesting OTP for {sh_id}: {str(e)}")
+            return {'id': sh_id, 'status': 500, 'error': 'Something went wrong'}
+        finally:
+            connection.close()
+    
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = [executor.submit(send, sh_id) for sh_id in ids]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Stop sending if the client goes away mid-stream
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def ndjson_lines(results):
+    """Encode dicts as newline-delimited JSON."""
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + '\n'
+
+
+def is_invalid_otp(response):
+    """
+    Check whether an error response from Sejam reports an invalid OTP.
+    
+    Args:
+        response: A ``requests.Response`` or ``SejamResponse``
+        
+    Returns:
+        bool: True if Sejam rejected the OTP
+    """
+    if response.status_code != 400:
+        return False
+    try:
+        error_data = response.json()
+    except ValueError:
+        return False
+    return 'error' in error_data and error_data['error'].get('customMessage') == 'invalid otp'
+
+
+SHAREHOLDER_FIELDS = ['first_name', 'last_name', 'position']
+ACCOUNT_FIELDS = ['account_number', 'bank_name', 'branch_code', 'branch_name', 'branch_city']
+
+# Child rows of a profile: (identifying field, fields updated in place)
+RELATED_ROWS = {
+    Shareholder: ('unique_identifier', SHAREHOLDER_FIELDS),
+    Account: ('sheba', ACCOUNT_FIELDS),
+    TradingCode: ('code', []),
+}
+
+
+def sync_shareholders(profile, shareholders, created=False):
+    """
+    Make the stored shareholders of a profile match the given ones.
+    
+    The new list is diffed against the existing rows by unique identifier and
+    applied with at most one bulk INSERT, one bulk UPDATE and one DELETE, in a
+    single transaction. Unchanged shareholders cause no writes.
+    
+    Args:
+        profile (Profile): The legal person the shareholders belong to
+        shareholders (list): Unsaved ``Shareholder`` instances
+        created (bool): True if the profile is new, so has no rows to diff against
+        
+    Returns:
+        tuple: Number of shareholders (created, updated, deleted)
+    """
+    return sync_many_shareholders([(profile, shareholders, created)])
+
+
+def sync_many_shareholders(entries):
+    """
+    Batch form of ``sync_shareholders`` for several profiles at once.
+    
+    Args:
+        entries (list): ``(profile, shareholders, created)`` tuples
+        
+    Returns:
+        tuple: Number of shareholders (created, updated, deleted)
+    """
+    return sync_many_related(Shareholder, entries)
+
+
+def sync_many_related(model, entries):
+    """
+    Make the stored child rows of several profiles match the given ones.
+    
+    Existing rows for all profiles are read in one query, diffed by the
+    model's identifying field (see ``RELATED_ROWS``), and the combined diff
+    is applied with one bulk INSERT, one bulk UPDATE and one DELETE.
+    
+    Args:
+        model: ``Shareholder``, ``Account`` or ``TradingCode``
+        entries (list): ``(profile, rows, created)`` tuples, where ``rows``
+            are unsaved instances of ``model``
+        
+    Returns:
+        tuple: Number of rows (created, updated, deleted)
+    """
+    key, fields = RELATED_ROWS[model]
+    to_create = []
+    to_update = []
+    to_delete = []
+    
+    # Inside a caller's transaction (store_profile, the importer) this joins
+    # it rather than costing a SAVEPOINT and RELEASE round trip
+    with transaction.atomic(savepoint=False):
+        existing_ids = [profile.pk for profile, _, created in entries if not created]
+        existing = {}
+        if existing_ids:
+            for row in model.objects.filter(profile_id__in=existing_ids):
+                existing.setdefault(row.profile_id, {})[getattr(row, key)] = row
+        
+        for profile, rows, created in entries:
+            current_rows = existing.pop(profile.pk, {})
+            # Later duplicates win, matching the unique (profile, key) pair
+            desired = {getattr(row, key): row for row in rows}
+            for identifier, row in desired.items():
+                current = current_rows.pop(identifier, None)
+                if current is None:
+                    row.profile = profile
+                    to_create.append(row)
+                elif any(getattr(current, f) != getattr(row, f) for f in fields):
+                    for field in fields:
+                        setattr(current, field, getattr(row, field))
+                    to_update.append(current)
+            to_delete.extend(row.pk for row in current_rows.values())
+        
+        if to_delete:
+            model.objects.filter(pk__in=to_delete).delete()
+        if to_create:
+            model.objects.bulk_create(to_create)
+        if to_update:
+            model.objects.bulk_update(to_update, fields)
+    
+    return len(to_create), len(to_update), len(to_delete)
+
+
+def map_holdings(profile_data):
+    """Map a payload's accounts and trading codes, as ``sync_holdings`` takes them."""
+    return map_accounts(profile_data), map_trading_codes(profile_data)
+
+
+def sync_holdings(entries):
+    """
+    Sync the accounts and trading codes of several profiles.
+    
+    Args:
+        entries (list): ``(profile, holdings, created)`` tuples, with
+            ``holdings`` as returned by ``map_holdings``
+    """
+    sync_many_related(Account, [(profile, accounts, created) for profile, (accounts, _), created in entries])
+    sync_many_related(TradingCode, [(profile, codes, created) for profile, (_, codes), created in entries])
+
+
+def payload_hash(profile_data):
+    """
+    Hash a Sejam profile payload in a key-order independent way.
+    
+    Args:
+        profile_data (dict): The ``data`` object of a Sejam profiles response
+        
+    Returns:
+        str: Hex SHA-256 digest of the canonical JSON encoding
+    """
+    canonical = json.dumps(profile_data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def apply_profile_fields(profile, fields):
+    """
+    Set mapped fields on a stored profile, returning the names that changed.
+    
+    ``raw_data`` is always treated as changed: callers only get here when
+    the payload hash differs, and the profile is loaded without it.
+    """
+    changed = [
+        name for name, value in fields.items()
+        if name == 'raw_data' or getattr(profile, name) != value
+    ]
+    for name in changed:
+        setattr(profile, name, fields[name])
+    return changed
+
+
+def store_profile(profile_data):
+    """
+    Write a Sejam profile payload to the database with as few writes as possible.
+    
+    A payload whose hash matches the stored ``payload_hash`` causes no writes
+    at all, and is recognised before a transaction is opened, so repeat
+    fetches do not wait for the database write lock. Otherwise only the fields that differ are written, together with
+    the rebuilt ``response_data`` document, in a single UPDATE, and
+    shareholders, accounts, trading codes and search terms are synced by diff.
+    
+    Args:
+        profile_data (dict): The ``data`` object of a Sejam profiles response
+        
+    Returns:
+        Profile: The stored profile
+    """
+    digest = payload_hash(profile_data)
+    unique_identifier = profile_data['uniqueIdentifier']
+    
+    with code_path('profile'):
+        # raw_data is only needed when it changed, and then the hash says so
+        profile = Profile.objects.defer('raw_data').filter(pk=unique_identifier).first()
+    if profile is not None and profile.payload_hash == digest:
+        return profile
+    
+    with transaction.atomic():
+        with code_path('profile'):
+            if profile is not None:
+                # Read again under the write lock, in case another request
+                # stored the profile since
+                profile = Profile.objects.defer('raw_data').select_for_update().get(pk=unique_identifier)
+                if profile.payload_hash == digest:
+                    return profile
+        
+            fields, shareholders = map_profile(profile_data)
+            holdings = map_holdings(profile_data)
+            fields['payload_hash'] = digest
+            created = profile is None
+        
+            if created:
+                profile = Profile(unique_identifier=unique_identifier, **fields)
+                profile.response_data = build_response(profile, shareholders)
+                try:
+                    with transaction.atomic():
+                        profile.save(force_insert=True)
+                except IntegrityError:
+                    # Lost a race with a concurrent insert of the same profile
+                    created = False
+                    profile = Profile.objects.defer('raw_data').get(pk=unique_identifier)
+        
+            if not created:
+                changed = apply_profile_fields(profile, fields)
+                profile.response_data = build_response(profile, shareholders)
+                profile.save(update_fields=changed + ['response_data', 'updated_at'])
+        
+        if shareholders is not None:
+            with code_path('shareholders'):
+                sync_shareholders(profile, shareholders, created=created)
+        with code_path('holdings'):
+            sync_holdings([(profile, holdings, created)])
+        with code_path('search'):
+            index_profiles([(profile, shareholders, created)])
+        with code_path('changes'):
+            mark_changed(Profile, [profile.pk])
+    
+    return profile
+
+
+def profile_document(profile):
+    """
+    Return a stored profile's response document.
+    
+    Profiles written before documents were stored get theirs built from
+    the model (one extra query for shareholders) and saved.
+    
+    Args:
+        profile (Profile): A stored profile
+        
+    Returns:
+        dict: Structured profile data
+    """
+    if profile.response_data is None:
+        shareholders = None
+        if profile.person_type != 'IranianPrivatePerson':
+            shareholders = list(profile.shareholders.order_by('pk'))
+        profile.response_data = build_response(profile, shareholders)
+        Profile.objects.filter(pk=profile.pk).update(response_data=profile.response_data)
+    return profile.response_data
+
+
+def get_profile_document(unique_identifier):
+    """
+    Look up the response document of a stored profile.
+    
+    Args:
+        unique_identifier (str): The profile's identifier
+        
+    Returns:
+        dict: Structured profile data, or None if there is no such profile
+    """
+    profile = Profile.objects.only(
+        'unique_identifier', 'person_type', 'response_data'
+    ).filter(pk=unique_identifier).first()
+    if profile is None:
+        return None
+    if profile.response_data is None:
+        # Older row: the document is built from the full model once
+        profile = Profile.objects.defer('raw_data').get(pk=unique_identifier)
+    return profile_document(profile)
+
+
+# Reverse lookups: URL kind -> Profile filter, each backed by an index
+LOOKUPS = {
+    'sheba': 'accounts__sheba',
+    'trade_code': 'trading_codes__code',
+    'mobile': 'mobile',
+}
+LOOKUP_LIMIT = 100
+
+
+def find_profiles(kind, value, limit=LOOKUP_LIMIT):
+    """
+    Find the profiles that own a sheba, trade code or mobile number.
+    
+    Args:
+        kind (str): One of ``LOOKUPS``
+        value (str): The value to look up
+        limit (int): Largest number of profiles returned
+        
+    Returns:
+        list: ``{'uniqueIdentifier', 'type'}`` dicts ordered by identifier
+    """
+    rows = Profile.objects.filter(**{LOOKUPS[kind]: value.strip()}).order_by('pk').values_list(
+        'unique_identifier', 'person_type'
+    )[:limit]
+    return [{'uniqueIdentifier': unique_identifier, 'type': person_type} for unique_identifier, person_type in rows]
+
+
+def save_profile(profile_data):
+    """
+    Store a Sejam profile payload and return the API response for it.
+    
+    The response document is built during mapping and stored with the
+    profile, so no further queries are needed to return it.
+    
+    Args:
+        profile_data (dict): The ``data`` object of a Sejam profiles response
+        
+    Returns:
+        dict: Structured profile data
+    """
+    return profile_document(store_profile(profile_data))
+
+
+def persist_profile(profile_data):
+    """
+    Store or queue a Sejam profile payload per ``SEJAM_PROFILE_WRITE_MODE``.
+    
+    In ``queue`` mode the response is built from the mapped payload and the
+    writes are left to the persistence queue, so the caller waits for one
+    upsert instead of the profile and child table writes.
+    
+    Args:
+        profile_data (dict): The ``data`` object of a Sejam profiles response
+        
+    Returns:
+        dict: Structured profile data
+    """
+    if settings.SEJAM_PROFILE_WRITE_MODE != 'queue':
+        return save_profile(profile_data)
+    fields, shareholders = map_profile(profile_data)
+    profile = Profile(unique_identifier=profile_data['uniqueIdentifier'], **fields)
+    document = build_response(profile, shareholders)
+    enqueue_profile(profile_data)
+    return document
+
+
 def get_profile(sh_id, otp_code):
     """
     Validate OTP and retrieve user profile from Sejam API.
@@ -145,188 +587,63 @@ def get_profile(sh_id, otp_code):
         
     Returns:
         dict: Structured profile data or error information
+        
+    Raises:
+        UpstreamUnavailable: If the Sejam API is not being called right now
     """
-    token = get_valid_token()
-    
-    base_url = f"{settings.SEJAM_API_BASE_URL}/servicesWithOtp/profiles/{sh_id}"
-    url = f"{base_url}?otp={otp_code}"
-    
-    headers = {
-        "accept": "application/json",
-        "Content-Type": "application/json-patch+json",
-        "Authorization": f"bearer {token}"
-    }
+    with stage_seconds.time('profile', 'token'), code_path('token'):
+        token = get_valid_token()
     
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        res = response.json()
+        with stage_seconds.time('profile', 'upstream'):
+            response = get_client().profile(token, sh_id, otp_code)
+            response.raise_for_status()
+            profile_data = response.json()['data']
+        logger.debug(f"Profile data retrieved for {sh_id}")
         
-        # Store raw data
-        profile_data = res['data']
-        print("Profile data retrieved successfully")
-        print("Profile data retrieved successfully")
-        print("Profile data retrieved successfully")
-        
-        try:
-            print(f"Profile data retrieved: {profile_data}")
-        except Exception as e:
-            logger.error(f"Error printing profile data: {str(e)}")
-        # Validate profile data structure
-        # Try to get existing profile or create new one
-        profile, created = Profile.objects.update_or_create(
-            unique_identifier=profile_data['uniqueIdentifier'],
-            defaults={
-                'person_type': profile_data['type'],
-                'mobile': profile_data['mobile'],
-                'email': profile_data.get('email', ''),
-                'raw_data': profile_data
-            }
-        )
-        
-        # Helper function to safely strip strings
-        def safe_strip(value):
-            return str(value).strip() if value is not None else ''
-        
-        # Process person-specific data
-        if profile_data['type'] == 'IranianPrivatePerson':
-            person_data = profile_data['privatePerson']
-            profile.first_name = safe_strip(person_data.get('firstName'))
-            profile.last_name = safe_strip(person_data.get('lastName'))
-            profile.father_name = safe_strip(person_data.get('fatherName'))
-            profile.gender = safe_strip(person_data.get('gender'))
-            profile.birth_date = safe_strip(person_data.get('birthDate'))
-            profile.place_of_birth = safe_strip(person_data.get('placeOfBirth'))
-            profile.place_of_issue = safe_strip(person_data.get('placeOfIssue'))
-            
-        elif profile_data['type'] == 'IranianLegalPerson':
-            legal_data = profile_data['legalPerson']
-            profile.company_name = safe_strip(legal_data.get('companyName'))
-            profile.economic_code = safe_strip(legal_data.get('economicCode'))
-            profile.register_date = safe_strip(legal_data.get('registerDate'))
-            profile.register_place = safe_strip(legal_data.get('registerPlace'))
-            profile.register_number = safe_strip(legal_data.get('registerNumber'))
-            
-            # Process shareholders
-            persian_positions = {
-                'Chairman': 'رئیس هیئت مدیره',
-                'Ceo': 'مدیرعامل',
-                'Member': 'عضو هیئت مدیره',
-                'DeputyChairman': 'نایب رئیس هیئت مدیره'
-            }
-            
-            # Clear existing shareholders and add new ones
-            profile.shareholders.all().delete()
-            for shareholder in profile_data.get('legalPersonShareholders', []):
-                position = shareholder.get('positionType', '')
-                persian_position = persian_positions.get(position, position)
-                
-                Shareholder.objects.create(
-                    profile=profile,
-                    unique_identifier=safe_strip(shareholder.get('uniqueIdentifier')),
-                    first_name=safe_strip(shareholder.get('firstName')),
-                    last_name=safe_strip(shareholder.get('lastName')),
-                    position=persian_position
-                )
-        
-        # Bank information - with safe field access
-        if profile_data.get('tradingCodes') and len(profile_data['tradingCodes']) > 0:
-            profile.trade_code = safe_strip(profile_data['tradingCodes'][0].get('code'))
-            
-        if profile_data.get('accounts') and len(profile_data['accounts']) > 0:
-            account = profile_data['accounts'][0]
-            profile.sheba = safe_strip(account.get('sheba'))
-            profile.bank_account_number = safe_strip(account.get('accountNumber'))
-            profile.bank_branch_code = safe_strip(account.get('branchCode'))
-            profile.bank_branch_name = safe_strip(account.get('branchName'))
-            
-            # Safe access to bank name
-            if account.get('bank') and account['bank']:
-                profile.bank_name = safe_strip(account['bank'].get('name'))
-                
-            # Safe access to branch city - this is where the error was occurring
-            if account.get('branchCity') and account['branchCity']:
-                profile.bank_branch_city = safe_strip(account['branchCity'].get('name'))
-        
-        profile.save()
-        
-        # Format response
-        if profile.person_type == 'IranianPrivatePerson':
-            return {
-                'uniqueIdentifier': profile.unique_identifier,
-                'type': profile.person_type,
-                'firstName': profile.first_name,
-                'lastName': profile.last_name,
-                'fatherName': profile.father_name,
-                'gender': profile.gender,
-                'birthDate': profile.birth_date,
-                'placeOfBirth': profile.place_of_birth,
-                'placeOfIssue': profile.place_of_issue,
-                'mobile': profile.mobile,
-                'email': profile.email or '',
-                'tradeCode': profile.trade_code or '',
-                'sheba': profile.sheba or '',
-                'bank_name': profile.bank_name or '',
-                'bank_branchCode': profile.bank_branch_code or '',
-                'bank_branchName': profile.bank_branch_name or '',
-                'bank_branchCity': profile.bank_branch_city or '',
-                'bank_accountNumber': profile.bank_account_number or '',
-            }
-        else:
-            # Process shareholders for response
-            shareholders = {}
-            for sh in profile.shareholders.all():
-                shareholders[sh.unique_identifier] = {
-                    'Name': sh.first_name,
-                    'LastName': sh.last_name,
-                    'position': sh.position
-                }
-                
-            return {
-                'uniqueIdentifier': profile.unique_identifier,
-                'type': profile.person_type,
-                'companyName': profile.company_name,
-                'economicCode': profile.economic_code,
-                'registerDate': profile.register_date,
-                'registerPlace': profile.register_place,
-                'registerNumber': profile.register_number,
-                'shareHolders': shareholders,
-                'mobile': profile.mobile,
-                'email': profile.email or '',
-                'tradeCode': profile.trade_code or '',
-                'sheba': profile.sheba or '',
-                'bank_name': profile.bank_name or '',
-                'bank_branchCode': profile.bank_branch_code or '',
-                'bank_branchName': profile.bank_branch_name or '',
-                'bank_branchCity': profile.bank_branch_city or '',
-                'bank_accountNumber': profile.bank_account_number or '',
-            }
+        with stage_seconds.time('profile', 'store'), code_path('store'):
+            return persist_profile(profile_data)
             
     except requests.exceptions.HTTPError as e:
         logger.error(f"HTTP error retrieving profile: {str(e)}")
-        ErrorLog.objects.create(error_data=response.text if 'response' in locals() else str(e))
+        record_error(response.text if 'response' in locals() else str(e))
         
         # Check for invalid OTP error
-        if hasattr(e, 'response') and e.response.status_code == 400:
-            try:
-                error_data = e.response.json()
-                if 'error' in error_data and error_data['error'].get('customMessage') == 'invalid otp':
-                    return {'error': 'invalid OTP'}
-            except ValueError:
-                pass
+        if hasattr(e, 'response') and is_invalid_otp(e.response):
+            return {'error': 'invalid OTP'}
                 
         return {'error': 'Error retrieving profile data'}
         
+    except UpstreamUnavailable:
+        raise
+        
     except Exception as e:
         logger.error(f"Error retrieving profile: {str(e)}")
-        ErrorLog.objects.create(error_data=str(e))
+        record_error(str(e))
         return {'error': 'Something went wrong'}
     
     
     
+def unavailable_response(error):
+    """
+    Build the 503 returned while the Sejam API is considered unavailable.
+    
+    Args:
+        error (UpstreamUnavailable): The rejection raised by the Sejam client
+        
+    Returns:
+        Response: 503 response with a ``Retry-After`` header
+    """
+    return Response(
+        {'error': 'Sejam service unavailable', 'retry_after': error.retry_after},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': str(error.retry_after)},
+    )
+
+
 class GetOTPView(APIView):
     """API view to request an OTP for a user."""
-    throttle_classes = [AnonRateThrottle]
+    throttle_classes = [AnonSlidingWindowThrottle, OTPIdentifierThrottle]
     
     def get(self, request, sh_id, format=None):
         """
@@ -340,13 +657,52 @@ class GetOTPView(APIView):
         Returns:
             Response: JSON response with OTP request status
         """
-        data = request_otp(str(sh_id))
+        try:
+            with stage_seconds.time('otp', 'total'):
+                data = request_otp(str(sh_id))
+        except UpstreamUnavailable as e:
+            return unavailable_response(e)
         return Response(data)
 
 
+class BatchOTPView(APIView):
+    """API view to send OTPs to many users at once."""
+    permission_classes = [IsAdminUser]
+    throttle_classes = []
+    
+    def post(self, request, format=None):
+        """
+        Send OTPs to a list of identifiers.
+        
+        Args:
+            request: The HTTP request, with a JSON body of the form
+                ``{"ids": [...], "concurrency": 10}``
+            format: The response format
+            
+        Returns:
+            StreamingHttpResponse: One NDJSON line per id, in completion order
+        """
+        ids, concurrency, error = parse_batch_ids(request.data)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            token = get_valid_token()
+        except UpstreamUnavailable as e:
+            return unavailable_response(e)
+        except Exception as e:
+            logger.error(f"Error getting access token for batch OTP: {str(e)}")
+            return Response({'error': 'Something went wrong'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return StreamingHttpResponse(
+            ndjson_lines(dispatch_otps(ids, concurrency, token)),
+            content_type='application/x-ndjson'
+        )
+
+
 class ValidateOTPView(APIView):
     """API view to validate an OTP and retrieve user profile."""
-    throttle_classes = [AnonRateThrottle]
+    throttle_classes = [AnonSlidingWindowThrottle]
     
     def get(self, request, sh_id, otpCode, format=None):
         """
@@ -361,5 +717,170 @@ class ValidateOTPView(APIView):
         Returns:
             Response: JSON response with profile data or error
         """
-        data = get_profile(str(sh_id), str(otpCode))
-        return Response(data)
\ No newline at end of file
+        try:
+            with stage_seconds.time('profile', 'total'):
+                data = get_profile(str(sh_id), str(otpCode))
+        except UpstreamUnavailable as e:
+            return unavailable_response(e)
+        return Response(data)
+
+
+class ProfileView(APIView):
+    """API view returning a stored profile for admin tools and internal services."""
+    permission_classes = [IsAdminUser]
+    throttle_classes = []
+    
+    def get(self, request, sh_id, format=None):
+        """
+        Return the stored response document for a profile.
+        
+        Args:
+            request: The HTTP request
+            sh_id: The unique identifier for the user
+            format: The response format
+            
+        Returns:
+            Response: The profile data, or 404 if it has not been stored
+        """
+        data = get_profile_document(str(sh_id))
+        if data is None:
+            return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(data)
+
+
+class LookupView(APIView):
+    """API view finding profiles by sheba, trade code or mobile number."""
+    permission_classes = [IsAdminUser]
+    throttle_classes = []
+    
+    def get(self, request, kind, value, format=None):
+        """
+        Return the profiles that own a value.
+        
+        Args:
+            request: The HTTP request
+            kind: ``sheba``, ``trade_code`` or ``mobile``
+            value: The value to look up
+            format: The response format
+            
+        Returns:
+            Response: ``{'profiles': [...]}``, at most ``LOOKUP_LIMIT`` of them
+        """
+        if kind not in LOOKUPS:
+            return Response(
+                {'error': f"kind must be one of {list(LOOKUPS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'profiles': find_profiles(kind, value)})
+
+
+class SearchView(APIView):
+    """API view searching profiles by Persian name."""
+    permission_classes = [IsAdminUser]
+    throttle_classes = []
+    
+    def get(self, request, format=None):
+        """
+        Return the profiles whose own or shareholders' names match a query.
+        
+        Query parameters:
+            q: Words of a name, in any order, possibly partial
+            limit: Largest number of results (default and maximum ``SEARCH_LIMIT``)
+            
+        Returns:
+            Response: ``{'results': [...]}``, best match first
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', SEARCH_LIMIT)), SEARCH_LIMIT)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': search_profiles(request.query_params.get('q', ''), max(limit, 0))})
+
+
+class ExportView(APIView):
+    """API view to stream profiles or shareholders as CSV or NDJSON."""
+    permission_classes = [IsAdminUser]
+    throttle_classes = []
+    
+    def get(self, request, format=None):
+        """
+        Stream an export.
+        
+        Query parameters:
+            kind: ``profiles`` (default) or ``shareholders``
+            output: ``csv`` (default) or ``ndjson``
+            person_type: Only export this person type
+            updated_from: Inclusive lower bound on ``updated_at``
+            updated_to: Exclusive upper bound on ``updated_at``
+            
+        Returns:
+            StreamingHttpResponse: The export, one row per line
+        """
+        params = request.query_params
+        kind = params.get('kind', 'profiles')
+        output = params.get('output', 'csv')
+        if kind not in EXPORT_KINDS or output not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"kind must be one of {EXPORT_KINDS} and output one of {EXPORT_FORMATS}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            filters = {
+                'person_type': params.get('person_type'),
+                'updated_from': parse_timestamp(params.get('updated_from')),
+                'updated_to': parse_timestamp(params.get('updated_to')),
+            }
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        response = StreamingHttpResponse(
+            export(kind, output, **filters), content_type=CONTENT_TYPES[output]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{output}"'
+        return response
+
+
+class ChangesView(APIView):
+    """API view paging through profile changes for incremental sync."""
+    permission_classes = [IsAdminUser]
+    throttle_classes = []
+    
+    def get(self, request, format=None):
+        """
+        Return the changes after a cursor.
+        
+        Query parameters:
+            cursor: Cursor returned by the previous call; omit to start over
+            since: Without a cursor, start at this ISO date or datetime
+            limit: Largest number of changes (default ``CHANGES_LIMIT``)
+            
+        Returns:
+            Response: ``{'changes': [...], 'cursor': ..., 'has_more': ...}``;
+                store ``cursor`` and call again, at once while ``has_more``
+        """
+        params = request.query_params
+        try:
+            limit = min(max(int(params.get('limit', CHANGES_LIMIT)), 1), MAX_CHANGES_LIMIT)
+            changes, cursor, has_more = get_changes(
+                params.get('cursor'), parse_timestamp(params.get('since')), limit
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'changes': changes, 'cursor': cursor, 'has_more': has_more})
+
+
+def metrics_view(request):
+    """
+    Expose the process's metrics in the Prometheus text format.
+    
+    When ``SEJAM_METRICS_TOKEN`` is set the request must carry it as
+    ``Authorization: Bearer <token>``.
+    
+    Returns:
+        HttpResponse: The rendered metrics
+    """
+    expected = settings.SEJAM_METRICS_TOKEN
+    if expected and request.headers.get('Authorization') != f'Bearer {expected}':
+        return HttpResponse('Unauthorized\n', status=401, content_type='text/plain')
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'profiling.query_budget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS middleware
     'django.middleware.common.CommonMiddleware',
@@ -51,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'profiling.request_profiler.RequestProfilerMiddleware',
 ]
 
 # CORS settings
@@ -84,13 +86,48 @@ WSGI_APPLICATION = 'sejam.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# DB_ENGINE takes a backend name (sqlite3, postgresql, mysql) or a full
+# dotted path. SQLite allows one writer at a time, so use PostgreSQL (with
+# psycopg installed) when several workers write profiles concurrently.
+
+DB_ENGINE = config('DB_ENGINE', default='sqlite3')
+if '.' not in DB_ENGINE:
+    DB_ENGINE = f'django.db.backends.{DB_ENGINE}'
+
+if DB_ENGINE == 'django.db.backends.sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'OPTIONS': {
+                # Seconds a writer waits for the lock instead of failing
+                # with "database is locked"
+                'timeout': config('DB_BUSY_TIMEOUT', default=20, cast=int),
+                # Take the write lock at BEGIN, so transactions that read
+                # then write queue up rather than fail on lock upgrade
+                'transaction_mode': 'IMMEDIATE',
+                # WAL lets readers run alongside the writer
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': config('DB_NAME', default='sejam'),
+            'USER': config('DB_USER', default=''),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default=''),
+            'PORT': config('DB_PORT', default=''),
+            # Keep connections open between requests instead of
+            # reconnecting each time; checked before reuse
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
-}
 
 
 # Password validation
@@ -118,10 +155,12 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
     ),
     'DEFAULT_THROTTLE_CLASSES': [
-        'rest_framework.throttling.AnonRateThrottle',
+        'profiling.throttling.AnonSlidingWindowThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
-        'anon': '100/day',
+        'anon': config('SEJAM_ANON_THROTTLE_RATE', default='100/day'),
+        # OTP sends per identifier, across all clients
+        'otp_identifier': config('SEJAM_OTP_THROTTLE_RATE', default='3/10m'),
     }
 }
 
@@ -152,4 +191,109 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Sejam API settings
 SEJAM_API_USERNAME = config('SEJAM_API_USERNAME')
 SEJAM_API_PASSWORD = config('SEJAM_API_PASSWORD')
-SEJAM_API_BASE_URL = 'https://api.sejam.ir:8080/v1.1'
\ No newline at end of file
+SEJAM_API_BASE_URL = config('SEJAM_API_BASE_URL', default='https://api.sejam.ir:8080/v1.1')
+
+
+# Cache settings
+# Point CACHE_BACKEND at a shared backend (Redis, Memcached or the file cache)
+# when running several workers so they share the cached access token.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='sejam-default'),
+    }
+}
+
+# Throttle counters; use a backend with atomic incr (Redis, Memcached) so the
+# limits hold across workers
+SEJAM_THROTTLE_CACHE_ALIAS = config('SEJAM_THROTTLE_CACHE_ALIAS', default='default')
+
+# Access token cache
+SEJAM_TOKEN_CACHE_ALIAS = config('SEJAM_TOKEN_CACHE_ALIAS', default='default')
+SEJAM_TOKEN_REFRESH_MARGIN = config('SEJAM_TOKEN_REFRESH_MARGIN', default=60, cast=int)
+SEJAM_TOKEN_LOCK_TIMEOUT = config('SEJAM_TOKEN_LOCK_TIMEOUT', default=30, cast=int)
+# Redis server behind the token cache (e.g. redis://127.0.0.1:6379/0); when
+# set, the refresh lock is released atomically there (needs the redis package)
+SEJAM_TOKEN_LOCK_REDIS_URL = config('SEJAM_TOKEN_LOCK_REDIS_URL', default='')
+# Renew the token this many seconds before expiry from a background thread
+# in each worker (or run `manage.py refresh_access_token --loop` instead)
+SEJAM_TOKEN_BACKGROUND_REFRESH = config('SEJAM_TOKEN_BACKGROUND_REFRESH', default=True, cast=bool)
+SEJAM_TOKEN_REFRESH_AHEAD = config('SEJAM_TOKEN_REFRESH_AHEAD', default=300, cast=int)
+
+# Sejam HTTP client
+SEJAM_HTTP_POOL_SIZE = config('SEJAM_HTTP_POOL_SIZE', default=10, cast=int)
+SEJAM_HTTP_CONNECT_TIMEOUT = config('SEJAM_HTTP_CONNECT_TIMEOUT', default=3.05, cast=float)
+SEJAM_HTTP_READ_TIMEOUT = config('SEJAM_HTTP_READ_TIMEOUT', default=15, cast=float)
+SEJAM_HTTP_RETRIES = config('SEJAM_HTTP_RETRIES', default=2, cast=int)
+SEJAM_HTTP_BACKOFF = config('SEJAM_HTTP_BACKOFF', default=0.3, cast=float)
+SEJAM_HTTP_ASYNC_MAX_CONNECTIONS = config('SEJAM_HTTP_ASYNC_MAX_CONNECTIONS', default=200, cast=int)
+
+# Serve the OTP endpoints from the async views in profiling.async_views.
+# Enable this for ASGI deployments; WSGI deployments keep the sync views.
+SEJAM_ASYNC_VIEWS = config('SEJAM_ASYNC_VIEWS', default=False, cast=bool)
+
+# Duplicate OTP requests for one identifier share a single Sejam call; a
+# successful send is reused for this many seconds (0: only while in flight)
+SEJAM_OTP_COALESCE_WINDOW = config('SEJAM_OTP_COALESCE_WINDOW', default=30, cast=int)
+SEJAM_OTP_CACHE_ALIAS = config('SEJAM_OTP_CACHE_ALIAS', default='default')
+
+# Batch OTP dispatch: maximum (and default) concurrent Sejam calls per batch,
+# and maximum number of ids per request
+SEJAM_BATCH_OTP_CONCURRENCY = config('SEJAM_BATCH_OTP_CONCURRENCY', default=10, cast=int)
+SEJAM_BATCH_OTP_MAX_IDS = config('SEJAM_BATCH_OTP_MAX_IDS', default=10000, cast=int)
+
+# Error log buffering: errors are folded per window and flushed in batches
+# from a background thread; retention applies to the purge_error_logs command
+SEJAM_ERROR_LOG_BUFFERED = config('SEJAM_ERROR_LOG_BUFFERED', default=True, cast=bool)
+SEJAM_ERROR_LOG_FLUSH_INTERVAL = config('SEJAM_ERROR_LOG_FLUSH_INTERVAL', default=5, cast=float)
+SEJAM_ERROR_LOG_WINDOW = config('SEJAM_ERROR_LOG_WINDOW', default=60, cast=int)
+SEJAM_ERROR_LOG_MAX_PENDING = config('SEJAM_ERROR_LOG_MAX_PENDING', default=10000, cast=int)
+SEJAM_ERROR_LOG_RETENTION_DAYS = config('SEJAM_ERROR_LOG_RETENTION_DAYS', default=30, cast=int)
+
+# Metrics endpoint; when a token is set, scrapers must send it as a Bearer token
+SEJAM_METRICS_TOKEN = config('SEJAM_METRICS_TOKEN', default='')
+
+# Circuit breaker around Sejam API calls: open when at least FAILURE_RATE of
+# the calls in the last WINDOW seconds failed (5xx, transport error or slower
+# than SLOW_CALL seconds), given at least MIN_CALLS calls
+SEJAM_BREAKER_FAILURE_RATE = config('SEJAM_BREAKER_FAILURE_RATE', default=0.5, cast=float)
+SEJAM_BREAKER_MIN_CALLS = config('SEJAM_BREAKER_MIN_CALLS', default=20, cast=int)
+SEJAM_BREAKER_WINDOW = config('SEJAM_BREAKER_WINDOW', default=30, cast=float)
+SEJAM_BREAKER_SLOW_CALL = config('SEJAM_BREAKER_SLOW_CALL', default=5.0, cast=float)
+SEJAM_BREAKER_OPEN_SECONDS = config('SEJAM_BREAKER_OPEN_SECONDS', default=15, cast=float)
+SEJAM_BREAKER_HALF_OPEN_CALLS = config('SEJAM_BREAKER_HALF_OPEN_CALLS', default=3, cast=int)
+
+# Adaptive limit on Sejam API calls in flight per process
+SEJAM_UPSTREAM_MIN_CONCURRENCY = config('SEJAM_UPSTREAM_MIN_CONCURRENCY', default=4, cast=int)
+SEJAM_UPSTREAM_MAX_CONCURRENCY = config('SEJAM_UPSTREAM_MAX_CONCURRENCY', default=100, cast=int)
+SEJAM_UPSTREAM_LATENCY_TARGET = config('SEJAM_UPSTREAM_LATENCY_TARGET', default=2.0, cast=float)
+
+# Profile persistence: 'sync' writes the profile before answering a validated
+# OTP; 'queue' answers from the Sejam payload and leaves the writes to
+# drain_profile_queue workers. A claimed batch is retried by another worker
+# once its lease (seconds) expires.
+SEJAM_PROFILE_WRITE_MODE = config('SEJAM_PROFILE_WRITE_MODE', default='sync')
+SEJAM_PROFILE_QUEUE_BATCH_SIZE = config('SEJAM_PROFILE_QUEUE_BATCH_SIZE', default=500, cast=int)
+SEJAM_PROFILE_QUEUE_LEASE = config('SEJAM_PROFILE_QUEUE_LEASE', default=60, cast=int)
+# Failed writes of a payload before it is marked dead and no longer retried
+SEJAM_PROFILE_QUEUE_MAX_ATTEMPTS = config('SEJAM_PROFILE_QUEUE_MAX_ATTEMPTS', default=5, cast=int)
+
+# On-demand request profiling (profiling.request_profiler): requests carrying
+# a signed X-Sejam-Profile header, or this share of all requests, are run
+# under cProfile; captures are kept in DIR, newest MAX_FILES only
+SEJAM_REQUEST_PROFILE_SAMPLE_RATE = config('SEJAM_REQUEST_PROFILE_SAMPLE_RATE', default=0.0, cast=float)
+SEJAM_REQUEST_PROFILE_DIR = config('SEJAM_REQUEST_PROFILE_DIR', default=str(BASE_DIR / 'request_profiles'))
+SEJAM_REQUEST_PROFILE_MAX_FILES = config('SEJAM_REQUEST_PROFILE_MAX_FILES', default=200, cast=int)
+
+# SQL query budget per request (profiling.query_budget): requests to an
+# endpoint sending more queries than its budget are logged, or fail when
+# STRICT is set. Per-endpoint budgets are given as "url_name=count" pairs,
+# using the names in profiling/urls.py, so they apply to the sync and async
+# views alike.
+SEJAM_QUERY_BUDGET = config('SEJAM_QUERY_BUDGET', default=20, cast=int)
+SEJAM_QUERY_BUDGETS = config(
+    'SEJAM_QUERY_BUDGETS',
+    default='validate_otp=12,profile=4,lookup=4,search=5',
+    cast=Csv(cast=lambda pair: (pair.split('=')[0].strip(), int(pair.split('=')[1])), post_process=dict),
+)
+SEJAM_QUERY_BUDGET_STRICT = config('SEJAM_QUERY_BUDGET_STRICT', default=False, cast=bool)